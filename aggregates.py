@@ -0,0 +1,273 @@
+# aggregates.py
+"""
+Statistical aggregate and window functions for SQLite.
+
+register(conn) adds, for use in GROUP BY queries and OVER (...) windows:
+
+    variance(x), var_samp(x)   sample variance
+    var_pop(x)                 population variance
+    stddev(x), stddev_samp(x)  sample standard deviation
+    stddev_pop(x)              population standard deviation
+    median(x)                  50th percentile, interpolated
+    percentile(x, p)           p-th quantile (0 <= p <= 1), interpolated like
+                               PostgreSQL's percentile_cont(p) WITHIN GROUP (ORDER BY x)
+
+NULLs are ignored, and an empty group gives NULL (a single value gives NULL for the
+sample statistics), as in PostgreSQL.
+"""
+import math
+import sqlite3
+
+import numpy as np
+
+# Values buffered before they are folded into the running moments with NumPy
+MOMENT_BATCH_SIZE = 4096
+# Values a quantile keeps exactly; beyond this it keeps a compacted sketch whose
+# rank error stays below about log2(n / QUANTILE_EXACT_LIMIT) / QUANTILE_EXACT_LIMIT
+QUANTILE_EXACT_LIMIT = 65536
+
+
+class _Moments:
+    """
+    Running count, mean and sum of squared deviations (M2).
+
+    Values are buffered and folded in batches with NumPy using Chan's parallel update.
+    Removing a value (for sliding windows) applies Welford's update in reverse.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.buffer = []
+
+    def step(self, value):
+        if value is None:
+            return
+        self.buffer.append(value)
+        if len(self.buffer) >= MOMENT_BATCH_SIZE:
+            self._flush()
+
+    def inverse(self, value):
+        if value is None:
+            return
+        self._flush()
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        value = float(value)
+        mean = (self.count * self.mean - value) / (self.count - 1)
+        self.m2 = max(0.0, self.m2 - (value - self.mean) * (value - mean))
+        self.mean = mean
+        self.count -= 1
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        batch = np.asarray(self.buffer, dtype=np.float64)
+        self.buffer = []
+        count = len(batch)
+        mean = float(batch.mean())
+        m2 = float(((batch - mean) ** 2).sum())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def variance(self, ddof):
+        self._flush()
+        if self.count <= ddof:
+            return None
+        return self.m2 / (self.count - ddof)
+
+
+class Variance(_Moments):
+    ddof = 1
+
+    def value(self):
+        return self.variance(self.ddof)
+
+    finalize = value
+
+
+class PopulationVariance(Variance):
+    ddof = 0
+
+
+class StandardDeviation(Variance):
+    def value(self):
+        variance = self.variance(self.ddof)
+        return None if variance is None else math.sqrt(variance)
+
+    finalize = value
+
+
+class PopulationStandardDeviation(StandardDeviation):
+    ddof = 0
+
+
+class QuantileSketch:
+    """
+    Collects values for quantile queries in bounded memory.
+
+    The first QUANTILE_EXACT_LIMIT values are kept as they are, so small groups and
+    window frames give exact answers. Beyond that, full levels are sorted and every
+    other value is promoted to the next level with twice the weight (a KLL-style
+    compactor), so memory grows with log(n) instead of n.
+    """
+
+    def __init__(self, capacity=QUANTILE_EXACT_LIMIT):
+        self.capacity = capacity
+        self.buffer = []
+        # levels[i] holds sorted values that each stand for 2 ** (i + 1) inputs
+        self.levels = []
+        self.compacted = 0
+        self._offset = 0
+
+    @property
+    def count(self):
+        return self.compacted + len(self.buffer)
+
+    def add(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        """Compacts the exact buffer into the levels; called once it is full."""
+        self._compact(0, np.sort(np.asarray(self.buffer, dtype=np.float64)))
+        self.compacted += len(self.buffer)
+        self.buffer = []
+
+    def remove(self, value):
+        if self.levels:
+            raise ValueError('quantile window frames are limited to '
+                             f'{self.capacity} rows')
+        self.buffer.remove(value)
+
+    def _compact(self, level, values):
+        # Alternate between keeping odd and even positions so the rank error of
+        # successive compactions cancels out instead of accumulating in one direction
+        promoted = values[self._offset::2]
+        self._offset ^= 1
+        if level == len(self.levels):
+            self.levels.append(promoted)
+            return
+        merged = np.sort(np.concatenate([self.levels[level], promoted]), kind='mergesort')
+        if len(merged) >= self.capacity:
+            self.levels[level] = merged[:0]
+            self._compact(level + 1, merged)
+        else:
+            self.levels[level] = merged
+
+    def quantile(self, fraction):
+        """
+        Returns the continuous quantile, interpolating between neighbouring values.
+
+        :param fraction: Quantile between 0 and 1.
+        :return: The quantile, or None if no values were added.
+        """
+        if self.count == 0:
+            return None
+        values = [np.asarray(self.buffer, dtype=np.float64)]
+        weights = [np.ones(len(self.buffer))]
+        for level, level_values in enumerate(self.levels):
+            values.append(level_values)
+            weights.append(np.full(len(level_values), 2.0 ** (level + 1)))
+        values = np.concatenate(values)
+        if len(values) == len(self.buffer):
+            # Exact: every value has weight one
+            return float(np.quantile(values, fraction))
+        weights = np.concatenate(weights)
+        order = np.argsort(values, kind='mergesort')
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+        position = fraction * (ranks[-1] - 1)
+        lower, upper = math.floor(position), math.ceil(position)
+        low = values[min(np.searchsorted(ranks, lower, side='right'), len(values) - 1)]
+        high = values[min(np.searchsorted(ranks, upper, side='right'), len(values) - 1)]
+        return float(low + (position - lower) * (high - low))
+
+
+class Percentile:
+    def __init__(self):
+        self.sketch = QuantileSketch()
+        self.fraction = None
+
+    def step(self, value, fraction):
+        # step runs once per row, so the common path is kept to an append
+        if fraction != self.fraction:
+            if fraction is None or not 0.0 <= fraction <= 1.0:
+                raise ValueError('percentile fraction must be between 0 and 1')
+            self.fraction = fraction
+        if value is not None:
+            buffer = self.sketch.buffer
+            buffer.append(value)
+            if len(buffer) >= self.sketch.capacity:
+                self.sketch.flush()
+
+    def inverse(self, value, fraction):
+        if value is not None:
+            self.sketch.remove(value)
+
+    def value(self):
+        return None if self.fraction is None else self.sketch.quantile(self.fraction)
+
+    finalize = value
+
+
+class Median(Percentile):
+    def __init__(self):
+        super().__init__()
+        self.fraction = 0.5
+
+    def step(self, value):
+        if value is not None:
+            buffer = self.sketch.buffer
+            buffer.append(value)
+            if len(buffer) >= self.sketch.capacity:
+                self.sketch.flush()
+
+    def inverse(self, value):
+        if value is not None:
+            self.sketch.remove(value)
+
+
+# name -> (number of arguments, implementation)
+FUNCTIONS = {
+    'variance': (1, Variance),
+    'var_samp': (1, Variance),
+    'var_pop': (1, PopulationVariance),
+    'stddev': (1, StandardDeviation),
+    'stddev_samp': (1, StandardDeviation),
+    'stddev_pop': (1, PopulationStandardDeviation),
+    'median': (1, Median),
+    'percentile': (2, Percentile),
+}
+
+
+def register(conn):
+    """
+    Registers every function in FUNCTIONS on a connection.
+
+    They are registered as window functions where the sqlite3 module supports it
+    (Python 3.11+), which also makes them usable as plain aggregates.
+
+    :param conn: An open sqlite3.Connection.
+    """
+    window = hasattr(conn, 'create_window_function')
+    for name, (arguments, implementation) in FUNCTIONS.items():
+        if window:
+            conn.create_window_function(name, arguments, implementation)
+        else:
+            conn.create_aggregate(name, arguments, implementation)
+
+
+def connect(database, **kwargs):
+    """
+    Opens a connection with the functions registered, like sqlite3.connect.
+    """
+    conn = sqlite3.connect(database, **kwargs)
+    register(conn)
+    return conn
@@ -1,29 +1,238 @@
 # app.py
+import os
+import tempfile
+import time
+from functools import partial
 import streamlit as st
-import sqlite3
-from similarity import get_top_n_sql_queries
+import tracing
+from executor import get_executor
+from precompile import get_precompiler, report
+from similarity import get_store, get_top_n_sql_queries
+from streaming import PAGE_SIZE, paged_query, write_csv
 import pandas as pd
 
-def execute_query(sql_query):
+# Seconds between reruns while a query runs in the background
+POLL_INTERVAL = 0.25
+# Rows in a CSV export; the download button holds the whole file in memory
+EXPORT_MAX_ROWS = int(os.environ.get('LAB_EXPORT_MAX_ROWS', '100000'))
+
+@st.cache_resource
+def warm_up():
+    """
+    Compiles the catalog SQL once per server process, before the first suggestions.
+
+    :return: The precompile.report() summary of the catalog.
+    """
+    return report(get_precompiler().compile_catalog(get_store().items()[1]))
+
+def execute_query(sql_query, params=()):
     """
     Executes the given SQL query on the lab.db SQLite database.
+
+    The query runs on the shared executor, within its time and row budgets. Results
+    are served from the result cache until the database changes.
     
     :param sql_query: The SQL query string to execute.
-    :return: A tuple containing column names and fetched rows, or (None, error message) if an error occurs.
+    :param params: Values for the query's positional parameters.
+    :return: A tuple of (columns, rows, truncated), where truncated says the rows stop at
+        the executor's row cap, or (None, error message, False) if an error occurs.
+    """
+    with tracing.span('execute') as execute_span:
+        try:
+            columns, rows, truncated = get_executor().run(sql_query, params)
+        except Exception as e:
+            execute_span.set('error', type(e).__name__)
+            return None, str(e), False
+        execute_span.count('rows', len(rows))
+        if tracing.is_enabled():
+            execute_span.count('bytes', tracing.result_size(rows))
+        return columns, rows, truncated
+
+def start_page(sql_query, page, params=()):
+    """
+    Starts fetching one page of the given SQL query's results in the background.
+    
+    :param sql_query: The SQL query string to execute.
+    :param page: Zero-based page number.
+    :param params: Values for the query's positional parameters.
+    :return: An executor.QueryHandle; pass it to page_results once it is done.
+    """
+    paged, params = paged_query(sql_query, page_size=PAGE_SIZE, page=page, params=params)
+    return get_executor().submit(paged, params)
+
+def page_results(handle):
+    """
+    Waits for a page started with start_page.
+    
+    :param handle: The QueryHandle returned by start_page.
+    :return: A tuple of (columns, rows, has_more), or (None, error message, False) if an error occurs.
     """
     try:
-        conn = sqlite3.connect('lab.db')
-        cursor = conn.cursor()
-        cursor.execute(sql_query)
-        rows = cursor.fetchall()
-        columns = [description[0] for description in cursor.description]
-        conn.close()
-        return columns, rows
+        columns, rows = handle.result()
     except Exception as e:
-        return None, str(e)
+        return None, str(e), False
+    return columns, rows[:PAGE_SIZE], len(rows) > PAGE_SIZE
+
+def execute_page(sql_query, page, params=()):
+    """
+    Executes the given SQL query and fetches only one page of its results.
+    
+    :param sql_query: The SQL query string to execute.
+    :param page: Zero-based page number.
+    :param params: Values for the query's positional parameters.
+    :return: A tuple of (columns, rows, has_more), or (None, error message, False) if an error occurs.
+    """
+    return page_results(start_page(sql_query, page, params))
+
+def show_results(sql_query, params=()):
+    """
+    Renders the current page of the active query with paging and export controls.
+    
+    :param sql_query: The SQL query string to execute.
+    :param params: Values for the query's positional parameters.
+    """
+    # Statements that do not compile on the schema are reported without running them
+    compiled = get_precompiler().compile(sql_query, len(params))
+    if compiled is not None and not compiled.valid:
+        st.error(f"❌ Error executing query: {compiled.error}")
+        return
+
+    page = st.session_state.get('page', 0)
+    handle = st.session_state.get('query_handle')
+    if handle is None or st.session_state.get('query_handle_key') != (sql_query, params, page):
+        if handle is not None:
+            # The user moved on, so the previous query no longer needs its connection
+            handle.cancel()
+        handle = start_page(sql_query, page, params)
+        st.session_state.query_handle = handle
+        st.session_state.query_handle_key = (sql_query, params, page)
+
+    # The query runs off the script thread; rerun until it finishes or is cancelled
+    if not handle.done():
+        state = "waiting for a slot" if handle.status == 'waiting' else "running"
+        st.info(f"🔎 Query {state} for {handle.elapsed:.1f}s...")
+        if compiled is not None and compiled.columns:
+            # The result headers are known from the precompiled statement
+            st.dataframe(pd.DataFrame(columns=compiled.columns), use_container_width=True)
+        if st.button("⏹️ Cancel query"):
+            handle.cancel()
+        else:
+            time.sleep(POLL_INTERVAL)
+            st.rerun()
+
+    columns, result, has_more = page_results(handle)
+
+    if columns and result:
+        st.success("✅ Query executed successfully!")
+        if st.session_state.pop('celebrate', False):
+            st.balloons()  # Fun visual when the query succeeds
+
+        st.subheader("🔬 Query Results:")
+        first_row = page * PAGE_SIZE + 1
+        st.caption(f"Rows {first_row}–{first_row + len(result) - 1}")
+        if handle.truncated:
+            st.warning(f"⚠️ Results stop at the {handle.max_rows:,}-row limit; the query returned more rows.")
+        with tracing.span('render', rows=len(result)):
+            df = pd.DataFrame(result, columns=columns)
+            st.dataframe(df, use_container_width=True, height=400)
+
+        previous_col, next_col = st.columns(2)
+        if previous_col.button("⬅️ Previous page", disabled=page == 0):
+            st.session_state.page = page - 1
+            st.rerun()
+        if next_col.button("Next page ➡️", disabled=not has_more):
+            st.session_state.page = page + 1
+            st.rerun()
+
+        show_export(sql_query, params)
+    elif columns and not result:
+        st.info("ℹ️ The query returned no results.")
+    else:
+        st.error(f"❌ Error executing query: {result}")
+
+def _discard_export():
+    handle = st.session_state.pop('export_handle', None)
+    if handle is not None:
+        handle.cancel()
+    path = st.session_state.pop('export_path', None)
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+    st.session_state.pop('export_data', None)
+    st.session_state.pop('export_truncated', None)
+
+def show_export(sql_query, params=()):
+    """
+    Renders the CSV export of the active query.
+
+    The export runs on the shared executor like the query itself, within its time
+    budget and the heavy-query cap, and can be cancelled. Rows are streamed to a
+    temporary file in chunks, up to EXPORT_MAX_ROWS; the finished file is read back
+    once for the download button.
+
+    :param sql_query: The SQL query string to export.
+    :param params: Values for the query's positional parameters.
+    """
+    if st.session_state.get('export_key') != (sql_query, params):
+        _discard_export()
+        st.session_state.export_key = (sql_query, params)
+
+    handle = st.session_state.get('export_handle')
+    if handle is None and 'export_data' not in st.session_state:
+        if not st.button("📥 Prepare CSV export"):
+            return
+        with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as f:
+            st.session_state.export_path = f.name
+        handle = get_executor().submit(sql_query, params, max_rows=EXPORT_MAX_ROWS,
+                                       write=partial(write_csv, st.session_state.export_path))
+        st.session_state.export_handle = handle
+
+    if handle is not None:
+        if not handle.done():
+            st.info(f"📥 Exporting for {handle.elapsed:.1f}s...")
+            if st.button("⏹️ Cancel export"):
+                _discard_export()
+                st.rerun()
+            time.sleep(POLL_INTERVAL)
+            st.rerun()
+        try:
+            handle.result()
+        except Exception as e:
+            _discard_export()
+            st.error(f"❌ Export failed: {e}")
+            return
+        path = st.session_state.pop('export_path')
+        with open(path, 'rb') as f:
+            st.session_state.export_data = f.read()
+        os.remove(path)
+        st.session_state.export_truncated = handle.truncated
+        del st.session_state.export_handle
+
+    if st.session_state.export_truncated:
+        st.warning(f"⚠️ The export stops at the first {EXPORT_MAX_ROWS:,} rows.")
+    st.download_button("Download CSV", st.session_state.export_data, file_name="query_results.csv", mime="text/csv")
+
+def show_debug_panel():
+    """
+    Shows the per-stage timings of the current run and the rolling percentiles in the
+    sidebar. Only rendered while tracing is enabled (LAB_TRACING=1).
+    """
+    trace = tracing.current_trace()
+    if trace is None:
+        return
+    with st.sidebar.expander("⏱️ Request timings"):
+        breakdown = trace.breakdown()
+        if breakdown:
+            st.dataframe(pd.DataFrame(breakdown), use_container_width=True)
+        stats = tracing.recorder.stats()
+        if stats:
+            st.caption("Rolling percentiles per stage")
+            st.dataframe(pd.DataFrame.from_dict(stats, orient='index'), use_container_width=True)
 
 def main():
     st.set_page_config(page_title="Lab Database AI Agent 🧠", layout="centered")
+    tracing.start_metrics_server()
+    # Templates that do not compile on the database are never suggested
+    catalog = warm_up()
 
     # Sidebar description
     with st.sidebar:
@@ -33,6 +242,8 @@ def main():
             The AI agent will suggest the most relevant SQL queries based on cosine similarity.  
             Select the query that best fits your needs, and get instant results!
         """)
+        if catalog['invalid']:
+            st.caption(f"{catalog['invalid']} catalog queries do not compile on the database and are not suggested.")
         st.markdown("---")
         st.markdown("**Author: Ramlavan**")
         st.markdown("[GitHub: ramlavn](https://github.com/ramlavn)")
@@ -68,33 +279,36 @@ def main():
             selected_sql = sql_queries[selected_index]
             selected_similarity = similarity_scores[selected_index]
             selected_matched_query = suggestions[selected_index][1]
+            # Values filled into the slots of a parameterized catalog entry
+            selected_params = suggestions[selected_index][3]
 
             # Display the selected SQL query with an option to run
             with st.expander("💡 Preview Your Selected SQL Query"):
                 st.code(selected_sql, language='sql')
+                if selected_params:
+                    st.write(f"**Parameters:** {', '.join(map(str, selected_params))}")
                 st.write(f"**Similarity Score:** {selected_similarity:.2f} 🧠")
                 st.write(f"**Matched Query:** {selected_matched_query} 🔍")
 
-            # Button to execute the query
+            # Button to execute the query; the active query is kept in the session so
+            # paging reruns keep showing its results
             if st.button("🚀 Run Query"):
-                with st.spinner('🔎 Executing your SQL query...'):
-                    columns, result = execute_query(selected_sql)
-
-                    if columns and result:
-                        st.success("✅ Query executed successfully!")
-                        st.balloons()  # Fun visual when the query succeeds
-
-                        st.subheader("🔬 Query Results:")
-                        df = pd.DataFrame(result, columns=columns)
-                        st.dataframe(df, use_container_width=True, height=400)
-                    elif columns and not result:
-                        st.info("ℹ️ The query returned no results.")
-                    else:
-                        st.error(f"❌ Error executing query: {result}")
+                previous = st.session_state.pop('query_handle', None)
+                if previous is not None:
+                    previous.cancel()
+                st.session_state.active_sql = (selected_sql, selected_params)
+                st.session_state.page = 0
+                st.session_state.celebrate = True
+
+            if st.session_state.get('active_sql') == (selected_sql, selected_params):
+                show_results(selected_sql, selected_params)
         else:
             st.warning("⚠️ No suitable SQL queries found for your input. Please try rephrasing your query.")
     else:
         st.info("💡 Please enter a query above to receive suggestions.")
 
 if __name__ == "__main__":
-    main()
+    # Every stage of this run is recorded as one trace when tracing is enabled
+    with tracing.trace('request'):
+        main()
+        show_debug_panel()
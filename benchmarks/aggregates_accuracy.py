@@ -0,0 +1,86 @@
+# benchmarks/aggregates_accuracy.py
+"""
+Compares the SQLite statistical functions in aggregates.py with fetching the column
+into NumPy: run time, peak Python memory (measured in a separate run, since tracing
+allocations slows both down) and accuracy.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aggregates
+
+SIZES = (1000000, 5000000)
+
+# SQL expression -> the NumPy computation it should match
+FUNCTIONS = {
+    'STDDEV(x)': lambda x: np.std(x, ddof=1),
+    'VARIANCE(x)': lambda x: np.var(x, ddof=1),
+    'MEDIAN(x)': np.median,
+    'PERCENTILE(x, 0.9)': lambda x: np.quantile(x, 0.9),
+    'PERCENTILE(x, 0.99)': lambda x: np.quantile(x, 0.99),
+}
+
+
+def build(path, size, seed=0):
+    """Fills a table with log-normally distributed values, shaped like prices or salaries."""
+    rng = np.random.default_rng(seed)
+    conn = aggregates.connect(path)
+    conn.execute('CREATE TABLE t (x REAL);')
+    for start in range(0, size, 1000000):
+        values = rng.lognormal(10, 0.5, min(1000000, size - start))
+        conn.executemany('INSERT INTO t VALUES (?);', ((value,) for value in values.tolist()))
+    conn.commit()
+    return conn
+
+
+def peak_memory(function):
+    """Runs function and returns the peak memory it allocated from Python, in MB."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES))
+    args = parser.parse_args()
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as workdir:
+            conn = build(os.path.join(workdir, 'aggregates.db'), size)
+            start = time.perf_counter()
+            column = np.array([value for value, in conn.execute('SELECT x FROM t;')])
+            fetch_seconds = time.perf_counter() - start
+            ordered = np.sort(column)
+            fetch_memory = peak_memory(lambda: np.array([value for value, in conn.execute('SELECT x FROM t;')]))
+            print(f"{size:,} rows (fetching the column for NumPy takes {fetch_seconds:.2f}s "
+                  f"and {fetch_memory:.0f} MB)")
+            for expression, reference in FUNCTIONS.items():
+                start = time.perf_counter()
+                value, = conn.execute(f'SELECT {expression} FROM t;').fetchone()
+                sql_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                expected = float(reference(column))
+                numpy_seconds = fetch_seconds + time.perf_counter() - start
+                # For quantiles, also report how far the answer is from the exact rank
+                rank_error = abs(np.searchsorted(ordered, value) - np.searchsorted(ordered, expected)) / size
+                sql_memory = peak_memory(lambda: conn.execute(f'SELECT {expression} FROM t;').fetchone())
+                print(f"  {expression:<20} sql {sql_seconds:6.2f}s {sql_memory:5.1f} MB | "
+                      f"fetch+numpy {numpy_seconds:6.2f}s | "
+                      f"relative error {abs(value - expected) / abs(expected):.2e} | rank error {rank_error:.2e}")
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
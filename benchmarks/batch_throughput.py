@@ -0,0 +1,71 @@
+# benchmarks/batch_throughput.py
+"""Compares query-at-a-time matching with the batch API for 1, 100 and 10k queries."""
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity import PREDEFINED_QUERIES, get_top_n_sql_queries, get_top_n_sql_queries_batch
+from templates import example
+
+BATCH_SIZES = (1, 100, 10000)
+
+
+def sample_queries(count, seed=0):
+    """
+    Builds a workload of user queries by shuffling and truncating catalog phrasings.
+
+    :param count: Number of queries to generate.
+    :param seed: Random seed for reproducibility.
+    :return: List of natural language queries.
+    """
+    rng = random.Random(seed)
+    # Templates are sampled with their slots filled, as a user would phrase them
+    catalog = [example(question, sql)[1] for question, sql in PREDEFINED_QUERIES.items()]
+    queries = []
+    for _ in range(count):
+        words = rng.choice(catalog).split()
+        rng.shuffle(words)
+        queries.append(' '.join(words[:rng.randint(2, len(words))]))
+    return queries
+
+
+def same_results(expected, actual):
+    """
+    Checks that two result lists name the same queries and parameters with (numerically) equal scores.
+
+    :param expected: Result list from get_top_n_sql_queries.
+    :param actual: Result list from the batch API.
+    :return: True if they match row for row.
+    """
+    return (len(expected) == len(actual)
+            and all(e[:2] == a[:2] and np.isclose(e[2], a[2]) and e[3:] == a[3:] for e, a in zip(expected, actual)))
+
+
+def main():
+    # Warm up the index and NLTK before timing
+    get_top_n_sql_queries("List all lab tests.")
+
+    for size in BATCH_SIZES:
+        queries = sample_queries(size)
+
+        start = time.perf_counter()
+        single = [get_top_n_sql_queries(query) for query in queries]
+        single_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = get_top_n_sql_queries_batch(queries)
+        batch_elapsed = time.perf_counter() - start
+
+        if not all(same_results(e, a) for e, a in zip(single, batch)):
+            raise SystemExit(f"Batch results differ from single-query results for {size} queries")
+        print(f"{size:>6} queries: single {size / single_elapsed:>10.0f} q/s | "
+              f"batch {size / batch_elapsed:>10.0f} q/s | speedup {single_elapsed / batch_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/catalog_updates.py
+"""Measures catalog update latency against catalog size, compared with refitting the matcher."""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import CatalogStore, compact, refresh
+from retrieval import BACKENDS
+from retrieval_latency import synthetic_catalog
+
+SIZES = (1000, 10000, 100000)
+
+
+def identity(text):
+    # The synthetic questions are already preprocessed
+    return text
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES))
+    parser.add_argument('--updates', type=int, default=300, help='add/update/delete operations per size')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in (int(size) for size in args.sizes.split(',')):
+        catalog = synthetic_catalog(size + args.updates, seed=size)
+        questions = list(catalog)
+        initial, extra = questions[:size], questions[size:]
+        with tempfile.TemporaryDirectory() as workdir:
+            path, index_path = os.path.join(workdir, 'catalog.db'), os.path.join(workdir, 'index')
+            writer = CatalogStore(path)
+            writer.put_many({question: catalog[question] for question in initial})
+            reader = CatalogStore(path)
+            start = time.perf_counter()
+            index = compact(reader, identity, index_path)
+            refit_seconds = time.perf_counter() - start
+
+            writes, applies = [], []
+            live = list(initial)
+            for i in range(args.updates):
+                operation = i % 3
+                start = time.perf_counter()
+                if operation == 0:
+                    writer.add(extra[i], 'SELECT 2;')
+                    live.append(extra[i])
+                elif operation == 1:
+                    writer.update(rng.choice(live), 'SELECT 3;')
+                else:
+                    writer.delete(live.pop(rng.randrange(len(live))))
+                writes.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                index = refresh(index, reader, identity, index_path)
+                applies.append(time.perf_counter() - start)
+
+            # Top-1 agreement between the layered index and a full refit of the same catalog
+            user_queries = [rng.choice(live) for _ in range(200)]
+            retriever = BACKENDS['maxscore'](index.base)
+            layered = [index.search(retriever, index.transform([query]), 3, 0.3)[0].tolist() for query in user_queries]
+            layered = [[index.question(row) for row in rows] for rows in layered]
+            refit = compact(reader, identity, index_path)
+            retriever = BACKENDS['maxscore'](refit.base)
+            fresh = [[refit.question(row) for row in refit.search(retriever, refit.transform([query]), 3, 0.3)[0]]
+                     for query in user_queries]
+            agreement = np.mean([a[:1] == b[:1] for a, b in zip(layered, fresh)])
+            writer.close()
+            reader.close()
+
+        print(f"{size:>7,} questions | write p50 {percentile_ms(writes, 50):6.2f} ms p99 {percentile_ms(writes, 99):6.2f} ms | "
+              f"apply p50 {percentile_ms(applies, 50):6.2f} ms p99 {percentile_ms(applies, 99):6.2f} ms | "
+              f"full refit {refit_seconds * 1000:8.1f} ms | top-1 agreement with refit {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
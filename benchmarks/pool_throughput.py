@@ -0,0 +1,100 @@
+# benchmarks/pool_throughput.py
+"""Compares queries/sec of connect-per-query execution with the connection pool."""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aggregates
+from pool import DATABASE_PATH, ConnectionPool
+from similarity import PREDEFINED_QUERIES
+from templates import examples
+
+CLIENT_COUNTS = (1, 8, 32)
+
+
+def connect_per_query(database):
+    """The original execute_query: a fresh connection for every query."""
+    def run(sql, params=()):
+        conn = aggregates.connect(database)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            conn.close()
+    return run
+
+
+def pooled(pool):
+    def run(sql, params=()):
+        with pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+    return run
+
+
+def runnable_queries(database):
+    """
+    Returns the catalog statements, as (SQL, params), that execute successfully against the database.
+    """
+    conn = aggregates.connect(database)
+    queries = []
+    for sql, params in examples(PREDEFINED_QUERIES):
+        try:
+            conn.execute(sql, params).fetchall()
+            queries.append((sql, params))
+        except sqlite3.Error:
+            pass
+    conn.close()
+    return queries
+
+
+def measure(run, queries, clients, duration):
+    """
+    Runs the catalog in a loop from several threads for a fixed duration.
+
+    :return: Completed queries per second.
+    """
+    completed = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(slot):
+        i = slot
+        while time.perf_counter() < deadline:
+            run(*queries[i % len(queries)])
+            i += 1
+            completed[slot] += 1
+
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(completed) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database', default=DATABASE_PATH)
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per measurement')
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    queries = runnable_queries(args.database)
+    pool = ConnectionPool(args.database, size=args.pool_size)
+    print(f"{len(queries)} runnable catalog queries, pool size {args.pool_size}")
+    for clients in CLIENT_COUNTS:
+        before = measure(connect_per_query(args.database), queries, clients, args.duration)
+        after = measure(pooled(pool), queries, clients, args.duration)
+        print(f"{clients:>3} clients: connect-per-query {before:>9.0f} q/s | "
+              f"pooled {after:>9.0f} q/s | speedup {after / before:.1f}x")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/replica_latency.py
+"""
+Compares catalog reads from the on-disk pool with the in-memory replica: per-query
+latency percentiles with one client, and queries/sec with several, on lab.db and on
+synthetic databases.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pool import ConnectionPool
+from pool_throughput import measure, pooled, runnable_queries
+from replica import ReplicaPool
+from suite import database_path
+
+CLIENT_COUNTS = (1, 8, 32)
+
+
+def latencies(run, queries, repeat):
+    """
+    Times every query repeat times.
+
+    :return: Dict of p50, p95 and p99 latency in milliseconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        for sql, params in queries:
+            start = time.perf_counter()
+            run(sql, params)
+            samples.append(time.perf_counter() - start)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {'p50': p50, 'p95': p95, 'p99': p99}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--databases', default='lab,100000',
+                        help="comma-separated 'lab' or synthetic row counts (see db.generate_database)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds per throughput measurement')
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    for database in args.databases.split(','):
+        path = database_path(database)
+        queries = runnable_queries(path)
+        disk = ConnectionPool(path, size=args.pool_size)
+        start = time.perf_counter()
+        memory = ReplicaPool(path, size=args.pool_size, refresh_interval=None)
+        load = time.perf_counter() - start
+        stats = memory.stats()
+        print(f"{database}: {len(queries)} runnable catalog queries, "
+              f"{stats['replica_bytes'] / 1e6:.1f} MB loaded into {stats['replica']} in {load * 1000:.0f} ms")
+        if stats['replica'] == 'disk':
+            print('  larger than LAB_DB_REPLICA_MAX_BYTES, served from disk')
+
+        for name, pool in (('disk', disk), ('replica', memory)):
+            # Warm the page caches and prepared statements first
+            latencies(pooled(pool), queries, 1)
+            result = latencies(pooled(pool), queries, args.repeat)
+            print(f"  {name:>7} latency | p50 {result['p50']:8.3f} ms | p95 {result['p95']:8.3f} ms | "
+                  f"p99 {result['p99']:8.3f} ms")
+        for clients in CLIENT_COUNTS:
+            before = measure(pooled(disk), queries, clients, args.duration)
+            after = measure(pooled(memory), queries, clients, args.duration)
+            print(f"  {clients:>3} clients: disk {before:>9.0f} q/s | replica {after:>9.0f} q/s | "
+                  f"speedup {after / before:.2f}x")
+        disk.close()
+        memory.close()
+
+
+if __name__ == "__main__":
+    main()
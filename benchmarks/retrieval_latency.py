@@ -0,0 +1,84 @@
+# benchmarks/retrieval_latency.py
+"""Measures retrieval latency per backend as a synthetic catalog grows 1000x."""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher_index import build_index
+from retrieval import BACKENDS
+from similarity import PREDEFINED_QUERIES, get_index, preprocess
+
+SCALES = (1, 10, 100, 1000)
+
+
+def synthetic_catalog(size, seed=0):
+    """
+    Builds a catalog of already-preprocessed templates shaped like the real one.
+
+    Each template reshuffles the stemmed tokens of a real template and swaps a few of
+    them for other vocabulary terms, so term frequencies stay realistic.
+
+    :param size: Number of templates.
+    :param seed: Random seed for reproducibility.
+    :return: Dict mapping preprocessed templates to placeholder SQL.
+    """
+    rng = random.Random(seed)
+    base = [preprocess(query).split() for query in PREDEFINED_QUERIES]
+    vocabulary = [str(term) for term in get_index().terms]
+    catalog = {}
+    while len(catalog) < size:
+        tokens = list(rng.choice(base))
+        for _ in range(rng.randint(0, 3)):
+            tokens[rng.randrange(len(tokens))] = rng.choice(vocabulary)
+        rng.shuffle(tokens)
+        catalog[' '.join(tokens) + f' t{len(catalog)}'] = 'SELECT 1;'
+    return catalog
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, default=300, help='queries timed per catalog size')
+    parser.add_argument('-n', type=int, default=3, help='matches per query')
+    parser.add_argument('--threshold', type=float, default=0.3)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    user_queries = [preprocess(query) for query in rng.sample(list(PREDEFINED_QUERIES), 100)]
+
+    for scale in SCALES:
+        size = len(PREDEFINED_QUERIES) * scale
+        index = build_index(synthetic_catalog(size), lambda text: text)
+        vectors = [index.transform([rng.choice(user_queries)]) for _ in range(args.queries)]
+        retrievers = {name: backend(index) for name, backend in BACKENDS.items()}
+        timings = {name: [] for name in retrievers}
+        mismatches = 0
+
+        for vector in vectors:
+            results = {}
+            for name, retriever in retrievers.items():
+                start = time.perf_counter()
+                results[name] = retriever.search(vector, args.n, args.threshold)
+                timings[name].append(time.perf_counter() - start)
+            exact_indices, exact_scores = results['bruteforce']
+            for name, (indices, scores) in results.items():
+                if not (np.array_equal(indices, exact_indices) and np.allclose(scores, exact_scores)):
+                    mismatches += 1
+
+        summary = ' | '.join(
+            f"{name} p50 {percentile_ms(samples, 50):7.3f} ms p99 {percentile_ms(samples, 99):7.3f} ms"
+            for name, samples in timings.items())
+        print(f"{size:>8} templates: {summary} | mismatches vs exact: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# benchmarks/service_throughput.py
+"""Measures requests/sec and latency of service.py under concurrent keep-alive clients."""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from similarity import PREDEFINED_QUERIES
+from templates import example, examples
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/health')
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('service did not start')
+
+
+def client(args):
+    """Sends requests over one keep-alive connection until the deadline."""
+    port, endpoint, deadline, seed = args
+    questions = [example(question, sql)[1] for question, sql in PREDEFINED_QUERIES.items()]
+    statements = examples(PREDEFINED_QUERIES)
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    latencies, statuses, i = [], {}, seed
+    while time.perf_counter() < deadline:
+        if endpoint == 'suggest':
+            payload = {'query': questions[i % len(questions)]}
+        else:
+            sql, params = statements[i % len(statements)]
+            payload = {'sql': sql, 'params': list(params), 'page_size': 20}
+        body = json.dumps(payload)
+        start = time.perf_counter()
+        conn.request('POST', '/' + endpoint, body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        i += 1
+    conn.close()
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4, help='service worker processes')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client connections')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per endpoint')
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'service.py'), 'serve',
+                               '--port', str(port), '--workers', str(args.workers)],
+                              cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        wait_ready(port)
+        with multiprocessing.Pool(args.clients) as pool:
+            for endpoint in ('suggest', 'execute'):
+                deadline = time.perf_counter() + args.duration
+                start = time.perf_counter()
+                outcomes = pool.map(client, [(port, endpoint, deadline, seed) for seed in range(args.clients)])
+                elapsed = time.perf_counter() - start
+                latencies = np.concatenate([np.asarray(latency) for latency, _ in outcomes]) * 1000
+                statuses = {}
+                for _, counts in outcomes:
+                    for status, count in counts.items():
+                        statuses[status] = statuses.get(status, 0) + count
+                print(f"{endpoint:>8}: {len(latencies) / elapsed:8.0f} req/s | "
+                      f"p50 {np.percentile(latencies, 50):6.2f} ms p99 {np.percentile(latencies, 99):6.2f} ms | "
+                      f"statuses {dict(sorted(statuses.items()))}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# benchmarks/shard_fanout.py
+"""
+Checks fanned-out catalog queries against one combined database, and compares the
+latency of querying the shards concurrently with querying them site by site.
+
+One synthetic database is split into site shards by department, so every shard
+holds whole departments with their lab tests and employees, and keeps the ids of
+the original. The unsplit database is the reference every fanned-out answer is
+checked against.
+"""
+import argparse
+import math
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aggregates
+from db import create_indexes, create_schema, generate_database
+from shards import ShardExecutor, ShardMergeError, merge, plan
+from similarity import PREDEFINED_QUERIES
+from templates import examples
+
+SHARD_COUNTS = (1, 2, 4, 8)
+# Cross-site question timed for scaling
+QUESTION = "Show the total salary expenditure per department."
+# Significant digits floats are compared on; shards sum in a different order
+FLOAT_DIGITS = 9
+
+# Trailing ORDER BY ... LIMIT ... OFFSET ... of a statement
+_LIMIT = re.compile(r'(?:\s+ORDER\s+BY\s+(?P<terms>.+?))?\s+LIMIT\s+(?P<limit>\d+)'
+                    r'(?:\s+OFFSET\s+(?P<offset>\d+))?\s*;?\s*$', re.IGNORECASE | re.DOTALL)
+_DIRECTION = re.compile(r'\s+(?:ASC|DESC)(?:\s+NULLS\s+(?:FIRST|LAST))?$', re.IGNORECASE)
+_ALIAS = re.compile(r'^(?P<expression>.+?)\s+AS\s+(?P<alias>\w+)$', re.IGNORECASE | re.DOTALL)
+
+
+def split(source, paths):
+    """
+    Splits a database into shards by department.
+
+    Department i goes to shard (i - 1) % len(paths) with its lab tests and employees;
+    ids are kept, so every row of a shard is a row of the source.
+    """
+    for number, path in enumerate(paths):
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        create_schema(cursor)
+        cursor.execute('ATTACH DATABASE ? AS source;', (source,))
+        cursor.execute('INSERT INTO Departments SELECT * FROM source.Departments WHERE (id - 1) % ? = ?;',
+                       (len(paths), number))
+        for table in ('LabTests', 'Employees'):
+            cursor.execute(f'INSERT INTO {table} SELECT * FROM source.{table} '
+                           f'WHERE department_id IN (SELECT id FROM main.Departments);')
+        conn.commit()
+        cursor.execute('DETACH DATABASE source;')
+        create_indexes(cursor)
+        cursor.execute('ANALYZE;')
+        conn.close()
+
+
+def _canonical(row):
+    return tuple(float(f'{value:.{FLOAT_DIGITS}g}') if isinstance(value, float) else value for value in row)
+
+
+def same_rows(rows, expected, ordered):
+    def same(a, b):
+        if isinstance(a, float) or isinstance(b, float):
+            return a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+        return a == b
+
+    if not ordered:
+        key = lambda row: [(value is None, str(type(value)), value if value is not None else 0) for value in row]
+        rows, expected = sorted(rows, key=key), sorted(expected, key=key)
+    return len(rows) == len(expected) and all(
+        len(row) == len(other) and all(same(a, b) for a, b in zip(row, other)) for row, other in zip(rows, expected))
+
+
+def _top_level(sql):
+    """Yields (index, character) of sql outside parentheses and string literals."""
+    depth, quote = 0, None
+    for index, character in enumerate(sql):
+        if quote:
+            quote = None if character == quote else quote
+        elif character in '\'"':
+            quote = character
+        elif character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+        elif depth == 0:
+            yield index, character
+
+
+def _split_top_level(text):
+    parts, start = [], 0
+    for index, character in _top_level(text):
+        if character == ',':
+            parts.append(text[start:index].strip())
+            start = index + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _keyed(sql, terms):
+    """
+    Rewrites an ORDER BY ... LIMIT statement to also select its sort keys, without
+    the LIMIT.
+
+    :return: The statement, or None if its select list cannot be found.
+    """
+    top = [' '] * len(sql)
+    for index, character in _top_level(sql):
+        top[index] = character
+    top = ''.join(top)
+    select = re.match(r'\s*SELECT\s+(?:DISTINCT\s+)?', top, re.IGNORECASE)
+    found = re.search(r'\bFROM\b', top[select.end():], re.IGNORECASE) if select else None
+    if found is None:
+        return None
+    select_end = select.end() + found.start()
+    items = _split_top_level(sql[select.end():select_end])
+    aliases = {}
+    for item in items:
+        alias = _ALIAS.match(item)
+        if alias:
+            aliases[alias.group('alias').casefold()] = alias.group('expression')
+    keys = []
+    for term in _split_top_level(terms):
+        term = _DIRECTION.sub('', term)
+        if term.isdigit():
+            term = _ALIAS.sub(r'\g<expression>', items[int(term) - 1])
+        keys.append(aliases.get(term.casefold(), term))
+    limit = _LIMIT.search(sql)
+    return (sql[:select_end].rstrip() + ''.join(f', {key}' for key in keys) + ' ' +
+            sql[select_end:limit.start()].strip() + f' ORDER BY {terms};')
+
+
+def same_top_rows(conn, sql, params, rows):
+    """
+    Checks a LIMIT answer against the full answer of the combined database.
+
+    Rows tied on the sort keys at either end of the limit window may come from any
+    shard, so those only have to be among the tied rows; every other row of the
+    window must be returned, and nothing else. Without an ORDER BY, any rows of the
+    full answer will do.
+    """
+    limit = _LIMIT.search(sql)
+    offset = int(limit.group('offset') or 0)
+    keyed = _keyed(sql, limit.group('terms')) if limit.group('terms') else None
+    try:
+        cursor = conn.execute(keyed, params) if keyed else None
+    except sqlite3.Error:
+        # A sort key the rewrite cannot select; fall back to the unordered check
+        cursor = None
+    if cursor is None:
+        full = [(_canonical(row), ()) for row in conn.execute(sql[:limit.start()] + ';', params)]
+    else:
+        width = len(cursor.description) - len(_split_top_level(limit.group('terms')))
+        full = [(_canonical(row[:width]), _canonical(row[width:])) for row in cursor]
+    window = full[offset:offset + int(limit.group('limit'))]
+    if len(rows) != len(window):
+        return False
+    edges = {window[0][1], window[-1][1]} if window else set()
+    required = Counter(row for row, key in window if key not in edges)
+    allowed = required + Counter(row for row, key in full if key in edges)
+    returned = Counter(_canonical(row) for row in rows)
+    return not required - returned and not returned - allowed
+
+
+def check(paths, combined):
+    """
+    Runs every catalog statement fanned out and on the combined database.
+
+    :return: Tuple of (agreeing, differing statements, number rejected by the planner,
+        number whose shard results hit the row cap).
+    """
+    executor = ShardExecutor(paths)
+    conn = aggregates.connect(combined)
+    agreeing, differing, rejected, truncated = 0, [], 0, 0
+    for sql, params in examples(PREDEFINED_QUERIES):
+        try:
+            result = executor.run(sql, params)
+        except ShardMergeError:
+            rejected += 1
+            continue
+        except Exception:
+            # Statements that fail on the schema itself fail on every shard
+            continue
+        if result.failures:
+            # Only cross joins hit the row cap; their full answer is too large to compare
+            truncated += 1
+            continue
+        cursor = conn.execute(sql, params)
+        expected = cursor.fetchall()
+        columns = [description[0] for description in cursor.description]
+        if _LIMIT.search(sql):
+            same = same_top_rows(conn, sql, params, result.rows)
+        else:
+            # Row order is only defined up to ties, so ordered results compare as sets too
+            same = same_rows(result.rows, expected, ordered=False)
+        if result.columns == columns and same:
+            agreeing += 1
+        else:
+            differing.append(sql)
+    conn.close()
+    executor.close()
+    return agreeing, differing, rejected, truncated
+
+
+def site_by_site(paths, sql_query, params):
+    """Runs the shard query on one shard after another, then merges."""
+    merge_plan = plan(sql_query, params)
+    results = []
+    for path in paths:
+        conn = aggregates.connect(path)
+        cursor = conn.execute(merge_plan.shard_sql, merge_plan.shard_params)
+        results.append(([description[0] for description in cursor.description], cursor.fetchall()))
+        conn.close()
+    return merge(merge_plan, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', default=','.join(str(count) for count in SHARD_COUNTS))
+    parser.add_argument('--scale', type=int, default=200000, help='synthetic rows per shard')
+    parser.add_argument('--departments', type=int, default=50, help='departments per shard')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    counts = [int(count) for count in args.shards.split(',')]
+    sql = PREDEFINED_QUERIES[QUESTION]
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = [os.path.join(workdir, f'site{i}.db') for i in range(max(counts))]
+        combined = os.path.join(workdir, 'combined.db')
+        generate_database(combined, args.scale * len(paths), departments=args.departments * len(paths),
+                          verbose=False)
+        split(combined, paths)
+        agreeing, differing, rejected, truncated = check(paths, combined)
+        print(f'catalog check on {len(paths)} shards: {agreeing} agree with the combined database, '
+              f'{len(differing)} differ, {rejected} cannot be merged, {truncated} exceed the row cap')
+        for statement in differing:
+            print(f'  differs: {statement}')
+
+        print(f'\n{QUESTION!r} on {os.cpu_count()} cores')
+        for count in counts:
+            shard_set = paths[:count]
+            executor = ShardExecutor(shard_set)
+            executor.run(sql)
+            sequential, concurrent = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                site_by_site(shard_set, sql, ())
+                sequential.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                executor.run(sql)
+                concurrent.append(time.perf_counter() - start)
+            executor.close()
+            print(f'{count:>3} shards | site by site {np.median(sequential) * 1000:8.1f} ms | '
+                  f'fan-out {np.median(concurrent) * 1000:8.1f} ms | '
+                  f'speedup {np.median(sequential) / np.median(concurrent):.2f}x')
+
+
+if __name__ == "__main__":
+    main()
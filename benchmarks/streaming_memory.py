@@ -0,0 +1,66 @@
+# benchmarks/streaming_memory.py
+"""Compares peak RSS of fetchall() + DataFrame with streamed paging and CSV export."""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# A result of arbitrary size that works on the read-only lab.db: every employee
+# repeated `count` times
+LARGE_QUERY = (
+    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {count}) "
+    "SELECT n.i, Employees.name, Employees.role, Employees.salary FROM n CROSS JOIN Employees"
+)
+
+MODES = ('fetchall', 'page', 'csv')
+
+
+def run_mode(mode, count):
+    import pandas as pd
+
+    from pool import get_pool
+    from streaming import export_csv, fetch_page
+
+    sql = LARGE_QUERY.format(count=count)
+    if mode == 'fetchall':
+        with get_pool().connection() as conn:
+            cursor = conn.execute(sql)
+            rows = cursor.fetchall()
+            pd.DataFrame(rows, columns=[description[0] for description in cursor.description])
+    elif mode == 'page':
+        fetch_page(sql, page=3)
+    else:
+        with open(os.devnull, 'w') as f:
+            export_csv(sql, f)
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma-separated repeat counts (rows = count x employees)')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.count)
+        return
+
+    # Each measurement runs in a fresh process so peak RSS is not shared
+    for count in (int(size) for size in args.sizes.split(',')):
+        peaks = {}
+        for mode in MODES:
+            output = subprocess.run([sys.executable, __file__, '--mode', mode, '--count', str(count)],
+                                    cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            peaks[mode] = int(output.split()[-1]) / 1024
+        summary = ' | '.join(f"{mode} {peak:7.1f} MB" for mode, peak in peaks.items())
+        print(f"{count:>8} repeats: peak RSS {summary}")
+
+
+if __name__ == "__main__":
+    main()
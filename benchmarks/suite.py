@@ -0,0 +1,325 @@
+# benchmarks/suite.py
+"""
+Times every stage of a request for every template in PREDEFINED_QUERIES.
+
+Stages: similarity.preprocess, the index transform, get_top_n_sql_queries (with its
+result cache emptied before each call), app.execute_query (result cache emptied) and
+a full request (match, then execute the top suggestion). Database stages run once per
+database size. Each (stage, database) pair runs in a fresh process, so peak RSS is
+measured per pair. Reports p50/p95/p99, throughput and peak memory as JSON.
+
+Usage:
+    python benchmarks/suite.py run [--databases lab,10000,100000] [--output results.json]
+    python benchmarks/suite.py compare baseline.json results.json [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Generated databases are kept here and reused between runs
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+
+MATCHER_STAGES = ('preprocess', 'transform', 'match')
+DATABASE_STAGES = ('execute', 'request')
+DEFAULT_DATABASES = 'lab,10000,100000'
+
+# Templates slower than this on a database are reported as skipped instead of timed
+STATEMENT_BUDGET = 0.5
+# Latency increases smaller than this are noise, whatever their ratio
+MIN_DELTA_MS = 0.05
+# Metrics compared between runs and whether a larger value is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'p99_ms': True,
+    'throughput_per_sec': False,
+    'peak_rss_mb': True,
+}
+
+
+def database_path(database):
+    """
+    Resolves a --databases entry to a file, generating synthetic databases on first use.
+
+    :param database: 'lab' for the bundled lab.db, or a synthetic row count.
+    :return: Path to the SQLite database.
+    """
+    if database == 'lab':
+        return os.path.join(ROOT, 'lab.db')
+    from db import generate_database
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f'synthetic_{int(database)}.db')
+    # Resumes an interrupted load and is a no-op on a finished one
+    generate_database(path, int(database), verbose=False)
+    return path
+
+
+def summarize(samples, errors=0, skipped=0, invalid=0):
+    """
+    Reduces per-call timings to latency percentiles and throughput.
+
+    :param samples: Seconds taken by each call.
+    :param errors: Calls that returned an error.
+    :param skipped: Templates left out for exceeding the time budget.
+    :param invalid: Templates left out for failing to compile on the schema.
+    :return: Dict of the stage metrics.
+    """
+    samples = np.asarray(samples, dtype=float)
+    counts = {'samples': int(len(samples)), 'errors': errors, 'skipped': skipped, 'invalid': invalid}
+    if not len(samples):
+        return counts
+    return {
+        **counts,
+        'mean_ms': float(samples.mean()) * 1000,
+        'p50_ms': float(np.percentile(samples, 50)) * 1000,
+        'p95_ms': float(np.percentile(samples, 95)) * 1000,
+        'p99_ms': float(np.percentile(samples, 99)) * 1000,
+        'max_ms': float(samples.max()) * 1000,
+        'throughput_per_sec': len(samples) / float(samples.sum()) if samples.sum() else 0.0,
+    }
+
+
+def timed(call, samples):
+    start = time.perf_counter()
+    result = call()
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def run_matcher_stage(stage, repeat):
+    import similarity
+    from similarity import PREDEFINED_QUERIES, get_index, get_top_n_sql_queries, preprocess
+    from templates import example
+
+    index = get_index()
+    # Parameterized questions are asked with their slots filled, as a user would
+    queries = [example(question, sql)[1] for question, sql in PREDEFINED_QUERIES.items()]
+    preprocessed = [preprocess(query) for query in queries]
+    samples = []
+    for _ in range(repeat):
+        if stage == 'preprocess':
+            for query in queries:
+                timed(lambda: preprocess(query), samples)
+        elif stage == 'transform':
+            for text in preprocessed:
+                timed(lambda: index.transform([text]), samples)
+        else:
+            for query in queries:
+                similarity._result_cache.clear()
+                timed(lambda: get_top_n_sql_queries(query), samples)
+    return summarize(samples)
+
+
+def runnable_statements(database, budget):
+    """
+    Returns the catalog SQL that compiles and finishes within budget on the database.
+
+    :return: Tuple of (statements as (SQL, params), number too slow, number invalid).
+    """
+    import sqlite3
+
+    import aggregates
+    from index_advisor import time_statement
+    from similarity import PREDEFINED_QUERIES
+    from templates import examples
+
+    conn = aggregates.connect(database)
+    statements, skipped, invalid = [], 0, 0
+    for sql, params in examples(PREDEFINED_QUERIES):
+        try:
+            conn.execute('EXPLAIN ' + sql, params)
+        except sqlite3.Error:
+            invalid += 1
+            continue
+        if time_statement(conn, sql, budget, params) is None:
+            skipped += 1
+        else:
+            statements.append((sql, params))
+    conn.close()
+    return statements, skipped, invalid
+
+
+def run_database_stage(stage, database, repeat, budget):
+    from app import execute_query
+    import similarity
+    from query_cache import get_result_cache
+    from similarity import PREDEFINED_QUERIES, get_top_n_sql_queries
+    from templates import example
+
+    statements, skipped, invalid = runnable_statements(database, budget)
+    runnable = set(statements)
+    result_cache = get_result_cache()
+    samples, errors = [], 0
+    for _ in range(repeat):
+        if stage == 'execute':
+            for sql, params in statements:
+                result_cache.clear()
+                columns, _, _ = timed(lambda: execute_query(sql, params), samples)
+                errors += columns is None
+        else:
+            for question, sql in PREDEFINED_QUERIES.items():
+                sql, query, params = example(question, sql)
+                if (sql, params) not in runnable:
+                    continue
+                similarity._result_cache.clear()
+                result_cache.clear()
+
+                def request():
+                    suggestions = get_top_n_sql_queries(query)
+                    return execute_query(suggestions[0][0], suggestions[0][3]) if suggestions else (None, None, False)
+                columns, _, _ = timed(request, samples)
+                errors += columns is None
+    return summarize(samples, errors, skipped, invalid)
+
+
+def run_worker(stage, database, repeat, budget):
+    """Runs one stage in this process and prints its metrics as JSON."""
+    if stage in MATCHER_STAGES:
+        metrics = run_matcher_stage(stage, repeat)
+    else:
+        metrics = run_database_stage(stage, database, repeat, budget)
+    metrics['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(metrics))
+
+
+def run_suite(args):
+    databases = [entry.strip() for entry in args.databases.split(',') if entry.strip()]
+    pairs = [(stage, None) for stage in MATCHER_STAGES if stage in args.stages]
+    paths = {database: database_path(database) for database in databases}
+    pairs += [(stage, database) for database in databases for stage in DATABASE_STAGES
+              if stage in args.stages]
+
+    results = []
+    for stage, database in pairs:
+        command = [sys.executable, __file__, 'worker', stage, '--repeat', str(args.repeat),
+                   '--budget', str(args.budget)]
+        env = dict(os.environ)
+        if database is not None:
+            command += ['--database', paths[database]]
+            # Settings are read at import, so each worker serves its own database
+            env['LAB_DB_PATH'] = paths[database]
+        output = subprocess.run(command, cwd=ROOT, env=env, check=True, capture_output=True,
+                                text=True).stdout
+        metrics = json.loads(output.strip().splitlines()[-1])
+        result = {'stage': stage, 'database': database, **metrics}
+        results.append(result)
+        print(format_result(result), file=sys.stderr)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+def format_result(result):
+    label = f"{result['stage']}@{result['database'] or '-'}"
+    if not result['samples']:
+        return f"{label:<22} no samples (skipped {result['skipped']}, invalid {result['invalid']})"
+    return (f"{label:<22} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+            f"p99 {result['p99_ms']:9.3f} ms  {result['throughput_per_sec']:10.1f}/s  "
+            f"peak {result['peak_rss_mb']:7.1f} MB  errors {result['errors']}  "
+            f"skipped {result['skipped']}  invalid {result['invalid']}")
+
+
+def regressions(baseline, current, tolerance=0.2, min_delta_ms=MIN_DELTA_MS):
+    """
+    Compares two reports and lists the metrics that got worse beyond tolerance.
+
+    :param baseline: Report produced by an earlier run.
+    :param current: Report to check.
+    :param tolerance: Allowed relative change, e.g. 0.2 for 20%.
+    :param min_delta_ms: Latency increases below this many milliseconds are ignored.
+    :return: List of (stage, database, metric, baseline value, current value).
+    """
+    previous = {(result['stage'], result['database']): result for result in baseline['results']}
+    found = []
+    for result in current['results']:
+        before = previous.get((result['stage'], result['database']))
+        if before is None:
+            continue
+        for metric, larger_is_worse in COMPARED_METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if larger_is_worse:
+                worse = new > old * (1 + tolerance)
+                if metric.endswith('_ms'):
+                    worse = worse and new - old > min_delta_ms
+            else:
+                worse = new < old / (1 + tolerance)
+            if worse:
+                found.append((result['stage'], result['database'], metric, old, new))
+    return found
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)
+    found = regressions(baseline, current, args.tolerance, args.min_delta_ms)
+    for stage, database, metric, old, new in found:
+        change = f' ({(new - old) / old:+.0%})' if old else ''
+        print(f"REGRESSION {stage}@{database or '-'} {metric}: {old:.3f} -> {new:.3f}{change}")
+    print(f"{len(found)} regression(s) beyond {args.tolerance:.0%}")
+    return 1 if found else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the suite and write a JSON report')
+    run.add_argument('--databases', default=DEFAULT_DATABASES,
+                     help="comma-separated 'lab' or synthetic row counts (see db.generate_database)")
+    run.add_argument('--stages', default=','.join(MATCHER_STAGES + DATABASE_STAGES))
+    run.add_argument('--repeat', type=int, default=3, help='passes over the catalog per stage')
+    run.add_argument('--budget', type=float, default=STATEMENT_BUDGET,
+                     help='seconds after which a template is skipped on a database')
+    run.add_argument('--output', help='write the report here instead of stdout')
+
+    check = commands.add_parser('compare', help='flag regressions against a stored baseline')
+    check.add_argument('baseline')
+    check.add_argument('current')
+    check.add_argument('--tolerance', type=float, default=0.2)
+    check.add_argument('--min-delta-ms', type=float, default=MIN_DELTA_MS)
+
+    worker = commands.add_parser('worker')
+    worker.add_argument('stage', choices=MATCHER_STAGES + DATABASE_STAGES)
+    worker.add_argument('--database')
+    worker.add_argument('--repeat', type=int, default=3)
+    worker.add_argument('--budget', type=float, default=STATEMENT_BUDGET)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        args.stages = args.stages.split(',')
+        run_suite(args)
+    elif args.command == 'compare':
+        return compare(args)
+    else:
+        run_worker(args.stage, args.database, args.repeat, args.budget)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
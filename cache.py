@@ -0,0 +1,106 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by LRUCache.get when a key is absent or expired
+MISSING = object()
+
+
+class LRUCache:
+    """
+    A thread-safe LRU cache with an optional time-to-live, an optional total weight
+    bound and hit/miss/eviction counters.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, max_weight=None):
+        """
+        :param maxsize: Maximum number of entries kept before the least recently used is evicted.
+        :param ttl: Seconds an entry stays valid, or None to keep entries until evicted.
+        :param max_weight: Maximum total weight (e.g. bytes) of the entries, or None for no bound.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weight = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        """
+        Returns the cached value for a key and marks it as most recently used.
+
+        :param key: The cache key.
+        :param default: Value returned on a miss.
+        :return: The cached value, or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, weight = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.weight -= weight
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value, weight=1):
+        """
+        Stores a value, evicting least recently used entries beyond maxsize or max_weight.
+
+        :param key: The cache key.
+        :param value: The value to cache.
+        :param weight: Weight of the value counted against max_weight.
+        :return: False if the value alone exceeds max_weight and was not stored.
+        """
+        if self.max_weight is not None and weight > self.max_weight:
+            return False
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.weight -= previous[2]
+            self._entries[key] = (value, expires_at, weight)
+            self.weight += weight
+            while len(self._entries) > self.maxsize or (
+                    self.max_weight is not None and self.weight > self.max_weight):
+                _, (_, _, evicted_weight) = self._entries.popitem(last=False)
+                self.weight -= evicted_weight
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        """Drops every entry; the counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        :return: Dict with size, maxsize, weight, hits, misses, evictions, expirations and hit_rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'weight': self.weight,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
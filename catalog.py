@@ -0,0 +1,609 @@
+# catalog.py
+"""
+Editable NL->SQL catalog with incremental matcher index updates.
+
+The catalog lives in a SQLite store seeded from similarity.PREDEFINED_QUERIES. Every
+add, update and delete is recorded in a change log with a catalog version. Running
+matchers do not refit TF-IDF on each change. A CatalogIndex layers the changes over
+the last compiled (memory-mapped) MatcherIndex:
+- changed or deleted rows are masked out;
+- new rows are vectorized with the compiled IDF weights, and terms the compiled
+  vocabulary lacks get a weight fixed when they are first seen.
+Applying a change costs the same whatever the catalog size. compact() refits the model
+over the live catalog, publishes it as the new compiled index and truncates the log.
+Until then, scores differ from a full refit only through the deferred IDF update.
+
+Questions may be templates with typed slots (see templates.py):
+    python catalog.py add "Find lab tests in {department} under {price}." \
+        "SELECT name FROM LabTests WHERE department_id =
+            (SELECT id FROM Departments WHERE name = :department) AND price < :price;"
+
+Usage:
+    python catalog.py list
+    python catalog.py add "Question?" "SELECT ...;"
+    python catalog.py update "Question?" "SELECT ...;"
+    python catalog.py delete "Question?"
+    python catalog.py import templates.json    # {"question": "sql", ...}
+    python catalog.py compact
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from matcher_index import TOKEN_PATTERN, build_index, catalog_hash, load_index, save_index
+from retrieval import top_n_indices
+from templates import parse_template
+
+# SQLite file holding the catalog and its change log
+CATALOG_PATH = os.environ.get(
+    'LAB_CATALOG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.db'),
+)
+# Pending changes after which the catalog CLI compacts on its own
+COMPACT_AFTER = 1000
+
+
+def catalog_key(question):
+    """
+    Returns the identity of a question: case and spacing do not make a new entry.
+
+    :param question: Natural language question.
+    :return: Normalized key string.
+    """
+    return ' '.join(question.split()).casefold()
+
+
+class CatalogStore:
+    """
+    SQLite-backed catalog with a change log.
+
+    Questions are unique by catalog_key(). Every write bumps the catalog version and
+    logs the changed key, so readers catch up by replaying only what changed.
+    Entries from the seed catalog are marked built-in and follow edits of the seed;
+    entries added or edited through the store are left alone.
+    """
+
+    def __init__(self, path=CATALOG_PATH, seed=None):
+        """
+        :param path: Path of the SQLite store, created if missing.
+        :param seed: Optional mapping of built-in questions to SQL to keep in sync.
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS queries (
+                key TEXT PRIMARY KEY,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                builtin INTEGER NOT NULL DEFAULT 0,
+                position INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS queries_position ON queries (position);
+            CREATE TABLE IF NOT EXISTS changes (
+                version INTEGER PRIMARY KEY,
+                key TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            );
+        ''')
+        self._data_version = None
+        if seed is not None:
+            self.sync_builtin(seed)
+
+    def _meta(self, name, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE name = ?;', (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, name, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?);', (name, str(value)))
+
+    def _write(self, apply):
+        # One IMMEDIATE transaction per write, so concurrent writers serialize cleanly
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE;')
+            try:
+                version = int(self._meta('version', 0))
+                changed = apply()
+                for offset, key in enumerate(changed, 1):
+                    self._conn.execute('INSERT INTO changes (version, key) VALUES (?, ?);', (version + offset, key))
+                self._set_meta('version', version + len(changed))
+                self._conn.execute('COMMIT;')
+            except BaseException:
+                self._conn.execute('ROLLBACK;')
+                raise
+            # data_version only moves for other connections' commits, so flag our own
+            self._data_version = None
+        return version + len(changed)
+
+    def _upsert(self, question, sql, builtin):
+        # Rejects templates whose slots and SQL parameters disagree
+        parse_template(question, sql)
+        key = catalog_key(question)
+        position = self._conn.execute('SELECT IFNULL(MAX(position), 0) + 1 FROM queries;').fetchone()[0]
+        # A changed entry moves to the end, matching where the index appends it
+        self._conn.execute('INSERT OR REPLACE INTO queries (key, question, sql, builtin, position) '
+                           'VALUES (?, ?, ?, ?, ?);', (key, question, sql, builtin, position))
+        return key
+
+    def add(self, question, sql):
+        """
+        Adds a question; a question with the same key must not exist yet.
+
+        :param question: Natural language question.
+        :param sql: SQL answering it.
+        :return: The new catalog version.
+        :raises ValueError: If the question is already in the catalog, or its slots
+            and SQL parameters disagree.
+        """
+        def apply():
+            if self._conn.execute('SELECT 1 FROM queries WHERE key = ?;', (catalog_key(question),)).fetchone():
+                raise ValueError(f'{question!r} is already in the catalog')
+            return [self._upsert(question, sql, 0)]
+        return self._write(apply)
+
+    def update(self, question, sql):
+        """
+        Replaces the SQL of an existing question.
+
+        :raises KeyError: If the question is not in the catalog.
+        :return: The new catalog version.
+        """
+        def apply():
+            if not self._conn.execute('SELECT 1 FROM queries WHERE key = ?;', (catalog_key(question),)).fetchone():
+                raise KeyError(question)
+            return [self._upsert(question, sql, 0)]
+        return self._write(apply)
+
+    def put_many(self, queries):
+        """
+        Adds or replaces many questions in one transaction.
+
+        :param queries: Mapping of questions to SQL.
+        :return: The new catalog version.
+        """
+        def apply():
+            # Later duplicates of a key win, like in a dict literal
+            latest = {catalog_key(question): (question, sql) for question, sql in queries.items()}
+            return [self._upsert(question, sql, 0) for question, sql in latest.values()]
+        return self._write(apply)
+
+    def delete(self, question):
+        """
+        Removes a question.
+
+        :raises KeyError: If the question is not in the catalog.
+        :return: The new catalog version.
+        """
+        def apply():
+            key = catalog_key(question)
+            if self._conn.execute('DELETE FROM queries WHERE key = ?;', (key,)).rowcount == 0:
+                raise KeyError(question)
+            return [key]
+        return self._write(apply)
+
+    def sync_builtin(self, seed):
+        """
+        Brings the built-in entries in line with the seed catalog when it changed.
+
+        :param seed: Mapping of built-in questions to SQL.
+        """
+        seed_hash = catalog_hash(seed)
+        with self._lock:
+            if self._meta('seed_hash') == seed_hash:
+                return
+
+        def apply():
+            current = dict(self._conn.execute('SELECT key, builtin FROM queries;').fetchall())
+            changed = []
+            for question, sql in seed.items():
+                key = catalog_key(question)
+                if current.get(key, 1) == 0:
+                    continue  # edited or added through the store
+                row = self._conn.execute('SELECT question, sql FROM queries WHERE key = ?;', (key,)).fetchone()
+                if row != (question, sql):
+                    changed.append(self._upsert(question, sql, 1))
+            seed_keys = {catalog_key(question) for question in seed}
+            for key, builtin in current.items():
+                if builtin and key not in seed_keys:
+                    self._conn.execute('DELETE FROM queries WHERE key = ?;', (key,))
+                    changed.append(key)
+            self._set_meta('seed_hash', seed_hash)
+            return list(dict.fromkeys(changed))
+        self._write(apply)
+
+    def items(self):
+        """
+        Returns the catalog in order.
+
+        :return: Tuple of (version, list of (question, sql)).
+        """
+        with self._lock:
+            self._conn.execute('BEGIN;')
+            try:
+                version = int(self._meta('version', 0))
+                rows = self._conn.execute('SELECT question, sql FROM queries ORDER BY position;').fetchall()
+            finally:
+                self._conn.execute('COMMIT;')
+        return version, rows
+
+    def changes_since(self, version):
+        """
+        Returns the current state of every key changed after a version.
+
+        :param version: Catalog version the caller has applied.
+        :return: Tuple of (current version, list of (key, question, sql) in order of
+            their last change; question and sql are None for deleted keys), or None if
+            the log no longer reaches back to `version`.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN;')
+            try:
+                current = int(self._meta('version', 0))
+                if version < int(self._meta('log_start', 0)):
+                    return None
+                rows = self._conn.execute('''
+                    SELECT changes.key, queries.question, queries.sql
+                    FROM (SELECT key, MAX(version) AS version FROM changes WHERE version > ? GROUP BY key) AS changes
+                    LEFT JOIN queries ON queries.key = changes.key
+                    ORDER BY changes.version;
+                ''', (version,)).fetchall()
+            finally:
+                self._conn.execute('COMMIT;')
+        return current, rows
+
+    def version(self):
+        with self._lock:
+            return int(self._meta('version', 0))
+
+    def changed(self):
+        """
+        Returns whether another connection has committed since the last call.
+        """
+        with self._lock:
+            data_version = self._conn.execute('PRAGMA data_version;').fetchone()[0]
+            changed, self._data_version = data_version != self._data_version, data_version
+        return changed
+
+    def base(self):
+        """
+        Returns the compiled index the log is relative to.
+
+        :return: Tuple of (catalog hash, version), or (None, 0) before the first compaction.
+        """
+        with self._lock:
+            return self._meta('base_hash'), int(self._meta('base_version', 0))
+
+    def set_base(self, base_hash, version):
+        """
+        Records a compiled index of the catalog at `version` and drops the log up to it.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE;')
+            self._set_meta('base_hash', base_hash)
+            self._set_meta('base_version', version)
+            self._set_meta('log_start', version)
+            self._conn.execute('DELETE FROM changes WHERE version <= ?;', (version,))
+            self._conn.execute('COMMIT;')
+            self._data_version = None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM queries;').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+class CatalogIndex:
+    """
+    A compiled MatcherIndex plus the catalog changes made since it was built.
+
+    Rows 0..B-1 are the compiled rows and rows B.. are appended changes; replaced
+    and deleted rows are masked. Instances are immutable: apply() returns a new one
+    that shares the compiled index, so a running matcher swaps versions with a single
+    assignment and in-flight searches keep the version they started with.
+    """
+
+    def __init__(self, base, base_sql, version, base_rows=None):
+        """
+        :param base: The compiled MatcherIndex.
+        :param base_sql: SQL of each compiled row, in row order.
+        :param version: Catalog version the compiled index reflects.
+        :param base_rows: Optional precomputed mapping of catalog_key -> compiled row.
+        """
+        self.base = base
+        self.base_sql = base_sql
+        self.version = version
+        self.base_rows = base_rows if base_rows is not None else {
+            catalog_key(question): row for row, question in enumerate(base.keys)}
+        self.added = ()          # (question, sql) of rows B..
+        self.added_rows = {}     # catalog_key -> row of the live appended rows
+        self.removed = frozenset()
+        self.extra_terms = {}    # terms missing from the compiled vocabulary -> column
+        self.extra_idf = np.empty(0)
+        self.added_matrix = csr_matrix((0, len(base.terms)))
+
+    @property
+    def catalog_hash(self):
+        return f'{self.base.catalog_hash}:{self.version}'
+
+    @property
+    def terms(self):
+        return np.concatenate([self.base.terms, np.asarray(list(self.extra_terms), dtype=str)])
+
+    @property
+    def pending(self):
+        """Number of changes layered over the compiled index."""
+        return len(self.added) + len(self.removed)
+
+    def __len__(self):
+        return len(self.base.keys) + len(self.added) - len(self.removed)
+
+    def question(self, row):
+        base_rows = len(self.base.keys)
+        return self.base.keys[row] if row < base_rows else self.added[row - base_rows][0]
+
+    def sql(self, row):
+        base_rows = len(self.base.keys)
+        return self.base_sql[row] if row < base_rows else self.added[row - base_rows][1]
+
+    def _vectorize(self, preprocessed_texts, vocabulary, idf):
+        data, indices, indptr = [], [], [0]
+        for text in preprocessed_texts:
+            counts = {}
+            for token in TOKEN_PATTERN.findall(text):
+                column = vocabulary(token)
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+            columns = sorted(counts)
+            indices.extend(columns)
+            data.extend(counts[column] * idf[column] for column in columns)
+            indptr.append(len(indices))
+        values = np.asarray(data, dtype=np.float64)
+        indptr = np.asarray(indptr, dtype=np.int32)
+        rows = np.repeat(np.arange(len(preprocessed_texts)), np.diff(indptr))
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(preprocessed_texts)))
+        if len(values):
+            values /= norms[rows]
+        width = len(self.base.terms) + len(self.extra_terms)
+        return csr_matrix((values, np.asarray(indices, dtype=np.int32), indptr),
+                          shape=(len(preprocessed_texts), width))
+
+    def _vocabulary(self, token):
+        column = self.base.vocabulary.get(token)
+        if column is None:
+            column = self.extra_terms.get(token)
+        return column
+
+    def transform(self, preprocessed_texts):
+        """
+        Vectorizes preprocessed texts over the compiled and the extra vocabulary.
+
+        :param preprocessed_texts: List of preprocessed query strings.
+        :return: CSR matrix with one L2-normalized TF-IDF row per text.
+        """
+        idf = np.concatenate([self.base.idf, self.extra_idf])
+        return self._vectorize(preprocessed_texts, self._vocabulary, idf)
+
+    def apply(self, changes, preprocess, version):
+        """
+        Returns a new CatalogIndex with changes layered on top of this one.
+
+        Costs O(changes + rows already layered), independent of the catalog size.
+
+        :param changes: List of (key, question, sql) from CatalogStore.changes_since.
+        :param preprocess: Function used to normalize natural language text.
+        :param version: Catalog version after the changes.
+        :return: The new CatalogIndex.
+        """
+        index = CatalogIndex(self.base, self.base_sql, version, self.base_rows)
+        index.extra_terms = dict(self.extra_terms)
+        added = list(self.added)
+        added_rows = dict(self.added_rows)
+        removed = set(self.removed)
+        new_rows = []
+        for key, question, sql in changes:
+            row = added_rows.pop(key, None)
+            if row is None:
+                row = self.base_rows.get(key)
+            if row is not None:
+                removed.add(row)
+            if question is not None:
+                added_rows[key] = len(self.base.keys) + len(added)
+                added.append((question, sql))
+                new_rows.append(preprocess(question))
+        live = len(self.base.keys) + len(added) - len(removed)
+        # Deferred IDF: a term the compiled model lacks is weighted as if it occurred
+        # once in the live catalog, and keeps that weight until the next compaction
+        extra_idf = list(self.extra_idf)
+        for text in new_rows:
+            for token in TOKEN_PATTERN.findall(text):
+                if self.base.vocabulary.get(token) is None and token not in index.extra_terms:
+                    index.extra_terms[token] = len(self.base.terms) + len(index.extra_terms)
+                    extra_idf.append(math.log((1 + live) / 2) + 1)
+        index.extra_idf = np.asarray(extra_idf, dtype=np.float64)
+        index.added = tuple(added)
+        index.added_rows = added_rows
+        index.removed = frozenset(removed)
+        width = len(self.base.terms) + len(index.extra_terms)
+        previous = self.added_matrix
+        previous = csr_matrix((previous.data, previous.indices, previous.indptr), shape=(previous.shape[0], width))
+        index.added_matrix = vstack([previous, index.transform(new_rows)], format='csr')
+        return index
+
+    def scores(self, vectors):
+        """
+        Cosine similarity of query vectors to every row; masked rows score -1.
+
+        :param vectors: CSR matrix from transform().
+        :return: Dense array of shape (queries, rows).
+        """
+        base_terms = len(self.base.terms)
+        similarities = (vectors[:, :base_terms] @ self.base.matrix.T).toarray()
+        if len(self.added):
+            similarities = np.hstack([similarities, (vectors @ self.added_matrix.T).toarray()])
+        if self.removed:
+            similarities[:, sorted(self.removed)] = -1.0
+        return similarities
+
+    def search(self, retriever, vector, n, threshold):
+        """
+        Finds the top N live rows for one query vector.
+
+        The compiled rows are searched with the retriever, asking for enough extra
+        matches to cover masked rows; appended rows are scored exactly.
+
+        :param retriever: A retrieval backend bound to self.base.
+        :param vector: 1 x vocabulary CSR row from transform().
+        :param n: Number of matches to return.
+        :param threshold: Minimum similarity score to consider a match.
+        :return: Tuple of (row indices, similarities), best match first.
+        """
+        base_terms = len(self.base.terms)
+        base_removed = len(self.removed) - sum(row >= len(self.base.keys) for row in self.removed)
+        docs, scores = retriever.search(vector[:, :base_terms], n + base_removed, threshold)
+        if not self.pending:
+            return docs, scores
+        if self.removed:
+            live = np.fromiter((doc not in self.removed for doc in docs), dtype=bool, count=len(docs))
+            docs, scores = docs[live], scores[live]
+        if len(self.added):
+            added_scores = (vector @ self.added_matrix.T).toarray()[0]
+            added_docs = np.arange(len(self.base.keys), len(self.base.keys) + len(self.added))
+            keep = np.fromiter((doc not in self.removed for doc in added_docs), dtype=bool, count=len(added_docs))
+            keep &= np.round(added_scores, 12) >= threshold
+            docs = np.concatenate([docs, added_docs[keep]])
+            scores = np.concatenate([scores, added_scores[keep]])
+        if len(docs) == 0:
+            return docs, scores
+        # Candidates in row order, so ties still go to the earlier catalog row
+        order = np.argsort(docs, kind='stable')
+        docs, scores = docs[order], scores[order]
+        best = top_n_indices(scores[np.newaxis, :], n)[0]
+        return docs[best].astype(np.intp), scores[best]
+
+
+def compact(store, preprocess, path):
+    """
+    Refits the matcher over the live catalog and publishes it as the compiled index.
+
+    The index is written and renamed into place before the store points at it, so
+    readers never see a store referring to an index that is not on disk yet.
+
+    :param store: The CatalogStore.
+    :param preprocess: Function used to normalize natural language text.
+    :param path: Directory of the compiled index.
+    :return: The new CatalogIndex, with nothing layered on top.
+    """
+    version, rows = store.items()
+    queries = dict(rows)
+    base = build_index(queries, preprocess)
+    try:
+        save_index(base, path)
+        base = load_index(path, base.catalog_hash) or base
+    except OSError:
+        # A read-only deployment can still serve from the in-memory index
+        pass
+    store.set_base(base.catalog_hash, version)
+    return CatalogIndex(base, [sql for _, sql in rows], version)
+
+
+def load_catalog_index(store, preprocess, path):
+    """
+    Loads the compiled index the store refers to and replays the changes since.
+
+    Compacts first when there is no usable compiled index.
+
+    :return: A CatalogIndex for the store's current version.
+    """
+    base_hash, base_version = store.base()
+    base = load_index(path, base_hash) if base_hash else None
+    if base is None and base_hash and store.base()[0] != base_hash:
+        # Another process compacted between reading the store and the index
+        base_hash, base_version = store.base()
+        base = load_index(path, base_hash)
+    if base is None:
+        return compact(store, preprocess, path)
+
+    current = store.changes_since(base_version)
+    if current is None:
+        return compact(store, preprocess, path)
+    version, changes = current
+    sql_by_key = {catalog_key(question): sql for question, sql in store.items()[1]}
+    # Changed rows are masked by the replay, so their current SQL is never read
+    index = CatalogIndex(base, [sql_by_key.get(catalog_key(question)) for question in base.keys], base_version)
+    return index.apply(changes, preprocess, version) if changes else index
+
+
+def refresh(index, store, preprocess, path):
+    """
+    Brings a CatalogIndex up to the store's current version.
+
+    :return: The same index if nothing changed, otherwise a new one.
+    """
+    if not store.changed():
+        return index
+    base_hash, _ = store.base()
+    if base_hash != index.base.catalog_hash:
+        # Another process compacted: switch to its compiled index
+        return load_catalog_index(store, preprocess, path)
+    current = store.changes_since(index.version)
+    if current is None:
+        return load_catalog_index(store, preprocess, path)
+    version, changes = current
+    if version == index.version:
+        return index
+    return index.apply(changes, preprocess, version)
+
+
+def main():
+    from similarity import INDEX_PATH, get_store, preprocess_question
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['list', 'add', 'update', 'delete', 'import', 'compact'])
+    parser.add_argument('arguments', nargs='*')
+    args = parser.parse_args()
+
+    store = get_store()
+    if args.command == 'list':
+        version, rows = store.items()
+        for question, sql in rows:
+            print(f'{question}\t{sql}')
+        print(f'{len(rows)} questions, catalog version {version}', file=sys.stderr)
+        return 0
+    try:
+        if args.command == 'add':
+            store.add(*args.arguments)
+        elif args.command == 'update':
+            store.update(*args.arguments)
+        elif args.command == 'delete':
+            store.delete(*args.arguments)
+        elif args.command == 'import':
+            with open(args.arguments[0], encoding='utf-8') as f:
+                store.put_many(json.load(f))
+    except (KeyError, ValueError, TypeError) as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+
+    _, base_version = store.base()
+    if args.command == 'compact' or store.version() - base_version >= COMPACT_AFTER:
+        index = compact(store, preprocess_question, INDEX_PATH)
+        print(f'Compiled {len(index)} questions at catalog version {index.version}.')
+    else:
+        print(f'Catalog version {store.version()} ({store.version() - base_version} changes since compaction).')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
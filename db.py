@@ -1,10 +1,32 @@
 # create_db.py
+import argparse
 import sqlite3
+import time
+import numpy as np
 
-def create_database():
-    conn = sqlite3.connect('lab.db')  # Database name is 'lab.db'
-    cursor = conn.cursor()
+# Secondary indexes proposed by index_advisor.py for the catalog templates,
+# as (name, table, columns). Most are covering for the templates they serve.
+INDEXES = [
+    ('idx_employees_department_id_name_salary', 'Employees', ('department_id', 'name', 'salary')),
+    ('idx_labtests_department_id_name_price', 'LabTests', ('department_id', 'name', 'price')),
+    ('idx_employees_salary_name_age', 'Employees', ('salary', 'name', 'age')),
+    ('idx_departments_name', 'Departments', ('name',)),
+    ('idx_employees_role_name_age', 'Employees', ('role', 'name', 'age')),
+    ('idx_labtests_price_name_normal_range', 'LabTests', ('price', 'name', 'normal_range')),
+    ('idx_employees_age', 'Employees', ('age',)),
+    ('idx_labtests_name_normal_range_department_id', 'LabTests', ('name', 'normal_range', 'department_id')),
+    ('idx_employees_name_age_department_id', 'Employees', ('name', 'age', 'department_id')),
+]
+
+# Journal mode of generated databases (persistent, stored in the file)
+JOURNAL_MODE = 'WAL'
 
+def create_schema(cursor):
+    """
+    Creates the Departments, LabTests and Employees tables if they do not exist.
+
+    :param cursor: A cursor on the target database.
+    """
     # Create Departments table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS Departments (
@@ -39,6 +61,183 @@ def create_database():
         );
     ''')
 
+def create_indexes(cursor):
+    """
+    Creates the secondary indexes in INDEXES; safe to run repeatedly.
+
+    :param cursor: A cursor on the target database.
+    """
+    for name, table, columns in INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)});')
+
+def add_indexes(database='lab.db'):
+    """
+    Adds the INDEXES to an existing database and refreshes planner statistics.
+
+    :param database: Path to the SQLite database file.
+    """
+    conn = sqlite3.connect(database)
+    try:
+        create_indexes(conn.cursor())
+        conn.execute('ANALYZE;')
+        conn.commit()
+    finally:
+        conn.close()
+
+# Per-department rollups kept current by triggers, as (summary table, base table,
+# row count column, measured columns). Each measured column gets _count, _sum, _min
+# and _max columns; summaries.ROUTES answers aggregate templates from them.
+SUMMARY_TABLES = [
+    ('DepartmentLabTestSummary', 'LabTests', 'test_count', ('price',)),
+    ('DepartmentEmployeeSummary', 'Employees', 'employee_count', ('salary', 'age')),
+]
+
+def summary_triggers(summary):
+    """
+    Returns the names of the insert, delete and update triggers maintaining a summary table.
+    """
+    return [f'{summary}_{event}' for event in ('insert', 'delete', 'update')]
+
+def _summary_add(summary, count_column, measures, row):
+    # Adds one base row (NEW) to its department's summary row; rows without a
+    # department never appear in the per-department rollups
+    columns = ['department_id', count_column]
+    values = [f'{row}.department_id', '1']
+    updates = [f'{count_column} = {count_column} + 1']
+    for column in measures:
+        value = f'{row}.{column}'
+        columns += [f'{column}_count', f'{column}_sum', f'{column}_min', f'{column}_max']
+        values += [f'{value} IS NOT NULL', f'IFNULL({value}, 0)', value, value]
+        updates += [
+            f'{column}_count = {column}_count + ({value} IS NOT NULL)',
+            f'{column}_sum = {column}_sum + IFNULL({value}, 0)',
+            # Scalar MIN/MAX return NULL if either side is NULL, so fall back to the other
+            f'{column}_min = COALESCE(MIN({column}_min, {value}), {column}_min, {value})',
+            f'{column}_max = COALESCE(MAX({column}_max, {value}), {column}_max, {value})',
+        ]
+    return [f'INSERT INTO {summary} ({", ".join(columns)}) SELECT {", ".join(values)} '
+            f'WHERE {row}.department_id IS NOT NULL '
+            f'ON CONFLICT (department_id) DO UPDATE SET {", ".join(updates)};']
+
+def _summary_remove(summary, table, count_column, measures, row):
+    # Removes one base row (OLD); an extreme is recomputed from the department's rows
+    # only when the removed value was that extreme
+    department = f'{row}.department_id'
+    updates = [f'{count_column} = {count_column} - 1']
+    recompute = []
+    for column in measures:
+        value = f'{row}.{column}'
+        updates += [
+            f'{column}_count = {column}_count - ({value} IS NOT NULL)',
+            # Reset the sum exactly once no values are left, so rounding cannot linger
+            f'{column}_sum = CASE WHEN {column}_count - ({value} IS NOT NULL) = 0 THEN 0 '
+            f'ELSE {column}_sum - IFNULL({value}, 0) END',
+        ]
+        recompute.append(
+            f'UPDATE {summary} SET '
+            f'{column}_min = (SELECT MIN({column}) FROM {table} WHERE department_id = {department}), '
+            f'{column}_max = (SELECT MAX({column}) FROM {table} WHERE department_id = {department}) '
+            f'WHERE department_id = {department} AND ({value} <= {column}_min OR {value} >= {column}_max);')
+    return ([f'UPDATE {summary} SET {", ".join(updates)} WHERE department_id = {department};']
+            + recompute
+            + [f'DELETE FROM {summary} WHERE department_id = {department} AND {count_column} = 0;'])
+
+def create_summary_tables(cursor):
+    """
+    Creates the SUMMARY_TABLES with their maintenance triggers and fills them from the
+    base tables. Safe to run repeatedly; each run recomputes the summaries.
+
+    :param cursor: A cursor on the target database.
+    """
+    for summary, table, count_column, measures in SUMMARY_TABLES:
+        definitions = [f'{count_column} INTEGER NOT NULL']
+        for column in measures:
+            definitions += [f'{column}_count INTEGER NOT NULL', f'{column}_sum REAL NOT NULL',
+                            f'{column}_min REAL', f'{column}_max REAL']
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {summary} (
+                department_id INTEGER PRIMARY KEY,
+                {", ".join(definitions)}
+            );
+        ''')
+
+        # A NULL department matches no summary row, so removals need no guard either
+        insert_trigger, delete_trigger, update_trigger = summary_triggers(summary)
+        add = _summary_add(summary, count_column, measures, 'NEW')
+        remove = _summary_remove(summary, table, count_column, measures, 'OLD')
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {insert_trigger} AFTER INSERT ON {table} '
+                       f'BEGIN {" ".join(add)} END;')
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {delete_trigger} AFTER DELETE ON {table} '
+                       f'BEGIN {" ".join(remove)} END;')
+        # An update removes the old row and adds the new one
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {update_trigger} '
+                       f'AFTER UPDATE OF department_id, {", ".join(measures)} ON {table} '
+                       f'BEGIN {" ".join(remove + add)} END;')
+        refresh_summary_table(cursor, summary)
+
+def refresh_summary_table(cursor, summary):
+    """
+    Recomputes one summary table from its base table.
+
+    :param cursor: A cursor on the target database.
+    :param summary: Name of a table in SUMMARY_TABLES.
+    """
+    cursor.execute(f'DELETE FROM {summary};')
+    cursor.execute(summary_query(summary).replace('SELECT', f'INSERT INTO {summary} SELECT', 1))
+
+def summary_query(summary):
+    """
+    Returns a query computing a summary table's rows directly from its base table.
+
+    :param summary: Name of a table in SUMMARY_TABLES.
+    :return: SQL string.
+    """
+    table, count_column, measures = next((table, count_column, measures)
+                                         for name, table, count_column, measures in SUMMARY_TABLES
+                                         if name == summary)
+    expressions = ['department_id', 'COUNT(*)']
+    for column in measures:
+        expressions += [f'COUNT({column})', f'TOTAL({column})', f'MIN({column})', f'MAX({column})']
+    return (f'SELECT {", ".join(expressions)} FROM {table} '
+            f'WHERE department_id IS NOT NULL GROUP BY department_id ORDER BY department_id;')
+
+def drop_summary_triggers(cursor):
+    """
+    Drops the summary maintenance triggers, e.g. before a bulk load. The summaries are
+    stale until create_summary_tables runs again, and are not routed to meanwhile.
+
+    :param cursor: A cursor on the target database.
+    """
+    for summary, _, _, _ in SUMMARY_TABLES:
+        for trigger in summary_triggers(summary):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger};')
+
+def add_summary_tables(database='lab.db'):
+    """
+    Adds the SUMMARY_TABLES and their triggers to an existing database.
+
+    :param database: Path to the SQLite database file.
+    """
+    conn = sqlite3.connect(database)
+    try:
+        create_summary_tables(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
+
+def _is_empty(cursor, table):
+    return cursor.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {table});').fetchone()[0] == 1
+
+def create_database():
+    conn = sqlite3.connect('lab.db')  # Database name is 'lab.db'
+    cursor = conn.cursor()
+    # Readers never block the writer in WAL mode; the mode is stored in the file, so
+    # pools opening it read-only leave it alone
+    cursor.execute(f'PRAGMA journal_mode={JOURNAL_MODE};')
+
+    create_schema(cursor)
+    create_indexes(cursor)
+
     # Insert sample data into Departments
     departments = [
         ('Hematology', 'First Floor'),
@@ -47,7 +246,8 @@ def create_database():
         ('Immunology', 'Fourth Floor'),
         ('Pathology', 'Fifth Floor')
     ]
-    cursor.executemany('INSERT INTO Departments (name, location) VALUES (?, ?);', departments)
+    if _is_empty(cursor, 'Departments'):
+        cursor.executemany('INSERT INTO Departments (name, location) VALUES (?, ?);', departments)
 
     # Insert sample data into LabTests
     lab_tests = [
@@ -62,7 +262,8 @@ def create_database():
         ('Vitamin D Level', 2, 80.0, '20-50 ng/mL'),
         ('Sputum Culture', 3, 90.0, 'No growth or specific pathogen identification')
     ]
-    cursor.executemany('INSERT INTO LabTests (name, department_id, price, normal_range) VALUES (?, ?, ?, ?);', lab_tests)
+    if _is_empty(cursor, 'LabTests'):
+        cursor.executemany('INSERT INTO LabTests (name, department_id, price, normal_range) VALUES (?, ?, ?, ?);', lab_tests)
 
     # Insert sample data into Employees with 'age' and 'salary'
     employees = [
@@ -77,11 +278,217 @@ def create_database():
         ('Ian Malcolm', 'Senior Analyst', 3, 50, 95000),
         ('Jenny Lind', 'Lab Technician', 1, 26, 49000)
     ]
-    cursor.executemany('INSERT INTO Employees (name, role, department_id, age, salary) VALUES (?, ?, ?, ?, ?);', employees)
+    if _is_empty(cursor, 'Employees'):
+        cursor.executemany('INSERT INTO Employees (name, role, department_id, age, salary) VALUES (?, ?, ?, ?, ?);', employees)
 
+    create_summary_tables(cursor)
     conn.commit()
     conn.close()
     print("Database 'lab.db' created and populated with mock data successfully.")
 
+# Synthetic data generator. Values follow the mock data above (same department
+# names, floors, roles and tests) so every catalog template selects something.
+SYNTHETIC_DEPARTMENTS = ['Hematology', 'Biochemistry', 'Microbiology', 'Immunology', 'Pathology']
+SYNTHETIC_FLOORS = ['First Floor', 'Second Floor', 'Third Floor', 'Fourth Floor', 'Fifth Floor']
+# (role, share of employees, base salary)
+SYNTHETIC_ROLES = [
+    ('Lab Technician', 0.50, 50000),
+    ('Senior Analyst', 0.20, 88000),
+    ('Quality Control', 0.18, 66000),
+    ('Lab Manager', 0.12, 76000),
+]
+SYNTHETIC_TESTS = [
+    ('Complete Blood Count (CBC)', '4.5-11.0 x10^9/L'),
+    ('Lipid Panel', 'Total Cholesterol: <200 mg/dL'),
+    ('Urinalysis', 'Various parameters depending on the test'),
+    ('Blood Glucose', '70-99 mg/dL'),
+    ('Thyroid Stimulating Hormone (TSH)', '0.4-4.0 mIU/L'),
+    ('Hepatitis Panel', 'Depends on specific markers'),
+    ('Prostate-Specific Antigen (PSA)', '0-4 ng/mL'),
+    ('C-Reactive Protein (CRP)', '<10 mg/L'),
+    ('Vitamin D Level', '20-50 ng/mL'),
+    ('Sputum Culture', 'No growth or specific pathogen identification'),
+]
+FIRST_NAMES = ['Alice', 'Bob', 'Charlie', 'Diana', 'Ethan', 'Fiona', 'George', 'Hannah', 'Ian', 'Jenny',
+               'Kevin', 'Laura', 'Miguel', 'Nora', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tara']
+LAST_NAMES = ['Johnson', 'Smith', 'Lee', 'Prince', 'Hunt', 'Gallagher', 'Costanza', 'Baker', 'Malcolm',
+              'Lind', 'Garcia', 'Chen', 'Okafor', 'Novak', 'Patel', 'Silva', 'Kim', 'Rossi', 'Murphy', 'Khan']
+
+# Rows inserted per transaction while bulk loading
+LOAD_BATCH_SIZE = 100000
+# Bulk-load settings: WAL keeps the file consistent if the loader is killed, and
+# skipping fsync is acceptable because a lost batch is simply reloaded on restart
+LOAD_PRAGMAS = {
+    'journal_mode': JOURNAL_MODE,
+    'synchronous': 'OFF',
+    'cache_size': -262144,  # ~256 MB
+    'temp_store': 'MEMORY',
+}
+
+def synthetic_row_counts(scale, departments=None):
+    """
+    Splits a total row count across the three tables.
+
+    Lab tests get 40% and employees the rest, with one department per 10,000 rows
+    (at least 5, at most 5,000) unless the department count is given.
+
+    :param scale: Approximate total number of rows (1k to 50M).
+    :param departments: Optional fixed number of departments.
+    :return: Dict mapping table name to row count, in load order.
+    """
+    if departments is None:
+        departments = min(5000, max(len(SYNTHETIC_DEPARTMENTS), scale // 10000))
+    lab_tests = max(1, (scale - departments) * 2 // 5)
+    return {
+        'Departments': departments,
+        'LabTests': lab_tests,
+        'Employees': max(1, scale - departments - lab_tests),
+    }
+
+def _department_weights(departments, seed):
+    # Department sizes follow a Zipf-like law: a few large departments, a long tail
+    weights = 1.0 / np.arange(1, departments + 1) ** 0.9
+    np.random.default_rng([seed, 0]).shuffle(weights)
+    return weights / weights.sum()
+
+def _synthetic_rows(table, start, count, departments, seed):
+    """
+    Generates rows start+1 .. start+count of a table, with explicit ids.
+
+    Every batch draws from its own seeded generator, so a resumed load produces
+    exactly the rows an uninterrupted one would.
+    """
+    rng = np.random.default_rng([seed, len(table), start])
+    ids = list(range(start + 1, start + count + 1))
+    if table == 'Departments':
+        return [(i, SYNTHETIC_DEPARTMENTS[i - 1] if i <= len(SYNTHETIC_DEPARTMENTS) else f'Department {i}',
+                 SYNTHETIC_FLOORS[(i - 1) % len(SYNTHETIC_FLOORS)])
+                for i in ids]
+
+    department_ids = (rng.choice(departments, size=count, p=_department_weights(departments, seed)) + 1).tolist()
+    if table == 'LabTests':
+        tests = rng.integers(len(SYNTHETIC_TESTS), size=count).tolist()
+        prices = np.round(rng.lognormal(np.log(55), 0.5, size=count), 2).tolist()
+        return [(i, f'{SYNTHETIC_TESTS[t][0]} #{i}', d, p, SYNTHETIC_TESTS[t][1])
+                for i, t, d, p in zip(ids, tests, department_ids, prices)]
+
+    roles = rng.choice(len(SYNTHETIC_ROLES), size=count, p=[share for _, share, _ in SYNTHETIC_ROLES])
+    ages = np.clip(np.round(rng.normal(38, 9, size=count)), 21, 67).astype(int)
+    base_salaries = np.array([base for _, _, base in SYNTHETIC_ROLES])[roles]
+    # Pay rises with age on top of the role's base, plus noise
+    salaries = np.round(base_salaries + (ages - 21) * 600 + rng.normal(0, 4000, size=count), -2)
+    first = rng.integers(len(FIRST_NAMES), size=count).tolist()
+    last = rng.integers(len(LAST_NAMES), size=count).tolist()
+    return [(i, f'{FIRST_NAMES[f]} {LAST_NAMES[l]}', SYNTHETIC_ROLES[r][0], d, a, s)
+            for i, f, l, r, d, a, s in zip(ids, first, last, roles.tolist(), department_ids,
+                                           ages.tolist(), salaries.tolist())]
+
+_SYNTHETIC_INSERTS = {
+    'Departments': 'INSERT OR REPLACE INTO Departments (id, name, location) VALUES (?, ?, ?);',
+    'LabTests': 'INSERT OR REPLACE INTO LabTests (id, name, department_id, price, normal_range) VALUES (?, ?, ?, ?, ?);',
+    'Employees': 'INSERT OR REPLACE INTO Employees (id, name, role, department_id, age, salary) VALUES (?, ?, ?, ?, ?, ?);',
+}
+
+def generate_database(database, scale, seed=0, batch_size=LOAD_BATCH_SIZE, departments=None, verbose=True):
+    """
+    Fills a database with synthetic data at the given scale.
+
+    Rows are loaded in large single-transaction batches with explicit ids, and each
+    table's progress is committed together with its batch. Re-running the same call
+    resumes an interrupted load and does nothing once it has finished. Secondary
+    indexes and summary triggers are dropped during the load, and the indexes and
+    summary tables are built once at the end.
+
+    :param database: Path to the SQLite database file to create or resume.
+    :param scale: Approximate total number of rows (1k to 50M).
+    :param seed: Random seed; a resumed load must use the same one.
+    :param batch_size: Rows per transaction.
+    :param departments: Optional fixed number of departments (see synthetic_row_counts).
+    :param verbose: Print progress and rows/sec.
+    :return: Dict with the rows loaded by this call, elapsed seconds and rows_per_sec.
+    """
+    counts = synthetic_row_counts(scale, departments)
+    conn = sqlite3.connect(database, isolation_level=None)
+    for name, value in LOAD_PRAGMAS.items():
+        conn.execute(f'PRAGMA {name}={value};')
+    cursor = conn.cursor()
+    create_schema(cursor)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS SyntheticLoad (
+            table_name TEXT PRIMARY KEY,
+            target_rows INTEGER NOT NULL,
+            rows_loaded INTEGER NOT NULL,
+            seed INTEGER NOT NULL
+        );
+    ''')
+    for table, target in counts.items():
+        cursor.execute('INSERT OR IGNORE INTO SyntheticLoad VALUES (?, ?, 0, ?);', (table, target, seed))
+        existing = cursor.execute('SELECT target_rows, seed FROM SyntheticLoad WHERE table_name = ?;',
+                                  (table,)).fetchone()
+        if existing != (target, seed):
+            conn.close()
+            raise ValueError(f"'{database}' holds a load of {existing[0]} {table} rows with seed {existing[1]}; "
+                             f"resume it with the same scale and seed")
+
+    progress = dict(cursor.execute('SELECT table_name, rows_loaded FROM SyntheticLoad;').fetchall())
+    pending = any(progress[table] < target for table, target in counts.items())
+    if pending:
+        # Deferred index build: one sort at the end beats maintaining indexes per row
+        for name, _, _ in INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {name};')
+        # Likewise the summaries are recomputed once instead of maintained per row
+        drop_summary_triggers(cursor)
+
+    start = time.perf_counter()
+    loaded_now = 0
+    for table, target in counts.items():
+        loaded = progress[table]
+        while loaded < target:
+            count = min(batch_size, target - loaded)
+            rows = _synthetic_rows(table, loaded, count, counts['Departments'], seed)
+            cursor.execute('BEGIN;')
+            cursor.executemany(_SYNTHETIC_INSERTS[table], rows)
+            cursor.execute('UPDATE SyntheticLoad SET rows_loaded = ? WHERE table_name = ?;',
+                           (loaded + count, table))
+            cursor.execute('COMMIT;')
+            loaded += count
+            loaded_now += count
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f"{table}: {loaded:,}/{target:,} rows ({loaded_now / elapsed:,.0f} rows/sec)")
+
+    if pending or not _has_indexes_and_summaries(cursor):
+        index_start = time.perf_counter()
+        create_indexes(cursor)
+        cursor.execute('BEGIN;')
+        create_summary_tables(cursor)
+        cursor.execute('COMMIT;')
+        cursor.execute('ANALYZE;')
+        if verbose:
+            print(f"Indexes and summary tables built in {time.perf_counter() - index_start:.1f}s")
+    conn.close()
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = loaded_now / elapsed if elapsed else 0.0
+    if verbose:
+        print(f"Loaded {loaded_now:,} rows into '{database}' in {elapsed:.1f}s ({rows_per_sec:,.0f} rows/sec)")
+    return {'rows': loaded_now, 'seconds': elapsed, 'rows_per_sec': rows_per_sec}
+
+def _has_indexes_and_summaries(cursor):
+    existing = {name for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger');")}
+    triggers = [trigger for summary, _, _, _ in SUMMARY_TABLES for trigger in summary_triggers(summary)]
+    return all(name in existing for name, _, _ in INDEXES) and all(name in existing for name in triggers)
+
 if __name__ == "__main__":
-    create_database()
+    parser = argparse.ArgumentParser(description="Create lab.db with mock data, or a synthetic database at scale.")
+    parser.add_argument('--scale', type=int, help="total synthetic rows to generate (1k to 50M)")
+    parser.add_argument('--database', default='lab_synthetic.db', help="synthetic database path")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=LOAD_BATCH_SIZE)
+    parser.add_argument('--departments', type=int, help="fixed number of departments")
+    args = parser.parse_args()
+    if args.scale:
+        generate_database(args.database, args.scale, seed=args.seed, batch_size=args.batch_size,
+                          departments=args.departments)
+    else:
+        create_database()
@@ -0,0 +1,360 @@
+# executor.py
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import tracing
+from cache import MISSING
+from pool import POOL_SIZE, get_pool
+from query_cache import get_result_cache
+from streaming import CHUNK_SIZE, MAX_ROWS
+from summaries import route
+
+# Wall-clock budget of one query, counted from when it starts running
+QUERY_TIMEOUT = float(os.environ.get('LAB_DB_QUERY_TIMEOUT', '30'))
+# A query still running after this many seconds counts as heavy: it is stopped and
+# started over on one of HEAVY_QUERY_SLOTS workers of its own, so runaway queries
+# cannot occupy the workers and connections of light ones
+HEAVY_QUERY_SECONDS = 0.5
+HEAVY_QUERY_SLOTS = int(os.environ.get('LAB_DB_HEAVY_QUERY_SLOTS', '2'))
+# Light queries running at once per process; further submissions wait in line. With
+# the heavy workers they never need more than POOL_SIZE connections
+MAX_CONCURRENT_QUERIES = max(1, POOL_SIZE - HEAVY_QUERY_SLOTS)
+# SQLite virtual machine steps between budget and cancellation checks
+PROGRESS_STEPS = 10000
+
+
+class QueryCancelled(Exception):
+    """Raised by QueryHandle.result() when the query was cancelled."""
+
+
+class QueryTimeout(Exception):
+    """Raised by QueryHandle.result() when the query exceeded its time budget."""
+
+
+class QueryHandle:
+    """
+    A query submitted to a QueryExecutor.
+
+    status moves from 'queued' to 'running' (and 'waiting' while a query promoted to
+    heavy waits for a heavy worker) and ends as 'done', 'cancelled', 'timeout' or 'failed'.
+    """
+
+    def __init__(self, sql_query, params, timeout, max_rows, write=None):
+        self.sql_query = sql_query
+        self.params = params
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.write = write
+        self.status = 'queued'
+        self.truncated = False
+        self.rows_fetched = 0
+        self.heavy = False
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._future = None
+        self._heavy_future = None
+        self._conn = None
+        self._cancelled = False
+        self._timed_out = False
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        """Seconds since the query started running (0 while queued)."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def done(self):
+        return self._future.done()
+
+    def cancel(self):
+        """
+        Stops the query: a queued query never starts, a running one is interrupted.
+        """
+        with self._lock:
+            self._cancelled = True
+            if self._future.cancel():
+                self.status = 'cancelled'
+            elif self._conn is not None:
+                self._conn.interrupt()
+            elif self._heavy_future is not None:
+                # Waiting for a heavy worker; the executor resolves it as cancelled
+                self._heavy_future.cancel()
+
+    def result(self, timeout=None):
+        """
+        Waits for the query and returns its result.
+
+        :param timeout: Seconds to wait; concurrent.futures.TimeoutError if exceeded.
+        :return: Tuple of (columns, rows), or (columns, what write returned) for a
+            query submitted with write.
+        :raises QueryCancelled: If the query was cancelled.
+        :raises QueryTimeout: If the query ran out of its time budget.
+        """
+        if self._future.cancelled():
+            raise QueryCancelled('Query cancelled before it started')
+        return self._future.result(timeout)
+
+
+# Returned by QueryExecutor._attempt when the query moves to a heavy worker
+_PROMOTED = object()
+
+
+class QueryExecutor:
+    """
+    Runs queries on background threads with time and row budgets.
+
+    A progress handler installed on the borrowed connection aborts the query once it
+    is cancelled or over its wall-clock budget, and cancel() also calls interrupt()
+    to stop it at once. A query still running after heavy_after seconds is aborted
+    as well: its connection goes back to the pool, and it starts over on one of a
+    few heavy workers, within the budget it started with. Light queries therefore
+    keep their workers and latency while runaway ones queue behind each other.
+    """
+
+    def __init__(self, pool=None, max_workers=MAX_CONCURRENT_QUERIES, heavy_slots=HEAVY_QUERY_SLOTS,
+                 heavy_after=HEAVY_QUERY_SECONDS, timeout=QUERY_TIMEOUT, max_rows=MAX_ROWS):
+        """
+        :param pool: Connection pool to borrow from, defaults to the shared pool.
+        :param max_workers: Light queries running at once.
+        :param heavy_slots: Heavy queries running at once, on workers of their own; a
+            pool needs max_workers + heavy_slots connections.
+        :param heavy_after: Seconds after which a running query counts as heavy.
+        :param timeout: Default wall-clock budget per query, in seconds.
+        :param max_rows: Default cap on rows fetched per query.
+        """
+        self.pool = pool
+        self.heavy_after = heavy_after
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+        self._heavy_threads = ThreadPoolExecutor(max_workers=heavy_slots, thread_name_prefix='heavy-query')
+        self.completed = 0
+        self.promoted = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.failed = 0
+
+    def submit(self, sql_query, params=(), timeout=None, max_rows=None, write=None):
+        """
+        Queues a query and returns immediately.
+
+        Statements on the shared database are routed to its summary tables where
+        possible (see summaries.route), and their results are served from and stored in
+        the result cache, unless a non-default row cap or write is given. Truncated
+        results are not cached.
+
+        :param sql_query: The SQL query string to execute.
+        :param params: Parameters bound to the query.
+        :param timeout: Wall-clock budget in seconds, defaults to the executor's.
+        :param max_rows: Stop fetching after this many rows and mark the result truncated.
+        :param write: Optional function called with (columns, iterator of row chunks)
+            that consumes the rows instead of keeping them, e.g. to stream them to a
+            file. It is called again from scratch if the query is promoted to heavy.
+        :return: A QueryHandle.
+        """
+        if self.pool is None:
+            sql_query = route(sql_query)
+        handle = QueryHandle(sql_query, tuple(params), timeout or self.timeout,
+                             self.max_rows if max_rows is None else max_rows, write)
+        cacheable = self.pool is None and handle.max_rows == self.max_rows and write is None
+        if cacheable:
+            result = get_result_cache().get(sql_query, params)
+            if result is not MISSING:
+                handle.status = 'done'
+                handle._future = self._completed(result)
+                return handle
+        handle._future = Future()
+        # The query thread runs in the caller's context, so its spans join the caller's trace
+        self._threads.submit(contextvars.copy_context().run, self._run, handle, cacheable)
+        return handle
+
+    def run(self, sql_query, params=(), timeout=None, max_rows=None):
+        """
+        Executes a query on the executor and waits for it.
+
+        :return: Tuple of (columns, rows, truncated); truncated is True if rows stop
+            at the row cap and the query had more.
+        """
+        handle = self.submit(sql_query, params, timeout, max_rows)
+        columns, rows = handle.result()
+        return columns, rows, handle.truncated
+
+    @staticmethod
+    def _completed(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def _run(self, handle, cacheable):
+        # Runs on a light worker, and once more on a heavy worker if it is promoted
+        if not handle.heavy:
+            if not handle._future.set_running_or_notify_cancel():
+                return  # cancelled while queued
+            handle.started_at = time.monotonic()
+        handle.status = 'running'
+        try:
+            result = self._attempt(handle, cacheable)
+        except BaseException as e:
+            handle.finished_at = time.monotonic()
+            handle._future.set_exception(e)
+            return
+        if result is _PROMOTED:
+            self._requeue(handle, cacheable)
+            return
+        handle.finished_at = time.monotonic()
+        handle.status = 'done'
+        self.completed += 1
+        handle._future.set_result(result)
+
+    def _attempt(self, handle, cacheable):
+        light = not handle.heavy
+        deadline = handle.started_at + handle.timeout
+        pool = self.pool or get_pool()
+        try:
+            with tracing.span('sqlite', heavy=handle.heavy) as query_span:
+                if cacheable:
+                    # submit() already missed the cache; only the version is taken here
+                    result_cache = get_result_cache()
+                    database_token, data_version = result_cache.version()
+                try:
+                    result = self._fetch(pool, handle, deadline)
+                except sqlite3.OperationalError:
+                    if not (light and handle.heavy) or handle._cancelled or handle._timed_out:
+                        raise
+                    # Aborted by _check to move to a heavy worker; the connection is back in the pool
+                    query_span.set('promoted', True)
+                    return _PROMOTED
+                if cacheable and not handle.truncated:
+                    result_cache.put(handle.sql_query, result, handle.params, database_token, data_version)
+                query_span.count('rows', handle.rows_fetched)
+        except sqlite3.OperationalError as e:
+            if handle._cancelled:
+                handle.status = 'cancelled'
+                self.cancelled += 1
+                raise QueryCancelled('Query cancelled') from None
+            if handle._timed_out:
+                handle.status = 'timeout'
+                self.timeouts += 1
+                raise QueryTimeout(f'Query exceeded its {handle.timeout:g}s time budget') from None
+            handle.status = 'failed'
+            self.failed += 1
+            raise e
+        except BaseException:
+            handle.status = 'failed'
+            self.failed += 1
+            raise
+        return result
+
+    def _requeue(self, handle, cacheable):
+        handle.status = 'waiting'
+        self.promoted += 1
+        context = contextvars.copy_context()
+        with handle._lock:
+            if not handle._cancelled:
+                handle._heavy_future = self._heavy_threads.submit(context.run, self._run, handle, cacheable)
+        if handle._heavy_future is None:
+            self._cancel_waiting(handle)
+        else:
+            handle._heavy_future.add_done_callback(
+                lambda future: future.cancelled() and self._cancel_waiting(handle))
+
+    def _cancel_waiting(self, handle):
+        # A promoted query cancelled before a heavy worker picked it up
+        handle.status = 'cancelled'
+        handle.finished_at = time.monotonic()
+        self.cancelled += 1
+        handle._future.set_exception(QueryCancelled('Query cancelled'))
+
+    def _fetch(self, pool, handle, deadline):
+        with pool.connection() as conn:
+            with handle._lock:
+                if handle._cancelled:
+                    raise sqlite3.OperationalError('interrupted')
+                handle._conn = conn
+            conn.set_progress_handler(lambda: self._check(handle, deadline), PROGRESS_STEPS)
+            try:
+                cursor = conn.execute(handle.sql_query, handle.params)
+                columns = [description[0] for description in cursor.description or ()]
+                chunks = self._chunks(cursor, handle)
+                if handle.write is not None:
+                    return columns, handle.write(columns, chunks)
+                return columns, [row for chunk in chunks for row in chunk]
+            finally:
+                with handle._lock:
+                    handle._conn = None
+                conn.set_progress_handler(None, 0)
+
+    @staticmethod
+    def _chunks(cursor, handle):
+        handle.rows_fetched = 0
+        while True:
+            size = CHUNK_SIZE
+            if handle.max_rows is not None:
+                size = min(size, handle.max_rows - handle.rows_fetched)
+                if size <= 0:
+                    handle.truncated = cursor.fetchone() is not None
+                    return
+            chunk = cursor.fetchmany(size)
+            if not chunk:
+                return
+            handle.rows_fetched += len(chunk)
+            yield chunk
+
+    def _check(self, handle, deadline):
+        # Runs inside SQLite every PROGRESS_STEPS steps; a non-zero return aborts the query
+        if handle._cancelled:
+            return 1
+        now = time.monotonic()
+        if now > deadline:
+            handle._timed_out = True
+            return 1
+        if not handle.heavy and now - handle.started_at > self.heavy_after:
+            # Waiting for a heavy worker here would hold this worker and connection,
+            # so the query is aborted and requeued instead (see _run)
+            handle.heavy = True
+            return 1
+        return 0
+
+    def stats(self):
+        """
+        Returns executor counters.
+
+        :return: Dict with completed, cancelled, timeouts, failed and promoted (queries
+            moved to a heavy worker).
+        """
+        return {
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'timeouts': self.timeouts,
+            'failed': self.failed,
+            'promoted': self.promoted,
+        }
+
+    def close(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        self._heavy_threads.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the process-wide executor for the shared pool, creating it on first use.
+
+    :return: The shared QueryExecutor.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = QueryExecutor()
+    return _executor
@@ -0,0 +1,281 @@
+# index_advisor.py
+"""
+Proposes secondary indexes for the SQL templates in PREDEFINED_QUERIES.
+
+Runs EXPLAIN QUERY PLAN for every catalog statement on a large synthetic copy of the
+schema, scores full scans, automatic indexes and temporary B-trees, and greedily picks
+the candidate indexes that remove the most of that cost. It then reports the plan and
+run time of each template before and after creating them.
+
+Usage:
+    python index_advisor.py [--scale N] [--departments N] [--json report.json]
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+import aggregates
+from db import create_schema, generate_database
+from similarity import PREDEFINED_QUERIES
+from templates import examples
+
+# Relative cost of plan steps. Scans and automatic indexes touch the whole table,
+# covering-index scans read a narrower structure, temp B-trees sort the rows read.
+SCAN_COST = 1.0
+COVERING_SCAN_COST = 0.4
+AUTOMATIC_INDEX_COST = 1.0
+TEMP_BTREE_COST = 0.3
+SEARCH_COST = 0.01
+# Correlated subqueries run once per outer row, so their steps are weighted up
+CORRELATED_MULTIPLIER = 10.0
+# Stop adding indexes once the best candidate saves less than this share of the cost
+MIN_IMPROVEMENT = 0.02
+# Per-template wall-clock budget when timing on the synthetic database
+TIME_BUDGET = 2.0
+
+SQLITE_READ = 20
+_PLAN_TABLE = re.compile(r'^(SCAN|SEARCH) (\w+)', re.IGNORECASE)
+
+
+def catalog_statements():
+    """
+    Returns the distinct statements of the catalog that are valid on the schema.
+
+    Parameterized templates are bound to templates.SAMPLE_VALUES.
+
+    :return: List of (SQL, params).
+    """
+    conn = aggregates.connect(':memory:')
+    create_schema(conn.cursor())
+    statements = []
+    for sql, params in examples(PREDEFINED_QUERIES):
+        try:
+            conn.execute('EXPLAIN ' + sql, params)
+            statements.append((sql, params))
+        except sqlite3.Error:
+            pass
+    conn.close()
+    return statements
+
+
+def columns_read(conn, sql, params=()):
+    """
+    Returns the {table: [columns]} a statement reads, as reported by SQLite's authorizer.
+    """
+    tables = {}
+
+    def authorizer(action, table, column, database, trigger):
+        if action == SQLITE_READ and table and column and not table.startswith('sqlite_'):
+            tables.setdefault(table, [])
+            if column not in tables[table]:
+                tables[table].append(column)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute('EXPLAIN ' + sql, params)
+    finally:
+        conn.set_authorizer(None)
+    return tables
+
+
+def explain(conn, sql, params=()):
+    """
+    Returns the EXPLAIN QUERY PLAN detail lines of a statement, indented by depth.
+    """
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+def plan_cost(conn, sql, table_rows, params=()):
+    """
+    Scores a statement's plan; lower is better.
+
+    :param table_rows: Mapping of lower-cased table name to row count.
+    """
+    cost = 0.0
+    correlated_depth = None
+    for line in explain(conn, sql, params):
+        depth = (len(line) - len(line.lstrip())) // 2
+        detail = line.strip()
+        if correlated_depth is not None and depth <= correlated_depth:
+            correlated_depth = None
+        if detail.startswith('CORRELATED'):
+            correlated_depth = depth
+            continue
+        weight = CORRELATED_MULTIPLIER if correlated_depth is not None else 1.0
+        match = _PLAN_TABLE.match(detail)
+        rows = table_rows.get(match.group(2).lower(), 0) if match else max(table_rows.values())
+        if detail.startswith('USE TEMP B-TREE'):
+            cost += weight * TEMP_BTREE_COST * rows
+        elif not match:
+            continue
+        elif 'AUTOMATIC' in detail:
+            cost += weight * AUTOMATIC_INDEX_COST * rows
+        elif match.group(1).upper() == 'SCAN':
+            covering = 'COVERING INDEX' in detail
+            cost += weight * (COVERING_SCAN_COST if covering else SCAN_COST) * rows
+        else:
+            cost += weight * SEARCH_COST * rows ** 0.5
+    return cost
+
+
+def candidate_indexes(conn, statements):
+    """
+    Derives candidate indexes from the columns each statement reads.
+
+    For every table a statement touches, each non-key column it reads may lead an index;
+    the remaining columns it reads from that table are appended to make it covering.
+
+    :param statements: List of (SQL, params), as from catalog_statements().
+    """
+    candidates = set()
+    for sql, params in statements:
+        for table, columns in columns_read(conn, sql, params).items():
+            columns = [column for column in columns if column.lower() != 'id']
+            for lead in columns:
+                candidates.add((table, (lead,)))
+                rest = tuple(column for column in columns if column != lead)
+                if rest:
+                    candidates.add((table, (lead,) + rest))
+    return sorted(candidates)
+
+
+def index_name(table, columns):
+    return 'idx_' + table.lower() + '_' + '_'.join(column.lower() for column in columns)
+
+
+def create_index(conn, table, columns):
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name(table, columns)} '
+                 f'ON {table} ({", ".join(columns)});')
+
+
+def advise(conn, statements):
+    """
+    Greedily selects the candidate indexes that most reduce the total plan cost.
+
+    :return: List of (table, columns, cost saved) in the order they were chosen.
+    """
+    table_rows = {table.lower(): conn.execute(f'SELECT COUNT(*) FROM {table};').fetchone()[0]
+                  for (table,) in conn.execute(
+                      "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';")}
+    reads = {statement: {table.lower() for table in columns_read(conn, *statement)} for statement in statements}
+    costs = {statement: plan_cost(conn, statement[0], table_rows, statement[1]) for statement in statements}
+    candidates = candidate_indexes(conn, statements)
+    chosen = []
+
+    while candidates:
+        total = sum(costs.values())
+        best = None
+        for table, columns in candidates:
+            affected = [statement for statement in statements if table.lower() in reads[statement]]
+            create_index(conn, table, columns)
+            new_costs = {statement: plan_cost(conn, statement[0], table_rows, statement[1]) for statement in affected}
+            conn.execute(f'DROP INDEX {index_name(table, columns)};')
+            saved = sum(costs[statement] - new_costs[statement] for statement in affected)
+            if best is None or saved > best[0]:
+                best = (saved, table, columns, new_costs)
+        saved, table, columns, new_costs = best
+        if saved <= MIN_IMPROVEMENT * total:
+            break
+        create_index(conn, table, columns)
+        costs.update(new_costs)
+        chosen.append((table, columns, saved))
+        candidates.remove((table, columns))
+        # Drop candidates that the chosen index already serves as a prefix
+        candidates = [(t, c) for t, c in candidates if not (t == table and columns[:len(c)] == c)]
+    return chosen
+
+
+def time_statement(conn, sql, budget=TIME_BUDGET, params=()):
+    """
+    Runs a statement to completion, or until the budget is spent.
+
+    :return: Elapsed seconds, or None if the budget ran out.
+    """
+    deadline = time.perf_counter() + budget
+    conn.set_progress_handler(lambda: int(time.perf_counter() > deadline), 10000)
+    start = time.perf_counter()
+    try:
+        conn.execute(sql, params).fetchall()
+        return time.perf_counter() - start
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=70000, help='synthetic rows (see db.generate_database)')
+    parser.add_argument('--departments', type=int, default=200)
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET, help='seconds per template run')
+    parser.add_argument('--json', help='write the full before/after report to this file')
+    args = parser.parse_args()
+
+    statements = catalog_statements()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'advisor.db')
+        generate_database(path, args.scale, departments=args.departments, verbose=False)
+        conn = aggregates.connect(path)
+        # Start from the bare schema so the advisor sees every scan
+        for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                  "AND name NOT LIKE 'sqlite_%';").fetchall():
+            conn.execute(f'DROP INDEX {name};')
+        conn.execute('ANALYZE;')
+
+        before = {(sql, params): (explain(conn, sql, params), time_statement(conn, sql, args.budget, params))
+                  for sql, params in statements}
+        chosen = advise(conn, statements)
+        conn.execute('ANALYZE;')
+        after = {(sql, params): (explain(conn, sql, params), time_statement(conn, sql, args.budget, params))
+                 for sql, params in statements}
+        conn.close()
+
+    def fmt(seconds):
+        return 'timeout' if seconds is None else f'{seconds * 1000:.1f} ms'
+
+    report = []
+    for statement in statements:
+        sql, params = statement
+        (plan_before, time_before), (plan_after, time_after) = before[statement], after[statement]
+        report.append({'sql': sql, 'params': list(params), 'plan_before': plan_before, 'plan_after': plan_after,
+                       'seconds_before': time_before, 'seconds_after': time_after})
+        if plan_before != plan_after:
+            print(f'\n{sql}' + (f'\n  params {list(params)}' if params else '') + f'\n  before ({fmt(time_before)}):')
+            print('\n'.join('    ' + line for line in plan_before))
+            print(f'  after ({fmt(time_after)}):')
+            print('\n'.join('    ' + line for line in plan_after))
+
+    # Compare totals over the templates that finished within budget both times
+    finished = [statement for statement in statements
+                if before[statement][1] is not None and after[statement][1] is not None]
+    timeouts_before = sum(t is None for _, t in before.values())
+    timeouts_after = sum(t is None for _, t in after.values())
+    print(f'\n{len(statements)} templates, {len(finished)} finished both times: '
+          f'{sum(before[statement][1] for statement in finished):.2f}s before, '
+          f'{sum(after[statement][1] for statement in finished):.2f}s after; '
+          f'timeouts {timeouts_before} before, {timeouts_after} after')
+    print('\nProposed indexes (for db.INDEXES):')
+    for table, columns, saved in chosen:
+        print(f"    ('{index_name(table, columns)}', '{table}', {columns!r}),  # saves {saved:,.0f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'indexes': [{'name': index_name(t, c), 'table': t, 'columns': list(c)}
+                                   for t, c, _ in chosen],
+                       'templates': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
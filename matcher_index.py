@@ -0,0 +1,247 @@
+# matcher_index.py
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Bump when the on-disk layout or the preprocessing pipeline changes so stale
+# indexes are rebuilt instead of silently producing different vectors.
+INDEX_FORMAT_VERSION = 4
+
+# Same token pattern TfidfVectorizer uses by default, so vectors built here
+# match the ones the fitted vectorizer would produce.
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+META_FILE = 'meta.json'
+ARRAY_FILES = ('terms', 'idf', 'data', 'indices', 'indptr',
+               'posting_indptr', 'posting_docs', 'posting_weights', 'term_max')
+
+
+def catalog_hash(queries):
+    """
+    Computes a content hash of the NL->SQL catalog.
+
+    :param queries: Mapping of natural language queries to SQL queries.
+    :return: Hex digest identifying the catalog contents and their order.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(INDEX_FORMAT_VERSION).encode('utf-8'))
+    for nl_query, sql in queries.items():
+        digest.update(nl_query.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(sql.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class MatcherIndex:
+    """
+    A compiled TF-IDF index over the predefined queries.
+
+    Holds the vocabulary, IDF weights, the L2-normalized CSR document matrix and
+    its term-major transpose (posting lists with per-term maximum weights).
+    Arrays loaded from disk are memory-mapped, so several processes share a
+    single page-cached copy.
+    """
+
+    def __init__(self, terms, idf, matrix, keys, catalog_hash, postings=None):
+        self.terms = terms
+        self.idf = idf
+        self.matrix = matrix
+        self.keys = keys
+        self.catalog_hash = catalog_hash
+        self.vocabulary = {str(term): i for i, term in enumerate(terms)}
+        if postings is None:
+            postings = build_postings(matrix)
+        self.posting_indptr, self.posting_docs, self.posting_weights, self.term_max = postings
+
+    def postings(self, term):
+        """
+        Returns the posting list of a term.
+
+        :param term: Column index of the term.
+        :return: Tuple of (sorted document row indices, their TF-IDF weights).
+        """
+        start, end = self.posting_indptr[term], self.posting_indptr[term + 1]
+        return self.posting_docs[start:end], self.posting_weights[start:end]
+
+    def transform(self, preprocessed_texts):
+        """
+        Vectorizes preprocessed texts the same way the fitted TfidfVectorizer would.
+
+        :param preprocessed_texts: List of preprocessed query strings.
+        :return: CSR matrix with one L2-normalized TF-IDF row per text.
+        """
+        data, indices, indptr = [], [], [0]
+        for text in preprocessed_texts:
+            counts = {}
+            for token in TOKEN_PATTERN.findall(text):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    counts[column] = counts.get(column, 0) + 1
+            columns = sorted(counts)
+            indices.extend(columns)
+            data.extend(counts[column] for column in columns)
+            indptr.append(len(indices))
+
+        indices = np.asarray(indices, dtype=np.int32)
+        values = np.asarray(data, dtype=np.float64) * self.idf[indices]
+        indptr = np.asarray(indptr, dtype=np.int32)
+        # L2-normalize every row; rows with no known terms stay all-zero
+        rows = np.repeat(np.arange(len(preprocessed_texts)), np.diff(indptr))
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(preprocessed_texts)))
+        if len(values):
+            values /= norms[rows]
+        return csr_matrix((values, indices, indptr), shape=(len(preprocessed_texts), len(self.terms)))
+
+
+def build_postings(matrix):
+    """
+    Builds term-major posting lists from a CSR document matrix.
+
+    :param matrix: CSR matrix of shape (documents, terms).
+    :return: Tuple of (indptr, document indices, weights, maximum weight per term).
+    """
+    by_term = matrix.tocsc()
+    by_term.sort_indices()
+    term_max = np.zeros(matrix.shape[1])
+    if by_term.nnz:
+        nonempty = np.diff(by_term.indptr) > 0
+        term_max[nonempty] = np.maximum.reduceat(by_term.data, by_term.indptr[:-1][nonempty])
+    return by_term.indptr, by_term.indices, by_term.data, term_max
+
+
+def build_index(queries, preprocess):
+    """
+    Fits TF-IDF over the catalog and returns an in-memory index.
+
+    :param queries: Mapping of natural language queries to SQL queries.
+    :param preprocess: Function used to normalize natural language text.
+    :return: A MatcherIndex for the catalog.
+    """
+    # Imported here so serving processes never pay for loading scikit-learn
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    keys = list(queries.keys())
+    preprocessed_queries = [preprocess(query) for query in keys]
+    vectorizer = TfidfVectorizer().fit(preprocessed_queries)
+    matrix = vectorizer.transform(preprocessed_queries).tocsr()
+    matrix.sort_indices()
+    terms = np.asarray(vectorizer.get_feature_names_out(), dtype=str)
+    return MatcherIndex(terms, vectorizer.idf_.astype(np.float64), matrix, keys, catalog_hash(queries))
+
+
+def save_index(index, path):
+    """
+    Writes the index to a directory as .npy arrays plus a JSON metadata file.
+
+    The directory is written next to its final location and renamed into place,
+    so concurrent readers never observe a partially written index.
+
+    :param index: The MatcherIndex to persist.
+    :param path: Target directory.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.matcher_index-', dir=parent)
+    arrays = {
+        'terms': index.terms,
+        'idf': index.idf,
+        'data': index.matrix.data,
+        'indices': index.matrix.indices,
+        'indptr': index.matrix.indptr,
+        'posting_indptr': index.posting_indptr,
+        'posting_docs': index.posting_docs,
+        'posting_weights': index.posting_weights,
+        'term_max': index.term_max,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, name + '.npy'), np.ascontiguousarray(array))
+    meta = {
+        'format_version': INDEX_FORMAT_VERSION,
+        'catalog_hash': index.catalog_hash,
+        'shape': list(index.matrix.shape),
+        'keys': index.keys,
+    }
+    with open(os.path.join(staging, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+    if os.path.isdir(path):
+        retired = tempfile.mkdtemp(prefix='.matcher_index-old-', dir=parent)
+        os.rmdir(retired)
+        os.rename(path, retired)
+        os.rename(staging, path)
+        _remove_tree(retired)
+    else:
+        os.rename(staging, path)
+
+
+def load_index(path, expected_hash=None):
+    """
+    Loads a persisted index with its arrays memory-mapped read-only.
+
+    :param path: Directory written by save_index.
+    :param expected_hash: If given, the catalog hash the index must carry.
+    :return: The MatcherIndex, or None if it is missing, stale or unreadable.
+    """
+    try:
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != INDEX_FORMAT_VERSION:
+            return None
+        if expected_hash is not None and meta.get('catalog_hash') != expected_hash:
+            return None
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in ARRAY_FILES}
+    except (OSError, ValueError):
+        return None
+
+    matrix = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                        shape=tuple(meta['shape']), copy=False)
+    postings = (arrays['posting_indptr'], arrays['posting_docs'],
+                arrays['posting_weights'], arrays['term_max'])
+    return MatcherIndex(arrays['terms'], arrays['idf'], matrix, meta['keys'], meta['catalog_hash'], postings)
+
+
+def load_or_build_index(queries, preprocess, path):
+    """
+    Returns the persisted index for the catalog, rebuilding it if it is missing or stale.
+
+    :param queries: Mapping of natural language queries to SQL queries.
+    :param preprocess: Function used to normalize natural language text.
+    :param path: Directory holding the persisted index.
+    :return: A MatcherIndex for the catalog.
+    """
+    expected_hash = catalog_hash(queries)
+    index = load_index(path, expected_hash)
+    if index is not None:
+        return index
+
+    index = build_index(queries, preprocess)
+    try:
+        save_index(index, path)
+    except OSError:
+        # A read-only deployment can still serve from the in-memory index
+        return index
+    return load_index(path, expected_hash) or index
+
+
+def _remove_tree(path):
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+    os.rmdir(path)
+
+
+if __name__ == "__main__":
+    from catalog import compact
+    from similarity import INDEX_PATH, get_store, preprocess_question
+
+    target = sys.argv[1] if len(sys.argv) > 1 else INDEX_PATH
+    built = compact(get_store(), preprocess_question, target)
+    print(f"Matcher index for {len(built)} queries written to '{target}' "
+          f"(catalog hash {built.base.catalog_hash[:12]}, version {built.version}).")
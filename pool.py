@@ -0,0 +1,227 @@
+# pool.py
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import aggregates
+
+# Database served by the app and pool defaults, overridable from the environment
+DATABASE_PATH = os.environ.get('LAB_DB_PATH', 'lab.db')
+POOL_SIZE = int(os.environ.get('LAB_DB_POOL_SIZE', '8'))
+# Serve queries from an in-memory replica of the database (see replica.py)
+REPLICA = os.environ.get('LAB_DB_REPLICA', '0') == '1'
+
+# Prepared statements kept per connection; the catalog has a few hundred distinct queries
+CACHED_STATEMENTS = 512
+
+# Applied to every new connection
+CONNECTION_PRAGMAS = {
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,  # negative means KiB, i.e. ~16 MB of page cache
+    'temp_store': 'MEMORY',
+}
+
+# Idle connections older than this are checked with a trivial query before reuse
+HEALTH_CHECK_INTERVAL = 30.0
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the borrow timeout."""
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of read-only SQLite connections.
+
+    Connections are opened lazily up to `size`, keep their prepared-statement cache
+    between borrows, and are health-checked before reuse when they have been idle.
+    """
+
+    def __init__(self, database=DATABASE_PATH, size=POOL_SIZE, readonly=True,
+                 cached_statements=CACHED_STATEMENTS, pragmas=None, journal_mode=None,
+                 timeout=10.0):
+        """
+        :param database: Path to the SQLite database file.
+        :param size: Maximum number of open connections.
+        :param readonly: Open connections with a read-only URI.
+        :param cached_statements: Prepared statements cached per connection.
+        :param pragmas: Per-connection pragmas, defaults to CONNECTION_PRAGMAS.
+        :param journal_mode: Journal mode to set once on the database file, or None to
+            leave it; databases generated by db.py are already in WAL mode.
+        :param timeout: Seconds to wait for a free connection before raising PoolTimeout.
+        """
+        self.database = database
+        self.size = size
+        self.readonly = readonly
+        self.cached_statements = cached_statements
+        self.pragmas = CONNECTION_PRAGMAS if pragmas is None else pragmas
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self.borrows = 0
+        self.health_check_failures = 0
+        if journal_mode:
+            self._set_journal_mode(journal_mode)
+
+    def _set_journal_mode(self, journal_mode):
+        try:
+            conn = sqlite3.connect(self.database)
+            try:
+                conn.execute(f'PRAGMA journal_mode={journal_mode};')
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            # A read-only file or directory keeps its current journal mode
+            pass
+
+    def _open(self):
+        if self.readonly:
+            uri = Path(self.database).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+        return conn
+
+    def _connect(self):
+        conn = self._open()
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value};')
+        # Catalog templates use stddev/variance/median/percentile, which SQLite lacks
+        aggregates.register(conn)
+        with self._lock:
+            self._opened += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._opened -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1;').fetchone()
+            return True
+        except sqlite3.Error:
+            self.health_check_failures += 1
+            return False
+
+    def acquire(self):
+        """
+        Borrows a connection, opening one if the pool has not reached its size.
+
+        :return: An open sqlite3.Connection; hand it back with release().
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError('Connection pool is closed')
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection available within {self.timeout}s')
+        try:
+            while True:
+                try:
+                    conn, returned_at = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    break
+                if time.monotonic() - returned_at < HEALTH_CHECK_INTERVAL or self._healthy(conn):
+                    break
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.borrows += 1
+        return conn
+
+    def release(self, conn):
+        """
+        Returns a borrowed connection to the pool.
+
+        :param conn: A connection obtained from acquire().
+        """
+        try:
+            if self._closed:
+                self._discard(conn)
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that borrows a connection and always returns it.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Closes idle connections; borrowed ones are closed when released."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        """
+        Returns pool counters.
+
+        :return: Dict with size, open, idle, borrows and health_check_failures.
+        """
+        return {
+            'size': self.size,
+            'open': self._opened,
+            'idle': self._idle.qsize(),
+            'borrows': self.borrows,
+            'health_check_failures': self.health_check_failures,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide pool for DATABASE_PATH, creating it on first use.
+
+    Lives in this module rather than app.py because Streamlit re-executes the app
+    script on every interaction, while imported modules are kept. With LAB_DB_REPLICA=1
+    the pool serves an in-memory replica of the database instead of the file.
+
+    :return: The shared ConnectionPool.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if REPLICA:
+                    # Imported here: both modules build on this one
+                    from query_cache import get_result_cache
+                    from replica import ReplicaPool
+                    # Results read while the replica lagged behind the file are dropped
+                    # once it catches up
+                    _pool = ReplicaPool(on_refresh=lambda: get_result_cache().clear())
+                else:
+                    _pool = ConnectionPool()
+    return _pool
@@ -0,0 +1,244 @@
+# precompile.py
+"""
+Prepares catalog SQL against the live schema before anyone runs it.
+
+Every statement is compiled once per schema version (`PRAGMA schema_version`):
+EXPLAIN QUERY PLAN prepares it, which fails for unknown tables, columns and
+functions, and gives its plan. The statement wrapped as
+"SELECT * FROM (...) LIMIT 0" gives its result columns without reading any rows.
+get_top_n_sql_queries skips templates that do not compile, and the app shows the
+result headers while the rows are still being fetched.
+
+Usage:
+    python precompile.py [--database lab.db] [--json report.json]
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import aggregates
+from cache import MISSING, LRUCache
+from pool import DATABASE_PATH
+from query_cache import normalize_sql
+from templates import parse_template
+
+# Minimum seconds between checks of the database for schema changes
+SCHEMA_REFRESH_INTERVAL = 1.0
+# Compiled statements kept, keyed on the SQL
+COMPILED_CACHE_SIZE = 16384
+# SQLite virtual machine steps allowed while reading a statement's columns; LIMIT 0
+# stops before the first row, so this only guards against unusual plans
+COLUMN_PROBE_STEPS = 100000
+PROGRESS_STEPS = 1000
+
+Compiled = namedtuple('Compiled', 'sql valid error columns plan')
+
+class Precompiler:
+    """
+    Compiled catalog statements of one database, dropped when its schema changes.
+
+    The schema version is read on a dedicated read-only connection, at most every
+    refresh_interval seconds. A database that cannot be opened compiles nothing, and
+    every statement counts as valid.
+    """
+
+    def __init__(self, database=DATABASE_PATH, refresh_interval=SCHEMA_REFRESH_INTERVAL,
+                 cache_size=COMPILED_CACHE_SIZE):
+        """
+        :param database: Path to the SQLite database whose schema statements compile against.
+        :param refresh_interval: Minimum seconds between checks for schema changes.
+        :param cache_size: Compiled statements kept.
+        """
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self.compiled = LRUCache(maxsize=cache_size)
+        self.recompilations = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._schema_version = None
+        self._checked = None
+
+    def schema_version(self, force=False):
+        """
+        Returns the schema version, emptying the compiled statements if it changed.
+
+        :param force: Check now even if the last check was within refresh_interval.
+        :return: The `PRAGMA schema_version` value, or None if the database cannot be read.
+        """
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.refresh_interval:
+            return self._schema_version
+        with self._lock:
+            self._checked = now
+            try:
+                if self._conn is None:
+                    # Catalog templates use the aggregates registered on pooled connections
+                    self._conn = aggregates.connect(Path(self.database).resolve().as_uri() + '?mode=ro',
+                                                    uri=True, check_same_thread=False)
+                schema_version = self._conn.execute('PRAGMA schema_version;').fetchone()[0]
+            except sqlite3.Error:
+                schema_version = None
+            if schema_version != self._schema_version:
+                if self._schema_version is not None:
+                    self.recompilations += 1
+                self.compiled.clear()
+                self._schema_version = schema_version
+            return schema_version
+
+    def compile(self, sql, parameters=0):
+        """
+        Prepares a statement, or returns it as prepared for the current schema.
+
+        :param sql: SQL with positional ? parameters.
+        :param parameters: Number of parameters it takes.
+        :return: A Compiled of (sql, valid, error, columns, plan), or None if the
+            database cannot be read. columns is None if they could not be read.
+        """
+        if self.schema_version() is None:
+            return None
+        compiled = self.compiled.get(sql)
+        if compiled is MISSING:
+            with self._lock:
+                compiled = self._compile(sql, (None,) * parameters)
+                self.compiled.put(sql, compiled)
+        return compiled
+
+    def _compile(self, sql, params):
+        try:
+            rows = self._conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except (sqlite3.Error, ValueError) as e:
+            # ValueError: more than one statement
+            return Compiled(sql, False, str(e), None, ())
+        depth = {0: -1}
+        plan = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, -1) + 1
+            plan.append('  ' * depth[node_id] + detail)
+
+        steps = [0]
+
+        def probe_budget():
+            steps[0] += PROGRESS_STEPS
+            return steps[0] > COLUMN_PROBE_STEPS
+
+        columns = None
+        self._conn.set_progress_handler(probe_budget, PROGRESS_STEPS)
+        try:
+            cursor = self._conn.execute(f'SELECT * FROM ({normalize_sql(sql)}) LIMIT 0;', params)
+            # SQLite's names, so repeated ones stay apart as name:1, name:2, ...
+            columns = [description[0] for description in cursor.description]
+        except sqlite3.Error:
+            # Statements that are not plain selects still compile; their columns stay unknown
+            pass
+        finally:
+            self._conn.set_progress_handler(None, 0)
+        return Compiled(sql, True, None, columns, tuple(plan))
+
+    def is_valid(self, sql, parameters=0):
+        """
+        Whether a statement compiles on the current schema; True if the database cannot be read.
+        """
+        compiled = self.compile(sql, parameters)
+        return compiled is None or compiled.valid
+
+    def compile_catalog(self, entries):
+        """
+        Compiles every entry of a catalog.
+
+        :param entries: Iterable of (question, sql), with :name parameters for slots.
+        :return: List of (question, Compiled), in catalog order; entries whose slots
+            and parameters disagree are invalid. Empty if the database cannot be read.
+        """
+        results = []
+        for question, sql in entries:
+            try:
+                template = parse_template(question, sql)
+            except ValueError as e:
+                results.append((question, Compiled(sql, False, str(e), None, ())))
+                continue
+            compiled = self.compile(template.sql, len(template.parameters))
+            if compiled is None:
+                return []
+            results.append((question, compiled))
+        return results
+
+    def stats(self):
+        """
+        Returns compile counters.
+
+        :return: Dict with schema_version, compiled, recompilations and the cache counters.
+        """
+        stats = self.compiled.stats()
+        stats.update({
+            'schema_version': self._schema_version,
+            'compiled': len(self.compiled),
+            'recompilations': self.recompilations,
+        })
+        return stats
+
+
+_precompiler = None
+_precompiler_lock = threading.Lock()
+
+
+def get_precompiler():
+    """
+    Returns the process-wide precompiler for DATABASE_PATH, creating it on first use.
+
+    :return: The shared Precompiler.
+    """
+    global _precompiler
+    if _precompiler is None:
+        with _precompiler_lock:
+            if _precompiler is None:
+                _precompiler = Precompiler()
+    return _precompiler
+
+
+def report(results):
+    """
+    Summarizes compile_catalog() results.
+
+    :return: Dict with valid, invalid and, per statement, its question, SQL, error,
+        columns and plan.
+    """
+    return {
+        'valid': sum(compiled.valid for _, compiled in results),
+        'invalid': sum(not compiled.valid for _, compiled in results),
+        'statements': [{'question': question, **compiled._asdict()} for question, compiled in results],
+    }
+
+
+def main():
+    from similarity import get_store
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=DATABASE_PATH)
+    parser.add_argument('--json', help='write the columns, plans and errors of every statement here')
+    args = parser.parse_args()
+
+    precompiler = Precompiler(args.database)
+    _, entries = get_store().items()
+    results = precompiler.compile_catalog(entries)
+    if not results:
+        print(f'error: cannot read {args.database}', file=sys.stderr)
+        return 1
+    summary = report(results)
+    for question, compiled in results:
+        if not compiled.valid:
+            print(f'{question}\n  {compiled.sql}\n  error: {compiled.error}')
+    print(f"{summary['valid']} of {len(results)} catalog statements compile on {args.database} "
+          f"(schema version {precompiler.schema_version()}); {summary['invalid']} fail")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
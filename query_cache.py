@@ -0,0 +1,245 @@
+# query_cache.py
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from cache import MISSING, LRUCache
+from pool import DATABASE_PATH
+
+# In-memory tier bounds
+RESULT_CACHE_ENTRIES = 4096
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+# Optional on-disk tier shared by every worker process on the host (unset = disabled)
+RESULT_CACHE_PATH = os.environ.get('LAB_DB_RESULT_CACHE_PATH')
+RESULT_CACHE_DISK_BYTES = 512 * 1024 * 1024
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql_query):
+    """
+    Normalizes SQL text so trivially different spellings share a cache entry.
+
+    Collapses whitespace and drops trailing semicolons. Literals are left untouched.
+
+    :param sql_query: The SQL query string.
+    :return: The normalized SQL string.
+    """
+    return _WHITESPACE.sub(' ', sql_query).strip().rstrip(';').rstrip()
+
+
+class QueryResultCache:
+    """
+    Caches query results until the database changes.
+
+    The in-memory tier checks `PRAGMA data_version` on a dedicated connection, which
+    changes whenever any other connection or process commits. Any write therefore
+    invalidates every cached result. The optional on-disk tier is a SQLite file that
+    several worker processes share. data_version values are per connection, so disk
+    entries are validated against the size and modification times of the database
+    and its WAL file instead.
+    """
+
+    def __init__(self, database=DATABASE_PATH, max_entries=RESULT_CACHE_ENTRIES,
+                 max_bytes=RESULT_CACHE_BYTES, disk_path=RESULT_CACHE_PATH,
+                 max_disk_bytes=RESULT_CACHE_DISK_BYTES):
+        """
+        :param database: Path to the SQLite database whose results are cached.
+        :param max_entries: Maximum number of results kept in memory.
+        :param max_bytes: Maximum total pickled size of results kept in memory.
+        :param disk_path: Path of the shared on-disk tier, or None to disable it.
+        :param max_disk_bytes: Maximum total size of results kept on disk.
+        """
+        self.database = database
+        self.memory = LRUCache(maxsize=max_entries, max_weight=max_bytes)
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._watcher = sqlite3.connect(Path(database).resolve().as_uri() + '?mode=ro',
+                                        uri=True, check_same_thread=False)
+        self._data_version = self._read_data_version()
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, timeout=5.0, check_same_thread=False,
+                                         isolation_level=None)
+            self._disk.execute('PRAGMA journal_mode=WAL;')
+            self._disk.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key BLOB PRIMARY KEY,
+                    database_token TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+            ''')
+        self.disk_hits = 0
+        self.invalidations = 0
+
+    def _read_data_version(self):
+        with self._lock:
+            return self._watcher.execute('PRAGMA data_version;').fetchone()[0]
+
+    def _database_token(self):
+        # Commits touch the WAL file and checkpoints the main file, so together their
+        # sizes and modification times change on every write from any process
+        parts = []
+        for path in (self.database, self.database + '-wal'):
+            try:
+                stat = os.stat(path)
+                parts.append(f'{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}')
+            except FileNotFoundError:
+                parts.append('-')
+        return '|'.join(parts)
+
+    def _check_version(self):
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self.memory.clear()
+            self.invalidations += 1
+
+    @staticmethod
+    def key(sql_query, params=()):
+        return (normalize_sql(sql_query), tuple(params))
+
+    def get(self, sql_query, params=()):
+        """
+        Returns the cached result of a query if the database has not changed since.
+
+        :param sql_query: The SQL query string.
+        :param params: Parameters bound to the query.
+        :return: The cached result, or MISSING.
+        """
+        self._check_version()
+        key = self.key(sql_query, params)
+        result = self.memory.get(key)
+        if result is not MISSING or self._disk is None:
+            return result
+
+        row = self._disk_execute(
+            'SELECT database_token, payload FROM results WHERE key = ?;', (pickle.dumps(key),))
+        if row is None or row[0] != self._database_token():
+            return MISSING
+        self._disk_execute('UPDATE results SET last_used = ? WHERE key = ?;',
+                           (time.time(), pickle.dumps(key)))
+        result = pickle.loads(row[1])
+        self.memory.put(key, result, weight=len(row[1]))
+        self.disk_hits += 1
+        return result
+
+    def put(self, sql_query, result, params=(), database_token=None, data_version=None):
+        """
+        Caches the result of a query.
+
+        :param sql_query: The SQL query string.
+        :param result: The result to cache, e.g. a (columns, rows) tuple.
+        :param params: Parameters bound to the query.
+        :param database_token: Database state the result was read from, taken before
+            executing; defaults to the current state.
+        :param data_version: data_version observed before executing; the result is not
+            kept in memory if the database has changed since.
+        """
+        key = self.key(sql_query, params)
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if data_version is None or data_version == self._data_version:
+            self.memory.put(key, result, weight=len(payload))
+        if self._disk is None or len(payload) > self.max_disk_bytes:
+            return
+        self._disk_execute(
+            'INSERT OR REPLACE INTO results (key, database_token, payload, size, last_used) '
+            'VALUES (?, ?, ?, ?, ?);',
+            (pickle.dumps(key), database_token or self._database_token(), payload, len(payload),
+             time.time()))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        total = self._disk_execute('SELECT COALESCE(SUM(size), 0) FROM results;', default=(0,))[0]
+        if total <= self.max_disk_bytes:
+            return
+        # Drop the least recently used results until the tier fits again
+        self._disk_execute('''
+            DELETE FROM results WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS running_size
+                    FROM results
+                ) WHERE running_size > ?
+            );
+        ''', (self.max_disk_bytes,))
+
+    def _disk_execute(self, sql, params=(), default=None):
+        try:
+            with self._lock:
+                return self._disk.execute(sql, params).fetchone()
+        except sqlite3.Error:
+            # The shared tier is best effort; a locked or broken file only costs misses
+            return default
+
+    def get_or_execute(self, sql_query, execute, params=()):
+        """
+        Returns the cached result of a query, executing and caching it on a miss.
+
+        :param sql_query: The SQL query string.
+        :param execute: Callable producing the result on a miss.
+        :param params: Parameters bound to the query.
+        :return: The query result.
+        """
+        result = self.get(sql_query, params)
+        if result is MISSING:
+            database_token, data_version = self.version()
+            result = execute()
+            self.put(sql_query, result, params, database_token, data_version)
+        return result
+
+    def version(self):
+        """
+        Returns the database state to pass to put() for a result about to be computed.
+
+        Taking it before executing means a write racing with the query makes the entry
+        stale instead of cached as current.
+
+        :return: Tuple of (database_token, data_version).
+        """
+        database_token = self._database_token() if self._disk is not None else None
+        return database_token, self._data_version
+
+    def clear(self):
+        """Drops every cached result from both tiers."""
+        self.memory.clear()
+        if self._disk is not None:
+            self._disk_execute('DELETE FROM results;')
+
+    def stats(self):
+        """
+        Returns hit-rate metrics for both tiers.
+
+        :return: Dict with the memory tier counters plus disk_hits, invalidations and hit_rate.
+        """
+        stats = self.memory.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'disk_hits': self.disk_hits,
+            'invalidations': self.invalidations,
+            'hit_rate': (stats['hits'] + self.disk_hits) / lookups if lookups else 0.0,
+        })
+        return stats
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the process-wide result cache for DATABASE_PATH, creating it on first use.
+
+    :return: The shared QueryResultCache.
+    """
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = QueryResultCache()
+    return _result_cache
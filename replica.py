@@ -0,0 +1,218 @@
+# replica.py
+"""
+Serves read queries from an in-memory copy of the database.
+
+A ReplicaPool copies the database file into a shared in-memory database (SQLite's
+memdb VFS) with the backup API and hands out read-only connections to that copy.
+A background thread checks the file's `PRAGMA data_version` every refresh interval
+and, when another connection has committed, copies the file into a new in-memory
+database and swaps it in. Connections on the old copy finish their queries and are
+replaced as they come back, and the old copy is freed when its last connection
+closes. Reads therefore never wait for a refresh, and see the file as of the last
+refresh.
+
+The copy is taken only while the file fits in max_bytes. A larger database, or an
+SQLite build without memdb (before 3.36), is served from disk like ConnectionPool.
+A replica lives in one process, so every service worker loads its own.
+
+Usage:
+    LAB_DB_REPLICA=1 streamlit run app.py
+    LAB_DB_REPLICA=1 python service.py serve --workers 4
+"""
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from pool import DATABASE_PATH, POOL_SIZE, ConnectionPool
+
+# Largest database copied into memory; bigger ones are served from disk
+REPLICA_MAX_BYTES = int(os.environ.get('LAB_DB_REPLICA_MAX_BYTES', str(256 * 1024 * 1024)))
+# Seconds between checks of the file for commits
+REPLICA_REFRESH_INTERVAL = float(os.environ.get('LAB_DB_REPLICA_REFRESH', '1.0'))
+# Pages copied per backup step; the file is only locked while a step runs
+BACKUP_PAGES = 1024
+# memdb databases are shared by name across the connections of a process
+MEMDB_AVAILABLE = sqlite3.sqlite_version_info >= (3, 36, 0)
+
+Snapshot = namedtuple('Snapshot', 'uri anchor data_version size')
+
+_names = itertools.count()
+
+
+class ReplicaPool(ConnectionPool):
+    """
+    A ConnectionPool whose connections read an in-memory snapshot of the database.
+
+    snapshot is the copy being served, or None while the pool falls back to the file.
+    """
+
+    def __init__(self, database=DATABASE_PATH, size=POOL_SIZE, max_bytes=REPLICA_MAX_BYTES,
+                 refresh_interval=REPLICA_REFRESH_INTERVAL, on_refresh=None, **kwargs):
+        """
+        :param database: Path to the SQLite database file to replicate.
+        :param size: Maximum number of open connections.
+        :param max_bytes: Largest database copied into memory.
+        :param refresh_interval: Seconds between checks for commits, or None to only
+            refresh when refresh() is called.
+        :param on_refresh: Called after a refresh swapped in a new snapshot or fell back to disk.
+        :param kwargs: Other ConnectionPool arguments.
+        """
+        super().__init__(database, size, readonly=True, **kwargs)
+        self.max_bytes = max_bytes
+        self.refresh_interval = refresh_interval
+        self.on_refresh = on_refresh
+        self.snapshot = None
+        self.refreshes = 0
+        self.fallbacks = 0
+        self.refresh_errors = 0
+        self._snapshots = {}
+        self._refresh_lock = threading.Lock()
+        self._watcher = sqlite3.connect(Path(database).resolve().as_uri() + '?mode=ro',
+                                        uri=True, check_same_thread=False)
+        self._data_version = None
+        self._stop = threading.Event()
+        self.refresh()
+        self._thread = None
+        if refresh_interval:
+            self._thread = threading.Thread(target=self._watch, name='replica-refresh', daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                # The last snapshot keeps being served; the next check tries again
+                self.refresh_errors += 1
+
+    def refresh(self, force=False):
+        """
+        Copies the database into a new snapshot if it changed since the last copy.
+
+        :param force: Copy even if the file has not changed.
+        :return: True if a new snapshot, or the fallback to disk, was swapped in.
+        """
+        with self._refresh_lock:
+            data_version = self._watcher.execute('PRAGMA data_version;').fetchone()[0]
+            if not force and data_version == self._data_version:
+                return False
+            page_count = self._watcher.execute('PRAGMA page_count;').fetchone()[0]
+            page_size = self._watcher.execute('PRAGMA page_size;').fetchone()[0]
+            size = page_count * page_size
+            snapshot = None
+            if MEMDB_AVAILABLE and size <= self.max_bytes:
+                snapshot = self._copy(data_version, size)
+            if snapshot is None:
+                self.fallbacks += 1
+            self._data_version = data_version
+            self._swap(snapshot)
+        if self.on_refresh is not None:
+            self.on_refresh()
+        return True
+
+    def _copy(self, data_version, size):
+        # A commit to the file during the copy restarts it, so the snapshot is at least
+        # as recent as data_version
+        uri = f'file:/lab_replica_{os.getpid()}_{next(_names)}?vfs=memdb'
+        anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(Path(self.database).resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            # The copy keeps the file's WAL flag, which memdb cannot open for other
+            # connections; under an exclusive lock it can be switched to a rollback journal
+            anchor.execute('PRAGMA locking_mode=EXCLUSIVE;')
+            source.backup(anchor, pages=BACKUP_PAGES)
+            anchor.execute('PRAGMA journal_mode=DELETE;')
+            anchor.execute('PRAGMA locking_mode=NORMAL;')
+            # The exclusive lock is only given up on the next access
+            anchor.execute('SELECT 1 FROM sqlite_master LIMIT 1;').fetchall()
+        except sqlite3.Error:
+            # Most likely memdb's own size limit; serve from disk instead
+            anchor.close()
+            return None
+        finally:
+            source.close()
+        return Snapshot(uri + '&mode=ro', anchor, data_version, size)
+
+    def _swap(self, snapshot):
+        with self._lock:
+            old, self.snapshot = self.snapshot, snapshot
+            self.refreshes += 1
+        # Idle connections on the old snapshot are closed now; borrowed ones when they
+        # come back (see acquire)
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for conn, returned_at in reversed(idle):
+            if self._snapshots.get(conn) is snapshot:
+                self._idle.put((conn, returned_at))
+            else:
+                self._discard(conn)
+        if old is not None:
+            # The in-memory database is freed once its last reader closes too
+            old.anchor.close()
+
+    def _open(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            conn = super()._open()
+        else:
+            conn = sqlite3.connect(snapshot.uri, uri=True, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+        with self._lock:
+            self._snapshots[conn] = snapshot
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._snapshots.pop(conn, None)
+        super()._discard(conn)
+
+    def acquire(self):
+        """
+        Borrows a connection to the current snapshot (see ConnectionPool.acquire).
+        """
+        conn = super().acquire()
+        if self._snapshots.get(conn) is not self.snapshot:
+            # Opened before the last refresh; the slot stays borrowed for its replacement
+            self._discard(conn)
+            try:
+                conn = self._connect()
+            except BaseException:
+                self._slots.release()
+                raise
+        return conn
+
+    def close(self):
+        """Stops refreshing and closes idle connections and the snapshot."""
+        self._stop.set()
+        super().close()
+        with self._refresh_lock:
+            snapshot, self.snapshot = self.snapshot, None
+            if snapshot is not None:
+                snapshot.anchor.close()
+            self._watcher.close()
+
+    def stats(self):
+        """
+        Returns pool counters and the state of the replica.
+
+        :return: Dict with the ConnectionPool counters plus replica ('memory' or
+            'disk'), replica_bytes, refreshes, fallbacks and refresh_errors.
+        """
+        stats = super().stats()
+        snapshot = self.snapshot
+        stats.update({
+            'replica': 'disk' if snapshot is None else 'memory',
+            'replica_bytes': 0 if snapshot is None else snapshot.size,
+            'refreshes': self.refreshes,
+            'fallbacks': self.fallbacks,
+            'refresh_errors': self.refresh_errors,
+        })
+        return stats
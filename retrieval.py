@@ -0,0 +1,167 @@
+# retrieval.py
+import numpy as np
+
+# Scores are compared at this precision, so rows that tie exactly in theory are
+# ordered by catalog position no matter how each backend summed their terms
+SCORE_DECIMALS = 12
+
+# Pruning bounds are loosened by this much to absorb floating-point error
+PRUNING_SLACK = 1e-9
+
+
+def above_threshold(similarities, threshold):
+    """
+    Returns a mask of the similarities that clear the threshold.
+
+    :param similarities: Array of similarity scores.
+    :param threshold: Minimum similarity score to consider a match.
+    :return: Boolean array with the same shape.
+    """
+    return np.round(similarities, SCORE_DECIMALS) >= threshold
+
+
+def top_n_indices(similarities, n):
+    """
+    Selects the N most similar catalog rows for every user query.
+
+    Uses a partial selection per row and only sorts the N survivors. Scores are
+    compared at SCORE_DECIMALS and ties are broken by catalog position, so every
+    backend returns the same rows in the same order.
+
+    :param similarities: Dense array of shape (queries, catalog size).
+    :param n: Number of matches to keep per query.
+    :return: Array of shape (queries, min(n, catalog size)) with catalog row indices.
+    """
+    n = max(0, min(n, similarities.shape[1]))
+    if n == 0:
+        return np.empty((similarities.shape[0], 0), dtype=np.intp)
+    similarities = np.round(similarities, SCORE_DECIMALS)
+    if n < similarities.shape[1]:
+        # Partition only finds the N-th best score; among rows tied with it, keep
+        # the ones earliest in the catalog so the choice never depends on the backend
+        kth = -np.partition(-similarities, n - 1, axis=1)[:, n - 1:n]
+        better = similarities > kth
+        tied = similarities == kth
+        needed = n - better.sum(axis=1, keepdims=True)
+        selected = better | (tied & (np.cumsum(tied, axis=1) <= needed))
+        candidates = np.nonzero(selected)[1].reshape(-1, n)
+    else:
+        candidates = np.broadcast_to(np.arange(n), similarities.shape)
+    candidate_similarities = np.take_along_axis(similarities, candidates, axis=1)
+    order = np.lexsort((candidates, -candidate_similarities), axis=-1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class BruteForceRetriever:
+    """
+    Exact reference scorer: computes the similarity to every catalog row.
+
+    Cost grows linearly with the catalog, so it is meant for small catalogs and for
+    checking other backends.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, query_vector, n, threshold):
+        """
+        Finds the top N catalog rows for one query vector.
+
+        :param query_vector: 1 x vocabulary CSR row, L2-normalized.
+        :param n: Number of matches to return.
+        :param threshold: Minimum similarity score to consider a match.
+        :return: Tuple of (row indices, similarities), best match first.
+        """
+        # Rows are L2-normalized, so the dot product is the cosine similarity
+        similarities = (query_vector @ self.index.matrix.T).toarray()
+        indices = top_n_indices(similarities, n)[0]
+        scores = similarities[0, indices]
+        matched = above_threshold(scores, threshold)
+        return indices[matched], scores[matched]
+
+
+class MaxScoreRetriever:
+    """
+    Inverted-index scorer with max-score pruning.
+
+    Query terms are visited from the highest to the lowest score upper bound
+    (query weight x largest weight in the posting list). While the bounds of the
+    remaining terms could still lift an unseen row to the current N-th best score
+    (or the threshold), their postings add new candidates. After that they are only
+    looked up for the rows already collected. Scores are exact, so results equal
+    those of BruteForceRetriever.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, query_vector, n, threshold):
+        """
+        Finds the top N catalog rows for one query vector.
+
+        :param query_vector: 1 x vocabulary CSR row, L2-normalized.
+        :param n: Number of matches to return.
+        :param threshold: Minimum similarity score to consider a match.
+        :return: Tuple of (row indices, similarities), best match first.
+        """
+        index = self.index
+        terms = query_vector.indices
+        weights = query_vector.data
+        empty = (np.empty(0, dtype=np.intp), np.empty(0))
+        if n <= 0 or len(terms) == 0:
+            return empty
+
+        bounds = weights * index.term_max[terms]
+        order = np.argsort(-bounds, kind='stable')
+        terms, weights, bounds = terms[order], weights[order], bounds[order]
+        # remaining[i]: the most that terms i.. can still add to any row's score
+        remaining = np.cumsum(bounds[::-1])[::-1]
+
+        # Dense accumulators are allocated with calloc, so only touched pages cost anything
+        accumulator = np.zeros(index.matrix.shape[0])
+        seen = np.zeros(index.matrix.shape[0], dtype=bool)
+        docs = np.empty(0, dtype=np.intp)
+        pruning = False
+        cutoff = threshold
+        for i, term in enumerate(terms):
+            posting_docs, posting_weights = index.postings(term)
+            if not pruning and remaining[i] >= cutoff - PRUNING_SLACK:
+                # Essential term: unseen rows can still qualify, so score the whole list
+                accumulator[posting_docs] += weights[i] * posting_weights
+                new_docs = posting_docs[~seen[posting_docs]]
+                seen[new_docs] = True
+                docs = np.concatenate((docs, new_docs))
+            else:
+                if not pruning:
+                    docs = np.sort(docs)
+                    pruning = True
+                # Drop candidates that can no longer reach the cutoff, then only
+                # probe the posting list for the survivors
+                docs = docs[accumulator[docs] + remaining[i] >= cutoff - PRUNING_SLACK]
+                if len(docs) == 0:
+                    break
+                positions = np.searchsorted(posting_docs, docs)
+                positions[positions == len(posting_docs)] = 0
+                hits = posting_docs[positions] == docs
+                accumulator[docs[hits]] += weights[i] * posting_weights[positions[hits]]
+            if len(docs) >= n:
+                # Partial scores are lower bounds, so the N-th best is a safe cutoff
+                scores = accumulator[docs]
+                cutoff = max(threshold, np.partition(scores, len(scores) - n)[len(scores) - n])
+
+        docs = np.sort(docs)
+        scores = accumulator[docs]
+        matched = above_threshold(scores, threshold)
+        docs, scores = docs[matched], scores[matched]
+        if len(docs) == 0:
+            return empty
+        best = top_n_indices(scores[np.newaxis, :], n)[0]
+        # Candidates are sorted by row, so position order is catalog order for ties
+        return docs[best].astype(np.intp), scores[best]
+
+
+# Registered retrieval backends, selectable by name
+BACKENDS = {
+    'bruteforce': BruteForceRetriever,
+    'maxscore': MaxScoreRetriever,
+}
@@ -0,0 +1,491 @@
+# service.py
+"""
+Headless HTTP service for matching and executing catalog queries.
+
+Endpoints (JSON in, JSON out):
+    POST /suggest  {"query": "...", "n": 3, "threshold": 0.3}
+                   or {"queries": ["...", ...], ...} for a batch
+    POST /execute  {"sql": "...", "params": [...], "page": 0, "page_size": 100}
+    GET  /health   worker status, pool and cache counters
+    GET  /metrics  tracing histograms in Prometheus text format
+
+Usage:
+    python service.py serve [--host 127.0.0.1] [--port 8000] [--workers 4]
+    python service.py suggest "Show all lab tests" [--url http://127.0.0.1:8000]
+    python service.py execute "SELECT * FROM Departments;" [--url http://127.0.0.1:8000]
+    python service.py execute "SELECT name FROM LabTests WHERE price > ?;" --params 50
+
+Suggestions for parameterized templates carry the values filled from the query in
+"params"; pass them back unchanged to /execute.
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tracing
+from executor import QueryTimeout, get_executor
+from pool import PoolTimeout, get_pool
+from precompile import get_precompiler
+from query_cache import get_result_cache
+from similarity import close_store, get_index, get_store, get_top_n_sql_queries, get_top_n_sql_queries_batch, preprocess
+from streaming import PAGE_SIZE, paged_query
+
+# Requests admitted at once per worker process; the rest get 503 and Retry-After
+MAX_IN_FLIGHT = int(os.environ.get('LAB_SERVICE_MAX_IN_FLIGHT', '256'))
+# Seconds a request may wait for its result before it is answered with 504
+REQUEST_TIMEOUT = 30.0
+# Suggest requests scored together in one batch, and how long the batcher waits for
+# more after the first (0 batches only requests that are already queued)
+BATCH_MAX_SIZE = 256
+BATCH_WINDOW = 0.0
+# Largest page a client may request
+MAX_PAGE_SIZE = 10000
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class ServiceError(Exception):
+    """An error reported to the client with an HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _integer(payload, name, default, minimum):
+    # Out-of-range values are rejected rather than clamped: SQLite reads a negative
+    # LIMIT as no limit, which would fetch the whole result
+    value = payload.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ServiceError(400, f"'{name}' must be an integer")
+    if value < minimum:
+        raise ServiceError(400, f"'{name}' must be at least {minimum}")
+    return value
+
+
+def _to_json(results):
+    return [{'sql': sql, 'question': question, 'score': float(score), 'params': list(params)}
+            for sql, question, score, params in results]
+
+
+class SuggestBatcher:
+    """
+    Scores concurrent suggest requests together with get_top_n_sql_queries_batch.
+
+    A single thread drains the queue: under load, requests that arrive while a batch
+    is being scored form the next batch, so the matcher handles them with one sparse
+    product instead of one per request. A lone request is scored on its own without
+    waiting.
+    """
+
+    def __init__(self, max_size=BATCH_MAX_SIZE, window=BATCH_WINDOW):
+        """
+        :param max_size: Maximum queries scored in one batch.
+        :param window: Seconds to wait for more requests after the first one.
+        """
+        self.max_size = max_size
+        self.window = window
+        self.batches = 0
+        self.batched_queries = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='suggest-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, query, n, threshold):
+        """
+        Queues one query for scoring.
+
+        :return: A Future resolving to the list of (sql, question, score, params) matches.
+        """
+        future = Future()
+        self._queue.put((query, n, threshold, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch[0] is None:
+                return
+            groups = {}
+            for query, n, threshold, future in batch:
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault((n, threshold), []).append((query, future))
+            for (n, threshold), items in groups.items():
+                try:
+                    if len(items) == 1:
+                        # Single queries go through the matcher's result cache
+                        results = [get_top_n_sql_queries(items[0][0], n, threshold)]
+                    else:
+                        results = get_top_n_sql_queries_batch([query for query, _ in items], n, threshold)
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(items, results):
+                    future.set_result(result)
+            self.batches += 1
+            self.batched_queries += len(batch)
+
+    def close(self):
+        self._queue.put(None)
+
+
+class QueryService:
+    """
+    Matching and execution shared by every connection of one worker process.
+
+    Admission is bounded by MAX_IN_FLIGHT so overload is answered with 503 instead of
+    an ever-growing backlog. SQLite work runs on the process's query executor, which
+    enforces time budgets and limits concurrent heavy queries.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, request_timeout=REQUEST_TIMEOUT):
+        """
+        :param max_in_flight: Requests admitted at once; further ones are rejected.
+        :param request_timeout: Seconds to wait for a result before answering 504.
+        """
+        self.request_timeout = request_timeout
+        self.batcher = SuggestBatcher()
+        self._admission = threading.BoundedSemaphore(max_in_flight)
+        self.started = time.time()
+        self.rejected = 0
+        self.requests = 0
+        # Open the pool now, so an in-memory replica (LAB_DB_REPLICA) is loaded before
+        # the first request rather than during it
+        get_pool()
+
+    def admit(self):
+        if not self._admission.acquire(blocking=False):
+            self.rejected += 1
+            raise ServiceError(503, 'Too many requests in flight, retry later')
+        self.requests += 1
+
+    def done(self):
+        self._admission.release()
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.request_timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise ServiceError(504, f'No result within {self.request_timeout}s')
+
+    def suggest(self, payload):
+        n = _integer(payload, 'n', 3, 1)
+        threshold = float(payload.get('threshold', 0.3))
+        if 'queries' in payload:
+            queries = payload['queries']
+            if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+                raise ServiceError(400, "'queries' must be a list of strings")
+            # An explicit batch is already grouped, so it bypasses the batcher
+            results = get_top_n_sql_queries_batch(queries, n, threshold)
+            return {'results': [_to_json(result) for result in results]}
+        query = payload.get('query')
+        if not isinstance(query, str) or not query.strip():
+            raise ServiceError(400, "'query' must be a non-empty string")
+        return {'results': _to_json(self._wait(self.batcher.submit(query, n, threshold)))}
+
+    def execute(self, payload):
+        sql = payload.get('sql')
+        if not isinstance(sql, str) or not sql.strip():
+            raise ServiceError(400, "'sql' must be a non-empty string")
+        params = payload.get('params', [])
+        if not isinstance(params, list) or not all(
+                value is None or isinstance(value, (str, int, float)) for value in params):
+            raise ServiceError(400, "'params' must be a list of strings, numbers or nulls")
+        page = _integer(payload, 'page', 0, 0)
+        page_size = min(_integer(payload, 'page_size', PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        paged, params = paged_query(sql, page_size=page_size, page=page, params=params)
+        try:
+            columns, rows = self._wait(get_executor().submit(paged, params))
+        except PoolTimeout as e:
+            raise ServiceError(503, str(e))
+        except QueryTimeout as e:
+            raise ServiceError(504, str(e))
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise ServiceError(400, str(e))
+        return {'columns': columns, 'rows': [list(row) for row in rows[:page_size]],
+                'has_more': len(rows) > page_size, 'page': page}
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'batches': self.batcher.batches,
+            'batched_queries': self.batcher.batched_queries,
+            'pool': get_pool().stats(),
+            'executor': get_executor().stats(),
+            'result_cache': get_result_cache().stats(),
+            'catalog_version': get_index().catalog_hash,
+            'precompiled': get_precompiler().stats(),
+        }
+
+    def close(self):
+        self.batcher.close()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets clients reuse connections across requests; without Nagle, small
+    # responses are not held back waiting for the client's delayed ACK
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_version = 'LabQueryService/1.0'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._respond(200, self.server.service.health())
+        elif self.path == '/metrics':
+            self._send(200, tracing.recorder.prometheus_text().encode(), 'text/plain; version=0.0.4')
+        else:
+            self._respond(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        routes = {'/suggest': self.server.service.suggest, '/execute': self.server.service.execute}
+        route = routes.get(self.path)
+        if route is None:
+            self._respond(404, {'error': f'Unknown path {self.path}'})
+            return
+        service = self.server.service
+        try:
+            payload = self._read_json()
+            service.admit()
+            try:
+                with tracing.trace(self.path.strip('/')):
+                    body = route(payload)
+            finally:
+                service.done()
+        except ServiceError as e:
+            headers = {'Retry-After': '1'} if e.status == 503 else {}
+            self._respond(e.status, {'error': str(e)}, headers)
+            return
+        except (TypeError, ValueError) as e:
+            self._respond(400, {'error': str(e)})
+            return
+        self._respond(200, body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ServiceError(413, 'Request body too large')
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise ServiceError(400, 'Request body is not valid JSON')
+        if not isinstance(payload, dict):
+            raise ServiceError(400, 'Request body must be a JSON object')
+        return payload
+
+    def _respond(self, status, body, headers=None):
+        self._send(status, json.dumps(body, default=str).encode(), 'application/json', headers)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are routine, not server errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def __init__(self, address, service=None, bind_and_activate=True):
+        super().__init__(address, ServiceHandler, bind_and_activate)
+        self.service = service
+
+
+def _load_shared():
+    # Load the memory-mapped index and NLTK up front, so forked workers share them.
+    # SQLite connections must not cross fork(), so the store connection opened to
+    # read the index is closed again; each process reopens it on first use
+    get_index()
+    preprocess('warm up')
+    close_store()
+
+
+def _warm_up():
+    # Per process: compile the catalog SQL up front instead of on the first request
+    get_precompiler().compile_catalog(get_store().items()[1])
+
+
+def create_server(host='127.0.0.1', port=8000):
+    """
+    Builds a single-process server with its own QueryService, ready for serve_forever().
+
+    :param host: Interface to bind.
+    :param port: Port to listen on; 0 picks a free one (see server.server_address).
+    :return: The ServiceServer.
+    """
+    _load_shared()
+    _warm_up()
+    server = ServiceServer((host, port))
+    server.service = QueryService()
+    return server
+
+
+def serve(host='127.0.0.1', port=8000, workers=1):
+    """
+    Serves until interrupted, optionally with several pre-forked worker processes.
+
+    The listening socket is opened and the matcher index and NLTK loaded before
+    forking, so the workers share them; the parent holds no SQLite connection when it
+    forks. Each worker opens its own database connections, compiles the catalog and
+    starts its result cache, batcher and query executor after the fork.
+
+    :param host: Interface to bind.
+    :param port: Port to listen on.
+    :param workers: Number of worker processes.
+    """
+    _load_shared()
+    server = ServiceServer((host, port))
+    print(f'Serving on http://{host}:{server.server_address[1]} with {workers} worker(s)', flush=True)
+    children = []
+    if workers > 1:
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                _warm_up()
+                server.service = QueryService()
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        # Terminating the parent stops the workers too
+        signal.signal(signal.SIGTERM, lambda signum, frame: _raise_interrupt())
+        try:
+            for pid in children:
+                os.waitpid(pid, 0)
+        except KeyboardInterrupt:
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+            for pid in children:
+                os.waitpid(pid, 0)
+        finally:
+            server.server_close()
+        return
+    _warm_up()
+    server.service = QueryService()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.close()
+        server.server_close()
+
+
+def _raise_interrupt():
+    raise KeyboardInterrupt
+
+
+def _post(url, path, payload):
+    request = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def _parameter(text):
+    # Command-line values are strings; numbers are bound as numbers
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='run the HTTP service')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--workers', type=int, default=1, help='pre-forked worker processes')
+
+    suggest_parser = commands.add_parser('suggest', help='match a natural language query')
+    suggest_parser.add_argument('query')
+    suggest_parser.add_argument('-n', type=int, default=3)
+    suggest_parser.add_argument('--threshold', type=float, default=0.3)
+    suggest_parser.add_argument('--url', help='ask a running service instead of matching in-process')
+
+    execute_parser = commands.add_parser('execute', help='run SQL and print one page of results')
+    execute_parser.add_argument('sql')
+    execute_parser.add_argument('--params', nargs='*', default=[], type=_parameter,
+                                help='values bound to the ? parameters of the SQL')
+    execute_parser.add_argument('--page', type=int, default=0)
+    execute_parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    execute_parser.add_argument('--url', help='ask a running service instead of executing in-process')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.host, args.port, args.workers)
+        return 0
+
+    if args.command == 'suggest':
+        payload = {'query': args.query, 'n': args.n, 'threshold': args.threshold}
+        path = '/suggest'
+    else:
+        payload = {'sql': args.sql, 'params': args.params, 'page': args.page, 'page_size': args.page_size}
+        path = '/execute'
+    if args.url:
+        body = _post(args.url, path, payload)
+    else:
+        service = QueryService()
+        try:
+            body = service.suggest(payload) if path == '/suggest' else service.execute(payload)
+        except ServiceError as e:
+            body = {'error': str(e)}
+        finally:
+            service.close()
+    json.dump(body, sys.stdout, indent=2, default=str)
+    print()
+    return 1 if 'error' in body else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,797 @@
+# shards.py
+"""
+Runs one query against many SQLite shards at once and merges their answers.
+
+Every shard is a complete site database with the lab.db schema. A statement is
+planned once into a shard query, which every shard runs concurrently, and a merge
+query, which combines the partial results in an in-memory SQLite database, so the
+merged answer follows SQLite's own ordering, grouping and typing rules:
+
+    Row queries           rows are concatenated, deduplicated for DISTINCT, and
+                          sorted by the statement's ORDER BY.
+    ORDER BY ... LIMIT    each shard returns its own first limit + offset rows, and
+                          the global top-k is taken from those.
+    COUNT/SUM/TOTAL/      each shard groups and aggregates, and the merge query
+    MIN/MAX/AVG           groups the partials again: counts and sums add up, AVG is
+                          carried as a sum and a count. HAVING, ORDER BY and LIMIT
+                          apply to the merged groups.
+
+Statements whose answer cannot be combined exactly from per-shard results are
+rejected with ShardMergeError: other aggregates (COUNT(DISTINCT ...), MEDIAN,
+STDDEV, ...), window functions, compound selects, and subqueries that aggregate,
+such as "price > (SELECT AVG(price) FROM LabTests)", whose value differs per shard.
+
+Each shard has its own connection pool and query executor, and with them the
+executor's time budget and row cap. Shards that fail or run out of time are listed
+in ShardResult.failures, and the answer is merged from the others.
+
+Usage:
+    LAB_DB_SHARDS=site1.db,site2.db python shards.py "SELECT ..." [--params ...]
+    python shards.py "SELECT ..." --shards 'sites/*.db' [--plan]
+"""
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import tracing
+from executor import QUERY_TIMEOUT, QueryCancelled, QueryExecutor, QueryTimeout
+from pool import ConnectionPool, PoolTimeout
+from streaming import MAX_ROWS
+
+# Comma-separated shard databases; an entry may be a glob pattern
+SHARD_PATHS = os.environ.get('LAB_DB_SHARDS', '')
+# Wall-clock budget of a query on one shard
+SHARD_TIMEOUT = float(os.environ.get('LAB_DB_SHARD_TIMEOUT', str(QUERY_TIMEOUT)))
+# Connections, and queries running at once, per shard
+SHARD_POOL_SIZE = int(os.environ.get('LAB_DB_SHARD_POOL_SIZE', '2'))
+# Fanned-out statements coordinated at once
+FAN_OUT_WORKERS = 8
+# Planned statements kept, keyed on the SQL
+PLAN_CACHE_SIZE = 1024
+
+# Aggregates whose per-shard results combine exactly, and the function merging them
+MERGED_AGGREGATES = {'count': 'SUM', 'sum': 'SUM', 'total': 'TOTAL', 'min': 'MIN', 'max': 'MAX', 'avg': None}
+# Aggregates that do not combine from per-shard results
+OTHER_AGGREGATES = {'group_concat', 'string_agg', 'json_group_array', 'json_group_object',
+                    'variance', 'var_samp', 'var_pop', 'stddev', 'stddev_samp', 'stddev_pop',
+                    'median', 'percentile'}
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+|--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<parameter>\?\d*|[:@$]\w+)
+  | (?P<word>\w+)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<comma>,)
+  | (?P<semicolon>;)
+  | (?P<operator>\|\||<<|>>|<=|>=|==|!=|<>|\S)
+""", re.VERBOSE | re.DOTALL)
+# Keywords starting a clause after the select list, at the top level of a statement
+_CLAUSES = ('FROM', 'GROUP', 'HAVING', 'WINDOW', 'ORDER', 'LIMIT', 'OFFSET')
+# Words after which a trailing name is part of the expression, not an implicit alias
+_NO_ALIAS_AFTER = {'COLLATE', 'CASE', 'WHEN', 'THEN', 'ELSE', 'AND', 'OR', 'NOT', 'IS', 'IN', 'LIKE',
+                   'GLOB', 'BETWEEN', 'DISTINCT', 'AS'}
+_NOT_ALIASES = {'END', 'NULL', 'TRUE', 'FALSE', 'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP'}
+
+Token = namedtuple('Token', 'kind text start end')
+MergePlan = namedtuple('MergePlan', 'shard_sql shard_params merge_sql merge_params columns hidden')
+ShardResult = namedtuple('ShardResult', 'columns rows failures')
+
+
+class ShardMergeError(ValueError):
+    """Raised when a statement's answer cannot be merged exactly from per-shard results."""
+
+
+class ShardsFailed(Exception):
+    """Raised when no shard answered; failures maps each shard to its error."""
+
+    def __init__(self, failures):
+        super().__init__('; '.join(f'{path}: {error}' for path, error in failures.items()))
+        self.failures = failures
+
+
+def shard_paths(spec=None):
+    """
+    Expands a comma-separated list of shard databases and glob patterns.
+
+    :param spec: The list, defaults to SHARD_PATHS (LAB_DB_SHARDS).
+    :return: List of paths; a pattern matching nothing is kept as given.
+    """
+    spec = SHARD_PATHS if spec is None else spec
+    return [path for pattern in spec.split(',') if pattern.strip()
+            for path in (sorted(glob.glob(pattern.strip())) or [pattern.strip()])]
+
+
+def _word(token):
+    return token.text.upper() if token.kind == 'word' else None
+
+
+def _unquote(text):
+    if text[:1] in ('"', '`'):
+        return text[1:-1].replace(text[0] * 2, text[0])
+    if text[:1] == '[':
+        return text[1:-1]
+    return text
+
+
+class _Statement:
+    """
+    A tokenized SELECT statement that renders spans of itself back to SQL, keeping
+    track of the positional parameters each span binds.
+    """
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.tokens = [Token(match.lastgroup, match.group(), match.start(), match.end())
+                       for match in _TOKEN.finditer(sql) if match.lastgroup != 'space']
+        while self.tokens and self.tokens[-1].kind == 'semicolon':
+            self.tokens.pop()
+        if not self.tokens or _word(self.tokens[0]) != 'SELECT':
+            raise ShardMergeError('Only SELECT statements can be fanned out')
+        self.parameters = {}
+        self.closing = {}
+        opened = []
+        for i, token in enumerate(self.tokens):
+            if token.kind == 'semicolon':
+                raise ShardMergeError('Only a single statement can be fanned out')
+            if token.kind == 'parameter':
+                if token.text != '?':
+                    raise ShardMergeError('Fanned-out statements take positional ? parameters only')
+                self.parameters[i] = len(self.parameters)
+            elif token.kind == 'open':
+                opened.append(i)
+            elif token.kind == 'close':
+                if not opened:
+                    raise ShardMergeError('Unbalanced parentheses')
+                self.closing[opened.pop()] = i
+        if opened:
+            raise ShardMergeError('Unbalanced parentheses')
+
+    def render(self, start, end, replacements=None):
+        """
+        Renders tokens start..end with some spans replaced.
+
+        :param replacements: Dict of first token -> (end token, text, parameter indexes).
+        :return: Tuple of (SQL text, indexes of the parameters it binds, in order).
+        """
+        if start >= end:
+            return '', []
+        replacements = replacements or {}
+        parts, params = [], []
+        position = self.tokens[start].start
+        i = start
+        while i < end:
+            if i in replacements:
+                stop, text, extra = replacements[i]
+                parts.append(self.sql[position:self.tokens[i].start])
+                parts.append(text)
+                params.extend(extra)
+                position = self.tokens[stop - 1].end
+                i = stop
+                continue
+            if i in self.parameters:
+                params.append(self.parameters[i])
+            i += 1
+        parts.append(self.sql[position:max(position, self.tokens[end - 1].end)])
+        return ''.join(parts), params
+
+    def key(self, start, end):
+        """Returns the span as case-insensitive token texts, to compare expressions."""
+        return tuple(_word(token) or token.text for token in self.tokens[start:end])
+
+    def split(self, start, end):
+        """Splits tokens start..end at their top-level commas."""
+        pieces, depth, first = [], 0, start
+        for i in range(start, end):
+            kind = self.tokens[i].kind
+            depth += (kind == 'open') - (kind == 'close')
+            if kind == 'comma' and depth == 0:
+                pieces.append((first, i))
+                first = i + 1
+        pieces.append((first, end))
+        return pieces
+
+    def clauses(self):
+        """
+        Returns the spans of the clause bodies, keyed 'SELECT' (the select list),
+        'FROM' (the FROM keyword through WHERE), 'GROUP', 'HAVING', 'ORDER', 'LIMIT'
+        and 'OFFSET'.
+        """
+        starts, depth = [], 0
+        for i, token in enumerate(self.tokens):
+            depth += (token.kind == 'open') - (token.kind == 'close')
+            word = _word(token)
+            if depth or not word:
+                continue
+            if word in ('UNION', 'INTERSECT', 'EXCEPT'):
+                raise ShardMergeError(f'{word} statements cannot be fanned out')
+            if word == 'WINDOW':
+                raise ShardMergeError('Window functions cannot be merged across shards')
+            if word in _CLAUSES:
+                starts.append((word, i))
+        first = 2 if len(self.tokens) > 1 and _word(self.tokens[1]) in ('DISTINCT', 'ALL') else 1
+        bounds = [('SELECT', first)]
+        for word, i in starts:
+            # FROM keeps its keyword; GROUP BY and ORDER BY skip two
+            body = i if word == 'FROM' else i + (2 if word in ('GROUP', 'ORDER') else 1)
+            bounds.append((word, body))
+        ends = [i for _, i in starts] + [len(self.tokens)]
+        return {word: (body, end) for (word, body), end in zip(bounds, ends)}
+
+    def aggregates(self, start, end):
+        """
+        Finds the aggregate calls among tokens start..end, outside subqueries.
+
+        :return: Dict of first token -> (name, end token, argument span, FILTER span or None).
+        :raises ShardMergeError: For aggregates that do not combine, window functions
+            and subqueries that aggregate.
+        """
+        calls = {}
+        i = start
+        while i < end:
+            token, word = self.tokens[i], _word(self.tokens[i])
+            if token.kind == 'open' and _word(self.tokens[i + 1]) == 'SELECT':
+                self._check_subquery(i + 1, self.closing[i])
+                i = self.closing[i] + 1
+                continue
+            if word == 'OVER':
+                raise ShardMergeError('Window functions cannot be merged across shards')
+            name = word.lower() if word else None
+            if name and i + 1 < end and self.tokens[i + 1].kind == 'open' and self._is_aggregate(name, i + 1):
+                close = self.closing[i + 1]
+                distinct = _word(self.tokens[i + 2]) == 'DISTINCT'
+                if name in OTHER_AGGREGATES or distinct and name not in ('min', 'max'):
+                    raise ShardMergeError(f"{name.upper()}({'DISTINCT ...' if distinct else ''}) "
+                                          f"cannot be combined across shards")
+                stop, filter_span = close + 1, None
+                if stop < end and _word(self.tokens[stop]) == 'FILTER':
+                    filter_span = (stop, self.closing[stop + 1] + 1)
+                    stop = filter_span[1]
+                if stop < end and _word(self.tokens[stop]) == 'OVER':
+                    raise ShardMergeError('Window functions cannot be merged across shards')
+                calls[i] = (name, stop, (i + 2 + distinct, close), filter_span)
+                i = stop
+                continue
+            i += 1
+        return calls
+
+    def _is_aggregate(self, name, open_index):
+        if name in OTHER_AGGREGATES:
+            return True
+        if name not in MERGED_AGGREGATES:
+            return False
+        # MIN and MAX with several arguments are the scalar functions
+        arguments = (open_index + 1, self.closing[open_index])
+        return name not in ('min', 'max') or len(self.split(*arguments)) == 1
+
+    def _check_subquery(self, start, end):
+        for i in range(start, end):
+            word = _word(self.tokens[i])
+            if word == 'LIMIT':
+                raise ShardMergeError('A subquery with LIMIT has a different answer on each shard')
+            if word == 'OVER' or (word and self.tokens[i + 1].kind == 'open'
+                                  and self._is_aggregate(word.lower(), i + 1)):
+                raise ShardMergeError('A subquery that aggregates has a different answer on each shard')
+
+    def standalone(self, start, end):
+        """Whether tokens start..end are not part of a qualified name or a call."""
+        before = self.tokens[start - 1].text if start > 0 else ''
+        after = self.tokens[end].text if end < len(self.tokens) else ''
+        return before != '.' and after not in ('.', '(')
+
+
+def _select_items(statement, start, end):
+    """
+    Returns the select list as (first token, end token of the expression, alias or None).
+    """
+    items = []
+    tokens = statement.tokens
+    for first, stop in statement.split(start, end):
+        alias = None
+        if stop - first >= 3 and _word(tokens[stop - 2]) == 'AS':
+            alias, stop = _unquote(tokens[stop - 1].text), stop - 2
+        elif (stop - first >= 2 and tokens[stop - 1].kind in ('word', 'quoted')
+              and _word(tokens[stop - 1]) not in _NOT_ALIASES
+              and tokens[stop - 2].kind in ('close', 'word', 'quoted', 'number', 'string')
+              and _word(tokens[stop - 2]) not in _NO_ALIAS_AFTER):
+            alias, stop = _unquote(tokens[stop - 1].text), stop - 1
+        items.append((first, stop, alias))
+    return items
+
+
+def _output_name(statement, first, stop, alias):
+    # SQLite names a result column by its alias, by the column it references, or by
+    # the text of its expression
+    if alias is not None:
+        return alias
+    tokens = statement.tokens[first:stop]
+    if len(tokens) % 2 == 1 and all(token.kind in ('word', 'quoted') if position % 2 == 0 else token.text == '.'
+                                    for position, token in enumerate(tokens)):
+        return _unquote(tokens[-1].text)
+    return statement.sql[tokens[0].start:tokens[-1].end]
+
+
+def _order_terms(statement, start, end):
+    """
+    Splits an ORDER BY clause into (first token, end token of the expression, suffix),
+    where the suffix is the COLLATE, ASC/DESC and NULLS FIRST/LAST text.
+    """
+    terms = []
+    tokens = statement.tokens
+    for first, stop in statement.split(start, end):
+        expression_end = stop
+        while expression_end - first > 1:
+            if _word(tokens[expression_end - 1]) in ('ASC', 'DESC'):
+                expression_end -= 1
+            elif expression_end - first > 2 and _word(tokens[expression_end - 2]) in ('COLLATE', 'NULLS'):
+                expression_end -= 2
+            else:
+                break
+        suffix = statement.sql[tokens[expression_end - 1].end:tokens[stop - 1].end]
+        terms.append((first, expression_end, suffix))
+    return terms
+
+
+def _limit_clause(statement, clauses):
+    """
+    Returns the spans of the LIMIT and OFFSET expressions (None when absent),
+    including the "LIMIT offset, count" form.
+    """
+    if 'LIMIT' not in clauses:
+        return None, None
+    parts = statement.split(*clauses['LIMIT'])
+    if len(parts) == 2:
+        return parts[1], parts[0]
+    return clauses['LIMIT'], clauses.get('OFFSET')
+
+
+def _merge_tail(statement, order, limit, offset):
+    tail, params = '', []
+    if order:
+        tail += ' ORDER BY ' + ', '.join(order)
+    if limit is not None:
+        text, params = statement.render(*limit)
+        tail += f' LIMIT {text}'
+        if offset is not None:
+            text, offset_params = statement.render(*offset)
+            tail += f' OFFSET {text}'
+            params = params + offset_params
+    return tail, params
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _plan(sql_query):
+    statement = _Statement(sql_query)
+    clauses = statement.clauses()
+    if 'SELECT' not in clauses or clauses['SELECT'][0] >= clauses['SELECT'][1]:
+        raise ShardMergeError('Empty select list')
+    items = _select_items(statement, *clauses['SELECT'])
+    order_terms = _order_terms(statement, *clauses['ORDER']) if 'ORDER' in clauses else []
+    calls = {}
+    for span in [clauses['SELECT'], clauses.get('HAVING')] + [term[:2] for term in order_terms]:
+        if span is not None:
+            calls.update(statement.aggregates(*span))
+    # Subqueries in the other clauses must not aggregate either
+    for name in ('FROM', 'GROUP', 'LIMIT', 'OFFSET'):
+        if name in clauses:
+            statement.aggregates(*clauses[name])
+    if calls or 'GROUP' in clauses:
+        return _aggregate_plan(statement, clauses, items, order_terms, calls)
+    return _row_plan(statement, clauses, items, order_terms)
+
+
+def _row_plan(statement, clauses, items, order_terms):
+    """
+    Plans a statement without aggregates: shards run it, with ORDER BY keys outside
+    the select list as hidden trailing columns and LIMIT widened by the OFFSET.
+    """
+    distinct = _word(statement.tokens[1]) == 'DISTINCT'
+    limit, offset = _limit_clause(statement, clauses)
+    if not order_terms and limit is None and not distinct:
+        # Rows of every shard are simply concatenated
+        return MergePlan(statement.sql, tuple(statement.parameters.values()), None, (), None, 0)
+
+    has_star = any(statement.tokens[stop - 1].text == '*' for _, stop, _ in items)
+    aliases = {alias.casefold(): (first, stop) for first, stop, alias in items if alias}
+    hidden, merge_order = [], []
+    for first, stop, suffix in order_terms:
+        token = statement.tokens[first]
+        if stop - first == 1 and token.kind == 'number':
+            merge_order.append(f'c{int(token.text) - 1}{suffix}')
+            continue
+        if stop - first == 1 and token.kind in ('word', 'quoted') and _unquote(token.text).casefold() in aliases:
+            first, stop = aliases[_unquote(token.text).casefold()]
+        position = [i for i, (item_first, item_stop, _) in enumerate(items)
+                    if statement.key(item_first, item_stop) == statement.key(first, stop)]
+        if position and not has_star:
+            merge_order.append(f'c{position[0]}{suffix}')
+            continue
+        merge_order.append(f'h{len(hidden)}{suffix}')
+        hidden.append(statement.render(first, stop))
+
+    select_text, shard_params = statement.render(*clauses['SELECT'])
+    shard_sql = 'SELECT ' + ('DISTINCT ' if distinct else '') + select_text
+    for i, (text, params) in enumerate(hidden):
+        shard_sql += f', {text} AS h{i}'
+        shard_params += params
+    for name, keyword in (('FROM', ''), ('ORDER', 'ORDER BY ')):
+        if name in clauses:
+            text, params = statement.render(*clauses[name])
+            shard_sql += f' {keyword}{text}'
+            shard_params += params
+    if limit is not None:
+        # Each shard returns its own first limit + offset rows
+        limit_text, limit_params = statement.render(*limit)
+        if offset is None:
+            shard_sql += f' LIMIT {limit_text}'
+            shard_params += limit_params
+        else:
+            offset_text, offset_params = statement.render(*offset)
+            shard_sql += f' LIMIT CASE WHEN ({limit_text}) < 0 THEN -1 ELSE ({limit_text}) + ({offset_text}) END'
+            shard_params += limit_params + limit_params + offset_params
+
+    merge_tail, merge_params = _merge_tail(statement, merge_order, limit, offset)
+    merge_sql = 'SELECT ' + ('DISTINCT ' if distinct else '') + '* FROM partials' + merge_tail
+    return MergePlan(shard_sql, tuple(shard_params), merge_sql, tuple(merge_params), None, len(hidden))
+
+
+def _aggregate_plan(statement, clauses, items, order_terms, calls):
+    """
+    Plans an aggregate statement: shards group by the GROUP BY keys (named g0, g1, ...)
+    and return the partial aggregates (a0, a1, ...) and other selected columns (b0,
+    b1, ...); the merge query groups those again.
+    """
+    tokens = statement.tokens
+    for first, stop, _ in items:
+        if tokens[stop - 1].text == '*' and (stop - first == 1 or tokens[stop - 2].text == '.'):
+            raise ShardMergeError('SELECT * cannot be combined with aggregates across shards')
+
+    shard_columns = []
+    partials = {}
+
+    def partial(text, params):
+        key = (text, tuple(params))
+        if key not in partials:
+            partials[key] = f'a{len(partials)}'
+            shard_columns.append((f'{text} AS {partials[key]}', params))
+        return partials[key]
+
+    merged_calls = {}
+    for first, (name, stop, arguments, filter_span) in calls.items():
+        if name == 'avg':
+            # An average is carried as its sum and count
+            argument_text, argument_params = statement.render(*arguments)
+            filter_text, filter_params = statement.render(*filter_span) if filter_span else ('', [])
+            filter_text = ' ' + filter_text if filter_text else ''
+            total = partial(f'TOTAL({argument_text}){filter_text}', argument_params + filter_params)
+            count = partial(f'COUNT({argument_text}){filter_text}', argument_params + filter_params)
+            merged = f'(TOTAL({total}) / SUM({count}))'
+        else:
+            merged = f'{MERGED_AGGREGATES[name]}({partial(*statement.render(first, stop))})'
+        merged_calls[first] = (stop, merged, [])
+
+    group_columns, groups = [], {}
+    group_terms = statement.split(*clauses['GROUP']) if 'GROUP' in clauses else []
+    aliases = {alias.casefold(): (first, stop) for first, stop, alias in items if alias}
+    for i, (first, stop) in enumerate(group_terms):
+        token = tokens[first]
+        if stop - first == 1 and token.kind == 'number':
+            first, stop, _ = items[int(token.text) - 1]
+        elif stop - first == 1 and token.kind in ('word', 'quoted') and _unquote(token.text).casefold() in aliases:
+            first, stop = aliases[_unquote(token.text).casefold()]
+        text, params = statement.render(first, stop)
+        groups.setdefault(statement.key(first, stop), f'g{i}')
+        group_columns.append((f'{text} AS g{i}', params))
+    # Longest first, so a key is not matched inside a longer one
+    group_keys = sorted(groups.items(), key=lambda entry: len(entry[0]), reverse=True)
+
+    def merged(first, stop, output_aliases=None):
+        """Renders an expression over the partials."""
+        replacements = {}
+        i = first
+        while i < stop:
+            if i in merged_calls:
+                replacements[i] = merged_calls[i]
+                i = merged_calls[i][0]
+                continue
+            for key, column in group_keys:
+                end = i + len(key)
+                if end <= stop and statement.key(i, end) == key and statement.standalone(i, end):
+                    replacements[i] = (end, column, [])
+                    i = end
+                    break
+            else:
+                token = tokens[i]
+                if (output_aliases and token.kind in ('word', 'quoted') and statement.standalone(i, i + 1)
+                        and _unquote(token.text).casefold() in output_aliases):
+                    replacements[i] = (i + 1, output_aliases[_unquote(token.text).casefold()], [])
+                i += 1
+        return statement.render(first, stop, replacements)
+
+    bare, names, merge_columns, merge_params, outputs = [], [], [], [], {}
+    for i, (first, stop, alias) in enumerate(items):
+        names.append(_output_name(statement, first, stop, alias))
+        if alias:
+            outputs[alias.casefold()] = f'o{i}'
+        if statement.key(first, stop) in groups or any(first <= call < stop for call in merged_calls):
+            text, params = merged(first, stop)
+        else:
+            # Columns outside aggregates and GROUP BY keys are bare columns: SQLite takes
+            # them from one row of the group, and the merge again from one partial row
+            text, params = statement.render(first, stop)
+            bare.append((f'{text} AS b{len(bare)}', params))
+            text, params = f'b{len(bare) - 1}', []
+        merge_columns.append(f'{text} AS o{i}')
+        merge_params += params
+
+    merge_sql = 'SELECT ' + ('DISTINCT ' if _word(tokens[1]) == 'DISTINCT' else '') + ', '.join(merge_columns)
+    merge_sql += ' FROM partials'
+    if group_terms:
+        merge_sql += ' GROUP BY ' + ', '.join(f'g{i}' for i in range(len(group_terms)))
+    if 'HAVING' in clauses:
+        text, params = merged(*clauses['HAVING'], output_aliases=outputs)
+        merge_sql += ' HAVING ' + text
+        merge_params += params
+    merge_order = []
+    for first, stop, suffix in order_terms:
+        if stop - first == 1 and tokens[first].kind == 'number':
+            merge_order.append(f'o{int(tokens[first].text) - 1}{suffix}')
+            continue
+        position = [i for i, (item_first, item_stop, _) in enumerate(items)
+                    if statement.key(item_first, item_stop) == statement.key(first, stop)]
+        if position:
+            merge_order.append(f'o{position[0]}{suffix}')
+            continue
+        text, params = merged(first, stop, output_aliases=outputs)
+        merge_order.append(text + suffix)
+        merge_params += params
+    tail, tail_params = _merge_tail(statement, merge_order, *_limit_clause(statement, clauses))
+    merge_sql += tail
+    merge_params += tail_params
+
+    columns = group_columns + bare + shard_columns
+    shard_sql = 'SELECT ' + ', '.join(text for text, _ in columns)
+    shard_params = [index for _, params in columns for index in params]
+    for name, keyword in (('FROM', ''), ('GROUP', 'GROUP BY ')):
+        if name in clauses:
+            text, params = statement.render(*clauses[name])
+            shard_sql += f' {keyword}{text}'
+            shard_params += params
+
+    # The merge query may only reference partial columns; anything else it still
+    # mentions, like a column outside the GROUP BY next to an aggregate, cannot merge
+    check = sqlite3.connect(':memory:')
+    try:
+        partial_names = [text.rsplit(' AS ', 1)[1] for text, _ in columns]
+        check.execute(f'CREATE TABLE partials ({", ".join(partial_names)});')
+        check.execute('EXPLAIN ' + merge_sql, [None] * len(merge_params))
+    except sqlite3.Error as e:
+        raise ShardMergeError(f'Cannot merge across shards: {e}') from None
+    finally:
+        check.close()
+    return MergePlan(shard_sql, tuple(shard_params), merge_sql, tuple(merge_params), tuple(names), 0)
+
+
+def plan(sql_query, params=()):
+    """
+    Plans a statement for fan-out.
+
+    :param sql_query: SELECT statement, with positional ? parameters.
+    :param params: Values of its parameters.
+    :return: A MergePlan, with the parameter values bound to each side.
+    :raises ShardMergeError: If the statement's answer cannot be merged exactly.
+    """
+    planned = _plan(sql_query)
+    params = tuple(params)
+    return planned._replace(shard_params=tuple(params[i] for i in planned.shard_params),
+                            merge_params=tuple(params[i] for i in planned.merge_params))
+
+
+def merge(merge_plan, results, max_rows=MAX_ROWS):
+    """
+    Combines the shard results of a planned statement.
+
+    :param merge_plan: The MergePlan the shards ran.
+    :param results: List of (columns, rows) from the shards that answered.
+    :param max_rows: Cap on the merged rows.
+    :return: Tuple of (columns, rows).
+    """
+    shard_columns = results[0][0]
+    visible = len(shard_columns) - merge_plan.hidden
+    if merge_plan.merge_sql is None:
+        rows = [row for _, shard_rows in results for row in shard_rows]
+        return shard_columns, rows[:max_rows]
+    conn = sqlite3.connect(':memory:')
+    try:
+        if merge_plan.columns is None:
+            names = [f'c{i}' for i in range(visible)] + [f'h{i}' for i in range(merge_plan.hidden)]
+        else:
+            names = list(shard_columns)
+        conn.execute(f'CREATE TABLE partials ({", ".join(names)});')
+        placeholders = ', '.join('?' for _ in names)
+        for _, rows in results:
+            conn.executemany(f'INSERT INTO partials VALUES ({placeholders});', rows)
+        rows = conn.execute(merge_plan.merge_sql, merge_plan.merge_params).fetchmany(max_rows)
+    finally:
+        conn.close()
+    if merge_plan.columns is None:
+        return shard_columns[:visible], [row[:visible] for row in rows]
+    return list(merge_plan.columns), rows
+
+
+class ShardExecutor:
+    """
+    Runs statements on every shard concurrently and merges the answers.
+
+    Each shard has a ConnectionPool and a QueryExecutor of its own. Shard queries run
+    on the executors' threads, and SQLite releases the GIL while it steps through a
+    query, so shards are scanned in parallel on as many cores as there are shards.
+    """
+
+    def __init__(self, paths=None, timeout=SHARD_TIMEOUT, pool_size=SHARD_POOL_SIZE, max_rows=MAX_ROWS):
+        """
+        :param paths: Shard database paths, defaults to shard_paths().
+        :param timeout: Wall-clock budget of a query on one shard, in seconds.
+        :param pool_size: Connections, and queries running at once, per shard.
+        :param max_rows: Cap on the rows fetched from each shard and on the merged rows.
+        """
+        self.paths = shard_paths() if paths is None else list(paths)
+        if not self.paths:
+            raise ValueError('No shards given; set LAB_DB_SHARDS')
+        self.timeout = timeout
+        self.max_rows = max_rows
+        # Every shard query is a slice of one fanned-out statement, so none is promoted
+        # to heavy: restarting it would only add to the statement's latency
+        self.executors = {path: QueryExecutor(pool=ConnectionPool(path, size=pool_size), max_workers=pool_size,
+                                              heavy_slots=1, heavy_after=float('inf'), timeout=timeout,
+                                              max_rows=max_rows)
+                          for path in self.paths}
+        self._coordinators = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='fan-out')
+        self.completed = 0
+        self.partial = 0
+        self.failed = 0
+
+    def submit(self, sql_query, params=(), timeout=None):
+        """
+        Fans a statement out in the background.
+
+        :return: A concurrent.futures.Future resolving like run().
+        """
+        return self._coordinators.submit(self.run, sql_query, params, timeout)
+
+    def run(self, sql_query, params=(), timeout=None):
+        """
+        Runs a statement on every shard and merges the answers.
+
+        :param sql_query: SELECT statement, with positional ? parameters.
+        :param params: Values of its parameters.
+        :param timeout: Per-shard budget in seconds, defaults to the executor's.
+        :return: A ShardResult of (columns, rows, failures), where failures maps each
+            shard that failed, ran out of time or was truncated to its error.
+        :raises ShardMergeError: If the answer cannot be merged from per-shard results.
+        :raises ShardsFailed: If no shard answered.
+        """
+        merge_plan = plan(sql_query, params)
+        with tracing.span('fan_out', shards=len(self.paths)) as fan_out_span:
+            handles = {path: executor.submit(merge_plan.shard_sql, merge_plan.shard_params, timeout)
+                       for path, executor in self.executors.items()}
+            results, failures = [], {}
+            for path, handle in handles.items():
+                try:
+                    result = handle.result()
+                except (QueryCancelled, QueryTimeout, PoolTimeout, sqlite3.Error) as e:
+                    failures[path] = f'{type(e).__name__}: {e}'
+                    continue
+                if handle.truncated:
+                    failures[path] = f'truncated at {handle.max_rows} rows'
+                    # Partial aggregates of a truncated shard would be wrong, not just short
+                    if merge_plan.columns is not None:
+                        continue
+                results.append(result)
+            fan_out_span.count('failures', len(failures))
+        if not results:
+            self.failed += 1
+            raise ShardsFailed(failures)
+        with tracing.span('merge', shards=len(results)) as merge_span:
+            columns, rows = merge(merge_plan, results, self.max_rows)
+            merge_span.count('rows', len(rows))
+        if failures:
+            self.partial += 1
+        else:
+            self.completed += 1
+        return ShardResult(columns, rows, failures)
+
+    def stats(self):
+        """
+        Returns fan-out counters and each shard's executor counters.
+
+        :return: Dict with completed, partial, failed and shards.
+        """
+        return {
+            'completed': self.completed,
+            'partial': self.partial,
+            'failed': self.failed,
+            'shards': {path: executor.stats() for path, executor in self.executors.items()},
+        }
+
+    def close(self):
+        self._coordinators.shutdown(wait=False, cancel_futures=True)
+        for executor in self.executors.values():
+            executor.close()
+            executor.pool.close()
+
+
+_shard_executor = None
+_shard_executor_lock = threading.Lock()
+
+
+def get_shard_executor():
+    """
+    Returns the process-wide executor for the LAB_DB_SHARDS databases, creating it on first use.
+
+    :return: The shared ShardExecutor.
+    :raises ValueError: If LAB_DB_SHARDS names no shards.
+    """
+    global _shard_executor
+    if _shard_executor is None:
+        with _shard_executor_lock:
+            if _shard_executor is None:
+                _shard_executor = ShardExecutor()
+    return _shard_executor
+
+
+def _parameter(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sql')
+    parser.add_argument('--params', nargs='*', default=[], type=_parameter, help='values for ? placeholders')
+    parser.add_argument('--shards', help='comma-separated databases or glob patterns, defaults to LAB_DB_SHARDS')
+    parser.add_argument('--timeout', type=float, default=SHARD_TIMEOUT, help='seconds per shard')
+    parser.add_argument('--plan', action='store_true', help='print the shard and merge queries only')
+    args = parser.parse_args()
+
+    try:
+        merge_plan = plan(args.sql, args.params)
+    except ShardMergeError as e:
+        parser.exit(1, f'{e}\n')
+    if args.plan:
+        print(f'shard query: {merge_plan.shard_sql}\n  params {list(merge_plan.shard_params)}')
+        if merge_plan.merge_sql is None:
+            print('merge: concatenate')
+        else:
+            print(f'merge query: {merge_plan.merge_sql}\n  params {list(merge_plan.merge_params)}')
+        return
+    executor = ShardExecutor(shard_paths(args.shards), timeout=args.timeout)
+    try:
+        result = executor.run(args.sql, args.params)
+    except ShardsFailed as e:
+        parser.exit(1, f'No shard answered: {e}\n')
+    finally:
+        executor.close()
+    print('\t'.join(result.columns))
+    for row in result.rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+    for path, error in result.failures.items():
+        print(f'shard {path} failed: {error}', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
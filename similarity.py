@@ -1,17 +1,59 @@
 # similarity.py
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
+import sqlite3
 import string
-import nltk
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
+import threading
+from functools import lru_cache
+import numpy as np
+import tracing
+from cache import MISSING, LRUCache
+from catalog import CATALOG_PATH, CatalogStore, load_catalog_index, refresh
+from precompile import get_precompiler
+from retrieval import BACKENDS, above_threshold, top_n_indices
+from templates import ENTITY_SOURCES, NUMBER, bind, extract, parse_template, template_text
+
+# Directory holding the compiled matcher index (build it with `python matcher_index.py`)
+INDEX_PATH = os.environ.get(
+    'MATCHER_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matcher_index'),
+)
+
+# Retrieval backend used by get_top_n_sql_queries (see retrieval.BACKENDS)
+RETRIEVAL_BACKEND = os.environ.get('MATCHER_BACKEND', 'maxscore')
+
+# Bounds of the per-token stem cache and the normalized-query -> matches cache
+STEM_CACHE_SIZE = 50000
+RESULT_CACHE_SIZE = 2048
+RESULT_CACHE_TTL = 3600
 
-# Download NLTK data if not already present
-nltk.download('punkt')
+# Stems mapped onto one stem, so that phrasings of one query shape match its single
+# catalog entry ("earning over" and "with salaries above", "show" and "list")
+# instead of each needing a catalog row of its own
+SYNONYMS = {
+    'list': 'show', 'find': 'show', 'display': 'show', 'get': 'show', 'give': 'show', 'what': 'show',
+    'cost': 'price',
+    'earn': 'salari', 'paid': 'salari', 'pay': 'salari', 'wage': 'salari',
+    'staff': 'employe', 'worker': 'employe', 'personnel': 'employe',
+    'over': 'abov', 'exceed': 'abov', 'exce': 'abov', 'greater': 'abov', 'more': 'abov', 'higher': 'abov',
+    'under': 'below', 'less': 'below', 'lower': 'below', 'cheaper': 'below',
+    'highcost': 'expens', 'costli': 'expens', 'pricey': 'expens',
+}
+
+# The stemmer and tokenizer are created on first use, since importing NLTK takes
+# seconds. The word tokenizer needs no NLTK data packages, so nothing is downloaded.
+stemmer = None
+tokenizer = None
+
+def _load_nltk():
+    global stemmer, tokenizer
+    from nltk.stem import PorterStemmer
+    from nltk.tokenize import NLTKWordTokenizer
+    stemmer = PorterStemmer()
+    tokenizer = NLTKWordTokenizer()
 
-# Initialize the stemmer
-stemmer = PorterStemmer()
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def _stem(word):
+    return stemmer.stem(word)
 
 def preprocess(text):
     """
@@ -20,83 +62,94 @@ def preprocess(text):
     :param text: The input text string.
     :return: The preprocessed text string.
     """
+    if stemmer is None:
+        _load_nltk()
     # Lowercase
     text = text.lower()
     # Remove punctuation
     text = text.translate(str.maketrans('', '', string.punctuation))
-    # Tokenize
-    tokens = word_tokenize(text)
-    # Stem
-    tokens = [stemmer.stem(word) for word in tokens]
+    # Tokenize (punctuation is already gone, so sentence splitting is unnecessary)
+    tokens = tokenizer.tokenize(text)
+    # Stem, then fold synonyms
+    tokens = [_stem(word) for word in tokens]
+    tokens = [SYNONYMS.get(token, token) for token in tokens]
     # Join back to string
     return ' '.join(tokens)
 
-# Predefined natural language queries and their corresponding SQL queries
+def preprocess_question(question):
+    """
+    Preprocesses a catalog question, turning its slots and numbers into slot tokens.
+
+    User queries get the same tokens from templates.extract(), so one template
+    matches every value of its slots.
+    
+    :param question: Catalog question, possibly with {slot} placeholders.
+    :return: The preprocessed text string.
+    """
+    return preprocess(template_text(question))
+
+# Predefined natural language queries and their corresponding SQL queries. They seed
+# the catalog store (see catalog.py), which also holds questions added at runtime.
+# {department}, {location}, {role} and number slots such as {price} are filled from
+# the user query and bound as :name parameters (see templates.py).
 PREDEFINED_QUERIES = {
     "Show all the data": "SELECT * from employees",
     "List all lab tests.": "SELECT name FROM LabTests;",
-    "List all labs.": "SELECT name, price FROM LabTests;",  # Added synonym
-    "List all lab tests in Hematology department.": "SELECT name, price FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Hematology');",
-    "Show the names and normal ranges of lab tests in Biochemistry.": "SELECT name, normal_range FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Biochemistry');",
-    "What lab tests are available in Chicago?": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'Chicago';",
-    "Find the average price of lab tests in Immunology.": "SELECT AVG(price) FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology');",
+    "List all lab tests in {department} department.": "SELECT name, price FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department);",
+    "Show the names and normal ranges of lab tests in {department}.": "SELECT name, normal_range FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department);",
+    "Show lab tests in departments located in {location}.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = :location;",
+    "Find the average price of lab tests in {department}.": "SELECT AVG(price) FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department);",
     "List all lab tests with their department names.": "SELECT LabTests.name, Departments.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id;",
     "Show the total number of lab tests in each department.": "SELECT Departments.name, COUNT(LabTests.id) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;",
     "Find lab tests with prices greater than the average price.": "SELECT name, price FROM LabTests WHERE price > (SELECT AVG(price) FROM LabTests);",
     "List departments and their locations.": "SELECT name, location FROM Departments;",
-    "Show lab tests in the Pathology department.": "SELECT name FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Pathology');",
+    "Show lab tests in the {department} department.": "SELECT name FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department);",
     "Show all lab test details.": "SELECT * FROM LabTests;",
     "List all departments.": "SELECT * FROM Departments;",
-    "Show the number of lab tests in Hematology.": "SELECT COUNT(*) FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Hematology');",
-    "Find lab tests in New York.": "SELECT name FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE location = 'New York');",
-    "List lab tests with prices above 70.": "SELECT name, price FROM LabTests WHERE price > 70;",
+    "Show the number of lab tests in {department}.": "SELECT COUNT(*) FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department);",
+    "List lab tests with prices above {price}.": "SELECT name, price FROM LabTests WHERE price > :price;",
     "Show average price per department.": "SELECT Departments.name, AVG(LabTests.price) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;",
     "List lab tests with normal ranges for C-Reactive Protein (CRP).": "SELECT name, normal_range FROM LabTests WHERE name = 'C-Reactive Protein (CRP)';",
-    "List all lab test names.": "SELECT name FROM LabTests;",
     "Find the most expensive lab test.": "SELECT name, price FROM LabTests ORDER BY price DESC LIMIT 1;",
-    "Show lab tests costing less than 50.": "SELECT name, price FROM LabTests WHERE price < 50;",
-    "List lab tests and their prices.": "SELECT name, price FROM LabTests;",
+    "Show lab tests costing less than {price}.": "SELECT name, price FROM LabTests WHERE price < :price;",
+    "List lab test names and their prices.": "SELECT name, price FROM LabTests;",
     "Show the departments with the highest number of lab tests.": "SELECT Departments.name, COUNT(LabTests.id) as test_count FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name ORDER BY test_count DESC;",
-    "Find lab tests in the second floor.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'Second Floor';",
-    "List employees working in Immunology department.": "SELECT Employees.name, Employees.role FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology');",
+    "List employees working in {department} department.": "SELECT Employees.name, Employees.role FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department);",
     "Show all employees": "SELECT name FROM employees;",
     "Show all employee roles.": "SELECT DISTINCT role FROM Employees;",
-    "Find employees with the role of Lab Manager.": "SELECT name FROM Employees WHERE role = 'Lab Manager';",
+    "Find employees with the role of {role}.": "SELECT name FROM Employees WHERE role = :role;",
     "List employees and their departments.": "SELECT Employees.name, Departments.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id;",
     "Show the total salary expenditure per department.": "SELECT Departments.name, SUM(Employees.salary) FROM Employees JOIN Departments ON Employees.department_id = Departments.id GROUP BY Departments.name;",
     "Find the youngest employee in each department.": "SELECT Departments.name, Employees.name, Employees.age FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Employees.age = (SELECT MIN(age) FROM Employees WHERE department_id = Departments.id);",
-    "List all roles in the lab.": "SELECT DISTINCT role FROM Employees;",
-    "Show employees in the Third Floor department.": "SELECT Employees.name, Employees.role FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = 'Third Floor';",
-    "Find employees with salaries above 70000.": "SELECT name, salary FROM Employees WHERE salary > 70000;",
+    "Show employees in departments located in {location}.": "SELECT Employees.name, Employees.role FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = :location;",
+    "Find employees with salaries above {salary}.": "SELECT name, salary FROM Employees WHERE salary > :salary;",
     "List all lab tests along with their prices and normal ranges.": "SELECT name, price, normal_range FROM LabTests;",
     "Show the most common lab test location.": "SELECT Departments.location, COUNT(LabTests.id) as test_count FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.location ORDER BY test_count DESC LIMIT 1;",
-    "Find lab tests that are priced between 30 and 60.": "SELECT name, price FROM LabTests WHERE price BETWEEN 30 AND 60;",
+    "Find lab tests priced between {min_price} and {max_price}.": "SELECT name, price FROM LabTests WHERE price BETWEEN :min_price AND :max_price;",
     "List all employees with their roles and departments.": "SELECT Employees.name, Employees.role, Departments.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id;",
-    "List lab tests costing exactly 50.": "SELECT name FROM LabTests WHERE price = 50;",
-    "Show lab tests priced between 40 and 60.": "SELECT name, price FROM LabTests WHERE price BETWEEN 40 AND 60;",
+    "List lab tests costing exactly {price}.": "SELECT name FROM LabTests WHERE price = :price;",
     "Find the cheapest lab test in each department.": "SELECT Departments.name, LabTests.name, LabTests.price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE LabTests.price = (SELECT MIN(price) FROM LabTests WHERE department_id = Departments.id);",
-    "List lab tests with prices not equal to 30.": "SELECT name, price FROM LabTests WHERE price != 30;",
-    "Show lab tests that cost more than the average price.": "SELECT name, price FROM LabTests WHERE price > (SELECT AVG(price) FROM LabTests);",
+    "List lab tests with prices not equal to {price}.": "SELECT name, price FROM LabTests WHERE price != :price;",
     "Find employees with salaries above the average salary.": "SELECT name, salary FROM Employees WHERE salary > (SELECT AVG(salary) FROM Employees);",
-    "List lab tests with prices in the top 10% of all tests.": "SELECT name, price FROM LabTests WHERE price > (SELECT percentile_cont(0.9) WITHIN GROUP (ORDER BY price) FROM LabTests);",
-    "Show employees earning less than 50000.": "SELECT name, salary FROM Employees WHERE salary < 50000;",
+    "List lab tests with prices in the top 10% of all tests.": "SELECT name, price FROM LabTests WHERE price > (SELECT PERCENTILE(price, 0.9) FROM LabTests);",
+    "Show employees earning less than {salary}.": "SELECT name, salary FROM Employees WHERE salary < :salary;",
     "Find lab tests that are the most expensive in their department.": "SELECT Departments.name, LabTests.name, LabTests.price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE LabTests.price = (SELECT MAX(price) FROM LabTests WHERE department_id = Departments.id);",
-    "List departments where the total price of lab tests exceeds 300.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING SUM(LabTests.price) > 300;",
+    "List departments where the total price of lab tests exceeds {total}.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING SUM(LabTests.price) > :total;",
     
     # Combining Multiple Filters
-    "Find lab tests in Hematology priced above 50.": "SELECT name, price FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Hematology') AND price > 50;",
-    "List employees in Biochemistry earning over 70000.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Biochemistry') AND salary > 70000;",
-    "Show lab tests in Immunology priced below 40.": "SELECT name, price FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology') AND price < 40;",
-    "Find employees in Pathology older than 35.": "SELECT name, age FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Pathology') AND age > 35;",
-    "List lab tests in Microbiology with normal ranges containing 'ng/mL'.": "SELECT name, normal_range FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = 'Microbiology') AND normal_range LIKE '%ng/mL%';",
-    "Show employees in departments located in Chicago earning above 60000.": "SELECT Employees.name, Employees.salary FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = 'Chicago' AND Employees.salary > 60000;",
-    "Find lab tests administered by employees younger than 30.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.age < 30;",
-    "List employees who are Lab Managers and earn more than 75000.": "SELECT name, salary FROM Employees WHERE role = 'Lab Manager' AND salary > 75000;",
-    "Show lab tests in departments on the Second Floor costing less than 60.": "SELECT name, price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'Second Floor' AND LabTests.price < 60;",
-    "Find employees in Immunology earning between 50000 and 80000.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology') AND salary BETWEEN 50000 AND 80000;",
+    "Find lab tests in {department} priced above {price}.": "SELECT name, price FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND price > :price;",
+    "List employees in {department} earning over {salary}.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND salary > :salary;",
+    "Show lab tests in {department} priced below {price}.": "SELECT name, price FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND price < :price;",
+    "Find employees in {department} older than {age}.": "SELECT name, age FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND age > :age;",
+    "List lab tests in {department} with normal ranges containing 'ng/mL'.": "SELECT name, normal_range FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND normal_range LIKE '%ng/mL%';",
+    "Show employees in departments located in {location} earning above {salary}.": "SELECT Employees.name, Employees.salary FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = :location AND Employees.salary > :salary;",
+    "Find lab tests administered by employees younger than {age}.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.age < :age;",
+    "List employees who are {role} and earn more than {salary}.": "SELECT name, salary FROM Employees WHERE role = :role AND salary > :salary;",
+    "Show lab tests in departments on the {location} costing less than {price}.": "SELECT LabTests.name, LabTests.price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = :location AND LabTests.price < :price;",
+    "Find employees in {department} earning between {min_salary} and {max_salary}.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND salary BETWEEN :min_salary AND :max_salary;",
     
     # Advanced Aggregations
-    "Calculate the median price of lab tests in each department.": "SELECT Departments.name, AVG(LabTests.price) as median_price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;",
+    "Calculate the median price of lab tests in each department.": "SELECT Departments.name, MEDIAN(LabTests.price) as median_price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;",
     "Show the standard deviation of employee salaries in each department.": "SELECT Departments.name, STDDEV(Employees.salary) FROM Employees JOIN Departments ON Employees.department_id = Departments.id GROUP BY Departments.name;",
     "Find the variance in lab test prices across all departments.": "SELECT VARIANCE(price) FROM LabTests;",
     "List departments with the highest average employee salary.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY AVG(Employees.salary) DESC LIMIT 1;",
@@ -135,21 +188,19 @@ PREDEFINED_QUERIES = {
     "List employees along with the average price of lab tests in their department.": "SELECT Employees.name, AVG(LabTests.price) FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id GROUP BY Employees.name;",
     "Show the highest and lowest priced lab tests in each department.": "SELECT Departments.name, MAX(LabTests.price) as max_price, MIN(LabTests.price) as min_price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;",
     "Find employees who manage the most expensive lab tests.": "SELECT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id GROUP BY Employees.name ORDER BY MAX(LabTests.price) DESC LIMIT 1;",
-    "List departments with an average employee salary above 60000.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name HAVING AVG(Employees.salary) > 60000;",
+    "List departments with an average employee salary above {salary}.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name HAVING AVG(Employees.salary) > :salary;",
     
     # Specific Attribute Listings
-    "List all lab test names and their prices.": "SELECT name, price FROM LabTests;",
     "Show all employee names and their salaries.": "SELECT name, salary FROM Employees;",
-    "Find all departments and their locations.": "SELECT name, location FROM Departments;",
     "List all lab test names along with their normal ranges.": "SELECT name, normal_range FROM LabTests;",
     "Show employee names, roles, and ages.": "SELECT name, role, age FROM Employees;",
     
     # Combining Conditions and Aggregations
-    "Find departments where the average lab test price is above 60 and have more than five tests.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) > 60 AND COUNT(LabTests.id) > 5;",
-    "List employees in departments offering lab tests priced between 30 and 50.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price BETWEEN 30 AND 50;",
-    "Show the average salary of employees in departments located in Chicago.": "SELECT Departments.name, AVG(Employees.salary) FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = 'Chicago' GROUP BY Departments.name;",
-    "Find lab tests administered by employees earning above 70000.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.salary > 70000;",
-    "List departments with employees older than 40 and lab tests priced above 80.": "SELECT DISTINCT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id JOIN LabTests ON Departments.id = LabTests.department_id WHERE Employees.age > 40 AND LabTests.price > 80;",
+    "Find departments where the average lab test price is above {price} and have more than {count} tests.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) > :price AND COUNT(LabTests.id) > :count;",
+    "List employees in departments offering lab tests priced between {min_price} and {max_price}.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price BETWEEN :min_price AND :max_price;",
+    "Show the average salary of employees in departments located in {location}.": "SELECT Departments.name, AVG(Employees.salary) FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = :location GROUP BY Departments.name;",
+    "Find lab tests administered by employees earning above {salary}.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.salary > :salary;",
+    "List departments with employees older than {age} and lab tests priced above {price}.": "SELECT DISTINCT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id JOIN LabTests ON Departments.id = LabTests.department_id WHERE Employees.age > :age AND LabTests.price > :price;",
     
     # Additional Creative Queries
     "Show the most common lab test price.": "SELECT price, COUNT(*) as frequency FROM LabTests GROUP BY price ORDER BY frequency DESC LIMIT 1;",
@@ -157,64 +208,58 @@ PREDEFINED_QUERIES = {
     "List lab tests offered by departments with no employees.": "SELECT LabTests.name FROM LabTests LEFT JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.id IS NULL;",
     "Show departments with the least number of employees.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY COUNT(Employees.id) ASC LIMIT 1;",
     "Find lab tests that are more expensive than the average salary of employees in their department.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON LabTests.department_id = Employees.department_id WHERE LabTests.price > (SELECT AVG(salary) FROM Employees WHERE department_id = Departments.id);",
-    "List employees who manage departments offering lab tests below 50.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = 'Lab Manager' AND LabTests.price < 50;",
+    "List employees who manage departments offering lab tests below {price}.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = 'Lab Manager' AND LabTests.price < :price;",
     "Show the average age of employees per department.": "SELECT Departments.name, AVG(Employees.age) FROM Employees JOIN Departments ON Employees.department_id = Departments.id GROUP BY Departments.name;",
     "Find departments where employees earn above the overall average salary.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name HAVING AVG(Employees.salary) > (SELECT AVG(salary) FROM Employees);",
     "List lab tests along with the number of employees in their department.": "SELECT LabTests.name, COUNT(Employees.id) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON Departments.id = Employees.department_id GROUP BY LabTests.name;",
     "Show departments offering the same number of lab tests as their number of employees.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name HAVING COUNT(LabTests.id) = COUNT(Employees.id);",
     
     # Additional 50 Queries for Diversity
-    "List all lab tests with a price greater than 90.": "SELECT name, price FROM LabTests WHERE price > 90;",
-    "Show employees who earn exactly 50000.": "SELECT name FROM Employees WHERE salary = 50000;",
-    "Find lab tests in departments not located in Chicago.": "SELECT name FROM LabTests WHERE department_id NOT IN (SELECT id FROM Departments WHERE location = 'Chicago');",
-    "List employees working in departments on the First Floor.": "SELECT Employees.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = 'First Floor';",
+    "Show employees who earn exactly {salary}.": "SELECT name FROM Employees WHERE salary = :salary;",
+    "List employees working in departments on the {location}.": "SELECT Employees.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = :location;",
+    "Find lab tests in departments not located in {location}.": "SELECT name FROM LabTests WHERE department_id NOT IN (SELECT id FROM Departments WHERE location = :location);",
     "Show the most common salary among employees.": "SELECT salary FROM Employees GROUP BY salary ORDER BY COUNT(*) DESC LIMIT 1;",
     "Find lab tests with prices less than the average lab test price.": "SELECT name, price FROM LabTests WHERE price < (SELECT AVG(price) FROM LabTests);",
-    "List departments that offer at least one lab test costing above 80.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.price > 80;",
+    "List departments that offer at least one lab test costing above {price}.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.price > :price;",
     "Show employees who are older than the average employee age.": "SELECT name, age FROM Employees WHERE age > (SELECT AVG(age) FROM Employees);",
-    "Find lab tests administered by employees older than 40.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.age > 40;",
+    "Find lab tests administered by employees older than {age}.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.age > :age;",
     "List departments with the highest average lab test price.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) = (SELECT MAX(avg_price) FROM (SELECT AVG(price) as avg_price FROM LabTests GROUP BY department_id));",
     
-    "Show employees in Immunology earning above 60000.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology') AND salary > 60000;",
-    "Find lab tests with prices not between 30 and 70.": "SELECT name, price FROM LabTests WHERE price NOT BETWEEN 30 AND 70;",
-    "List employees who work in departments offering more than five lab tests.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id GROUP BY Employees.name HAVING COUNT(LabTests.id) > 5;",
-    "Show the total number of lab tests in departments on the Fourth Floor.": "SELECT COUNT(LabTests.id) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'Fourth Floor';",
+    "Find lab tests with prices not between {min_price} and {max_price}.": "SELECT name, price FROM LabTests WHERE price NOT BETWEEN :min_price AND :max_price;",
+    "List employees who work in departments offering more than {count} lab tests.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id GROUP BY Employees.name HAVING COUNT(LabTests.id) > :count;",
+    "Show the total number of lab tests in departments on the {location}.": "SELECT COUNT(LabTests.id) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = :location;",
     "Find employees whose names end with 'n'.": "SELECT name FROM Employees WHERE name LIKE '%n';",
     "List lab tests that have a normal range containing 'mg/L'.": "SELECT name FROM LabTests WHERE normal_range LIKE '%mg/L%';",
-    "Show departments with an average lab test price below 50.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) < 50;",
-    "Find employees with the highest salary in Immunology.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology') AND salary = (SELECT MAX(salary) FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Immunology'));",
-    "List lab tests offered by departments with employees earning above 70000.": "SELECT DISTINCT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.salary > 70000;",
-    "Show employees in departments offering lab tests priced between 50 and 100.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price BETWEEN 50 AND 100;",
+    "Show departments with an average lab test price below {price}.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) < :price;",
+    "Find employees with the highest salary in {department}.": "SELECT name, salary FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department) AND salary = (SELECT MAX(salary) FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department));",
+    "List lab tests offered by departments with employees earning above {salary}.": "SELECT DISTINCT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.salary > :salary;",
     
-    "List departments that offer lab tests with prices exactly 25.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.price = 25;",
-    "Show lab tests in departments with no employees earning below 50000.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.id NOT IN (SELECT department_id FROM Employees WHERE salary < 50000);",
+    "List departments that offer lab tests with prices exactly {price}.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.price = :price;",
+    "Show lab tests in departments with no employees earning below {salary}.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.id NOT IN (SELECT department_id FROM Employees WHERE salary < :salary);",
     "Find employees who manage departments offering the most expensive lab tests.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price = (SELECT MAX(price) FROM LabTests);",
-    "List lab tests in departments where the average employee age is above 30.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON Departments.id = Employees.department_id GROUP BY LabTests.name HAVING AVG(Employees.age) > 30;",
+    "List lab tests in departments where the average employee age is above {age}.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON Departments.id = Employees.department_id GROUP BY LabTests.name HAVING AVG(Employees.age) > :age;",
     "Show employees who work in departments offering lab tests with normal ranges starting with '0-'.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.normal_range LIKE '0-%';",
+    "Find the total salary paid to {role}.": "SELECT SUM(salary) FROM Employees WHERE role = :role;",
     
-    "Find the total salary paid to Lab Managers.": "SELECT SUM(salary) FROM Employees WHERE role = 'Lab Manager';",
-    "List lab tests with prices not equal to 75.": "SELECT name, price FROM LabTests WHERE price != 75;",
-    "Show employees in departments on the Second Floor earning between 60000 and 80000.": "SELECT name, salary FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = 'Second Floor' AND Employees.salary BETWEEN 60000 AND 80000;",
-    "Find lab tests offered by departments with more than two employees.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id GROUP BY LabTests.name HAVING COUNT(Employees.id) > 2;",
-    "List employees who are Senior Analysts and earn above 90000.": "SELECT name, salary FROM Employees WHERE role = 'Senior Analyst' AND salary > 90000;",
+    "Show employees in departments on the {location} earning between {min_salary} and {max_salary}.": "SELECT Employees.name, Employees.salary FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = :location AND Employees.salary BETWEEN :min_salary AND :max_salary;",
+    "Find lab tests offered by departments with more than {count} employees.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id GROUP BY LabTests.name HAVING COUNT(Employees.id) > :count;",
     
-    "Show lab tests in departments located in San Francisco.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'San Francisco';",
     "Find employees who have the same salary as the 'Lipid Panel' test.": "SELECT name FROM Employees WHERE salary = (SELECT price FROM LabTests WHERE name = 'Lipid Panel');",
     "List departments with lab tests priced above their department's average.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.price > (SELECT AVG(price) FROM LabTests WHERE department_id = Departments.id);",
-    "Show employees who are older than the oldest employee in Pathology.": "SELECT name, age FROM Employees WHERE age > (SELECT MAX(age) FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = 'Pathology'));",
-    "Find lab tests that are administered by employees earning exactly 50000.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.salary = 50000;",
+    "Show employees who are older than the oldest employee in {department}.": "SELECT name, age FROM Employees WHERE age > (SELECT MAX(age) FROM Employees WHERE department_id = (SELECT id FROM Departments WHERE name = :department));",
+    "Find lab tests that are administered by employees earning exactly {salary}.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.salary = :salary;",
     
     "List all lab tests along with the names of employees who administer them.": "SELECT LabTests.name, Employees.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id;",
     "Show departments offering lab tests with normal ranges greater than '50 mg/dL'.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.normal_range > '50 mg/dL';",
     "Find employees who work in departments offering both 'Complete Blood Count (CBC)' and 'Urinalysis'.": "SELECT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.name IN ('Complete Blood Count (CBC)', 'Urinalysis') GROUP BY Employees.name HAVING COUNT(DISTINCT LabTests.name) = 2;",
-    "List lab tests administered by employees younger than 35 and earning above 60000.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.age < 35 AND Employees.salary > 60000;",
-    "Show departments that offer lab tests with prices between 25 and 50 and have employees older than 30.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id WHERE LabTests.price BETWEEN 25 AND 50 AND Employees.age > 30;",
+    "List lab tests administered by employees younger than {age} and earning above {salary}.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.age < :age AND Employees.salary > :salary;",
+    "Show departments that offer lab tests with prices between {min_price} and {max_price} and have employees older than {age}.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id WHERE LabTests.price BETWEEN :min_price AND :max_price AND Employees.age > :age;",
+    "Find lab tests that are administered by both {role} and {role2}.": "SELECT DISTINCT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.role IN (:role, :role2) GROUP BY LabTests.name HAVING COUNT(DISTINCT Employees.role) = 2;",
     
-    "Find lab tests that are administered by both Lab Managers and Lab Technicians.": "SELECT DISTINCT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.role IN ('Lab Manager', 'Lab Technician') GROUP BY LabTests.name HAVING COUNT(DISTINCT Employees.role) = 2;",
     "List employees who manage the most and least expensive lab tests.": "SELECT name FROM Employees WHERE salary IN ((SELECT MAX(price) FROM LabTests), (SELECT MIN(price) FROM LabTests));",
     "Show departments with the highest total salary expenditure.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY SUM(Employees.salary) DESC LIMIT 1;",
     "Find lab tests that have the same price as any employee's salary.": "SELECT name FROM LabTests WHERE price IN (SELECT salary FROM Employees);",
-    "List employees in departments offering lab tests priced above 90.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price > 90;",
+    "List employees in departments offering lab tests priced above {price}.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price > :price;",
     
     # Advanced Pattern Matching
     "Show lab tests with names containing both 'Blood' and 'Count'.": "SELECT name FROM LabTests WHERE name LIKE '%Blood%' AND name LIKE '%Count%';",
@@ -238,93 +283,360 @@ PREDEFINED_QUERIES = {
     "List departments that have added new lab tests in the current year.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.added_year = strftime('%Y','now');",
     
     # Null and Not Null Queries
-    "Find employees who do not have a specified salary.": "SELECT name FROM Employees WHERE salary IS NULL;",
-    "List lab tests without a specified normal range.": "SELECT name FROM LabTests WHERE normal_range IS NULL OR normal_range = '';",
     "Show departments that do not have any lab tests assigned.": "SELECT Departments.name FROM Departments LEFT JOIN LabTests ON Departments.id = LabTests.department_id WHERE LabTests.id IS NULL;",
-    "Find employees without an assigned department.": "SELECT name FROM Employees WHERE department_id IS NULL;",
-    "List lab tests where the price is not set.": "SELECT name FROM LabTests WHERE price IS NULL;",
+    "List all {role} along with their departments.": "SELECT Employees.name, Departments.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Employees.role = :role;",
     
     # Role-Based Queries
-    "List all Lab Managers along with their departments.": "SELECT Employees.name, Departments.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Employees.role = 'Lab Manager';",
-    "Show Lab Technicians earning above 50000.": "SELECT name, salary FROM Employees WHERE role = 'Lab Technician' AND salary > 50000;",
-    "Find Quality Control staff in Biochemistry.": "SELECT Employees.name FROM Employees WHERE role = 'Quality Control' AND department_id = (SELECT id FROM Departments WHERE name = 'Biochemistry');",
-    "List Senior Analysts with salaries above 90000.": "SELECT name, salary FROM Employees WHERE role = 'Senior Analyst' AND salary > 90000;",
-    "Show employees in the 'Quality Control' role and located on the Second Floor.": "SELECT Employees.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Employees.role = 'Quality Control' AND Departments.location = 'Second Floor';",
+    "Find {role} staff in {department}.": "SELECT Employees.name FROM Employees WHERE role = :role AND department_id = (SELECT id FROM Departments WHERE name = :department);",
+    "Show employees in the {role} role and located on the {location}.": "SELECT Employees.name FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Employees.role = :role AND Departments.location = :location;",
     
     # Combining Aggregations and Conditions
-    "Find departments where the average lab test price is above 60 and have more than three tests.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) > 60 AND COUNT(LabTests.id) > 3;",
     "List employees who are older than the average employee age and earn above the average salary.": "SELECT name FROM Employees WHERE age > (SELECT AVG(age) FROM Employees) AND salary > (SELECT AVG(salary) FROM Employees);",
-    "Show departments with the highest total salary expenditure.": "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY SUM(Employees.salary) DESC LIMIT 1;",
-    "Find lab tests that cost more than the average salary of employees in their department.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON LabTests.department_id = Employees.department_id WHERE LabTests.price > (SELECT AVG(salary) FROM Employees WHERE department_id = Departments.id);",
-    "List employees who manage departments offering lab tests priced below 50.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = 'Lab Manager' AND LabTests.price < 50;",
     
     # Temporal Queries (Assuming 'join_date' and 'introduced_date' exist)
     "Find employees who joined after January 1, 2018.": "SELECT name FROM Employees WHERE join_date > '2018-01-01';",
     "List lab tests introduced before 2020.": "SELECT name FROM LabTests WHERE introduced_date < '2020-01-01';",
-    "Show employees who joined in the year 2020.": "SELECT name FROM Employees WHERE strftime('%Y', join_date) = '2020';",
-    "Find lab tests introduced in the last two years.": "SELECT name FROM LabTests WHERE introduced_date >= date('now', '-2 years');",
-    "List employees who have been with the lab for over five years.": "SELECT name FROM Employees WHERE join_date <= date('now', '-5 years');",
     
     # Complex Conditional Queries
-    "Find lab tests that are either priced above 80 or belong to Immunology.": "SELECT name, price FROM LabTests WHERE price > 80 OR department_id = (SELECT id FROM Departments WHERE name = 'Immunology');",
-    "List employees who are Lab Technicians in departments offering tests priced below 50.": "SELECT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = 'Lab Technician' AND LabTests.price < 50;",
-    "Show lab tests in departments located on the Fourth Floor and priced above 60.": "SELECT name, price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'Fourth Floor' AND LabTests.price > 60;",
-    "Find employees who are either Lab Managers or earn above 80000.": "SELECT name, role, salary FROM Employees WHERE role = 'Lab Manager' OR salary > 80000;",
-    "List departments offering lab tests with normal ranges containing 'mg/L' and have at least two employees.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id WHERE LabTests.normal_range LIKE '%mg/L%' GROUP BY Departments.name HAVING COUNT(Employees.id) >= 2;",
+    "Find lab tests that are either priced above {price} or belong to {department}.": "SELECT name, price FROM LabTests WHERE price > :price OR department_id = (SELECT id FROM Departments WHERE name = :department);",
+    "List employees who are {role} in departments offering tests priced below {price}.": "SELECT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = :role AND LabTests.price < :price;",
+    "Show lab tests in departments located on the {location} and priced above {price}.": "SELECT LabTests.name, LabTests.price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = :location AND LabTests.price > :price;",
+    "Find employees who are either {role} or earn above {salary}.": "SELECT name, role, salary FROM Employees WHERE role = :role OR salary > :salary;",
+    "List departments offering lab tests with normal ranges containing 'mg/L' and have at least {count} employees.": "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id WHERE LabTests.normal_range LIKE '%mg/L%' GROUP BY Departments.name HAVING COUNT(Employees.id) >= :count;",
     
     # Logical Operators and Advanced Conditions
-    "Find lab tests that start with 'Blood' and are priced above 50.": "SELECT name, price FROM LabTests WHERE name LIKE 'Blood%' AND price > 50;",
-    "List employees who are not Lab Managers and earn less than 60000.": "SELECT name FROM Employees WHERE role != 'Lab Manager' AND salary < 60000;",
-    "Show lab tests that are either in Biochemistry or Immunology and priced below 80.": "SELECT name, price FROM LabTests WHERE (department_id = (SELECT id FROM Departments WHERE name = 'Biochemistry') OR department_id = (SELECT id FROM Departments WHERE name = 'Immunology')) AND price < 80;",
-    "Find employees who are either older than 40 or earn above 90000.": "SELECT name FROM Employees WHERE age > 40 OR salary > 90000;",
-    "List lab tests that are not administered by Lab Managers.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.role != 'Lab Manager';",
+    "Find lab tests that start with 'Blood' and are priced above {price}.": "SELECT name, price FROM LabTests WHERE name LIKE 'Blood%' AND price > :price;",
+    "List employees who are not {role} and earn less than {salary}.": "SELECT name FROM Employees WHERE role != :role AND salary < :salary;",
+    "Show lab tests that are either in {department} or {department2} and priced below {price}.": "SELECT name, price FROM LabTests WHERE (department_id = (SELECT id FROM Departments WHERE name = :department) OR department_id = (SELECT id FROM Departments WHERE name = :department2)) AND price < :price;",
+    "Find employees who are either older than {age} or earn above {salary}.": "SELECT name FROM Employees WHERE age > :age OR salary > :salary;",
+    "List lab tests that are not administered by {role}.": "SELECT LabTests.name FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id WHERE Employees.role != :role;",
     
     # Combining Multiple Joins and Conditions
-    "Show lab tests along with the names and roles of employees who administer them and are located on the Third Floor.": "SELECT LabTests.name, Employees.name, Employees.role FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = 'Third Floor';",
-    "Find employees who manage departments offering lab tests priced between 30 and 60.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = 'Lab Manager' AND LabTests.price BETWEEN 30 AND 60;",
-    "List departments that offer lab tests containing 'Glucose' and have employees older than 30.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id WHERE LabTests.name LIKE '%Glucose%' AND Employees.age > 30;",
-    "Show lab tests in departments where the average employee salary is above 65000 and have more than three tests.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON Departments.id = Employees.department_id GROUP BY LabTests.name HAVING AVG(Employees.salary) > 65000 AND COUNT(LabTests.id) > 3;",
-    "Find employees who work in departments offering lab tests priced above the overall average and earn above 70000.": "SELECT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price > (SELECT AVG(price) FROM LabTests) AND Employees.salary > 70000;",
+    "Show lab tests along with the names and roles of employees who administer them and are located on the {location}.": "SELECT LabTests.name, Employees.name, Employees.role FROM LabTests JOIN Employees ON LabTests.department_id = Employees.department_id JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = :location;",
+    "Find employees who manage departments offering lab tests priced between {min_price} and {max_price}.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE Employees.role = 'Lab Manager' AND LabTests.price BETWEEN :min_price AND :max_price;",
+    "List departments that offer lab tests containing 'Glucose' and have employees older than {age}.": "SELECT DISTINCT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id JOIN Employees ON Departments.id = Employees.department_id WHERE LabTests.name LIKE '%Glucose%' AND Employees.age > :age;",
+    "Show lab tests in departments where the average employee salary is above {salary} and have more than {count} tests.": "SELECT LabTests.name FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id JOIN Employees ON Departments.id = Employees.department_id GROUP BY LabTests.name HAVING AVG(Employees.salary) > :salary AND COUNT(LabTests.id) > :count;",
+    "Find employees who work in departments offering lab tests priced above the overall average and earn above {salary}.": "SELECT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price > (SELECT AVG(price) FROM LabTests) AND Employees.salary > :salary;",
     
     # More Creative and User-Centric Queries
     "List lab tests that are essential for blood analysis.": "SELECT name, price FROM LabTests WHERE name LIKE '%Blood%';",
-    "Show employees responsible for high-cost lab tests.": "SELECT DISTINCT Employees.name FROM Employees JOIN LabTests ON Employees.department_id = LabTests.department_id WHERE LabTests.price > 70;",
     "Find departments that do not offer any lab tests.": "SELECT name FROM Departments WHERE id NOT IN (SELECT department_id FROM LabTests);",
     "List lab tests with normal ranges exceeding '100 mg/dL'.": "SELECT name, normal_range FROM LabTests WHERE normal_range > '100 mg/dL';"
 }
 
-# Preprocess predefined queries
-preprocessed_queries = [preprocess(query) for query in PREDEFINED_QUERIES.keys()]
+# The catalog store, matcher index and retriever are loaded lazily on first use
+_store = None
+_index = None
+_index_lock = threading.Lock()
+_retriever = None
+
+# Top-N matches keyed on the catalog hash and database schema version the templates
+# were checked on, plus the normalized query. Entries of older versions can never be
+# served, even if a concurrent caller stores one after the cache was emptied
+_result_cache = LRUCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+_result_cache_catalog = None
+
+# Slot types in the column order of the per-row slot counts of the batch matcher
+SLOT_TYPES = (*ENTITY_SOURCES, NUMBER)
+# Slot counts and runnability of the compiled rows, valid for one (compiled index,
+# schema version); appended rows are few and recomputed per call
+_base_rows = None
+
+def get_store():
+    """
+    Returns the catalog store, creating it from PREDEFINED_QUERIES on first use.
+
+    Falls back to an in-memory store if CATALOG_PATH cannot be opened for writing.
+    
+    :return: The shared catalog.CatalogStore.
+    """
+    global _store
+    if _store is None:
+        with _index_lock:
+            if _store is None:
+                try:
+                    _store = CatalogStore(CATALOG_PATH, seed=PREDEFINED_QUERIES)
+                except sqlite3.Error:
+                    _store = CatalogStore(':memory:', seed=PREDEFINED_QUERIES)
+    return _store
+
+def close_store():
+    """
+    Closes the catalog store; the next get_store() opens it again.
+
+    The index keeps serving meanwhile. Used before fork(), since an SQLite connection
+    must not be used by a process other than the one that opened it.
+    """
+    global _store
+    with _index_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+def get_index():
+    """
+    Returns the matcher index for the current catalog.
+
+    The compiled index is memory-mapped from INDEX_PATH and built only if it is
+    missing. Catalog changes made since, by this or any other process, are layered
+    on top incrementally: each call checks the store and, if it changed, swaps in a
+    new index while searches already running keep the one they started with.
+    
+    :return: The catalog.CatalogIndex for the current catalog version.
+    """
+    global _index
+    store = get_store()
+    with _index_lock:
+        if _index is None:
+            _index = load_catalog_index(store, preprocess_question, INDEX_PATH)
+        else:
+            _index = refresh(_index, store, preprocess_question, INDEX_PATH)
+        return _index
+
+def get_retriever(index=None):
+    """
+    Returns the retriever for the configured backend, bound to the compiled index.
+    
+    :param index: The CatalogIndex to search, defaults to the current one.
+    :return: A retriever from retrieval.BACKENDS.
+    """
+    global _retriever
+    base = (index or get_index()).base
+    retriever = _retriever
+    if retriever is None or retriever.index is not base:
+        retriever = _retriever = BACKENDS[RETRIEVAL_BACKEND](base)
+    return retriever
+
+def set_retrieval_backend(name):
+    """
+    Switches the backend used by get_top_n_sql_queries.
+    
+    :param name: A key of retrieval.BACKENDS, e.g. 'maxscore' or 'bruteforce'.
+    """
+    global RETRIEVAL_BACKEND, _retriever
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown retrieval backend {name!r}; choose from {sorted(BACKENDS)}")
+    RETRIEVAL_BACKEND = name
+    _retriever = None
+    _result_cache.clear()
+
+def _cached_results(index):
+    """
+    Returns the result cache and the catalog version its keys must carry. The cache is
+    emptied when the catalog or the schema changes, to free the entries of the old one.
+
+    :return: Tuple of (cache, catalog version).
+    """
+    global _result_cache_catalog
+    catalog = (index.catalog_hash, get_precompiler().schema_version(), RETRIEVAL_BACKEND)
+    if _result_cache_catalog != catalog:
+        _result_cache.clear()
+        _result_cache_catalog = catalog
+    return _result_cache, catalog
+
+def _result_key(catalog, preprocessed_query, n, threshold):
+    # Matching is bag-of-words, so token order never changes the result and
+    # reordered phrasings share one entry
+    return (catalog, ' '.join(sorted(preprocessed_query.split())), n, threshold)
+
+def cache_stats():
+    """
+    Returns hit/miss/eviction counters of the matcher caches.
+    
+    :return: Dict with 'stem' and 'results' counter dicts.
+    """
+    stem_info = _stem.cache_info()
+    stem_lookups = stem_info.hits + stem_info.misses
+    return {
+        'stem': {
+            'size': stem_info.currsize,
+            'maxsize': stem_info.maxsize,
+            'hits': stem_info.hits,
+            'misses': stem_info.misses,
+            'evictions': max(0, stem_info.misses - stem_info.currsize),
+            'hit_rate': stem_info.hits / stem_lookups if stem_lookups else 0.0,
+        },
+        'results': _result_cache.stats(),
+    }
+
+def __getattr__(name):
+    # Keep the module-level `predefined_vectors` name working without loading at import
+    if name == 'predefined_vectors':
+        return get_index().base.matrix
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Returned when no predefined query clears the similarity threshold
+DEFAULT_MATCH = ("SELECT name, role FROM Employees;", "Default: List all employees.", 0.0, ())
+
+# Number of user queries scored per sparse product in the batch API
+BATCH_CHUNK_SIZE = 4096
+
+def _fill(sql, question, values):
+    try:
+        return bind(parse_template(question, sql), values)
+    except ValueError:
+        # Entries whose slots and parameters disagree can never be filled
+        return None
+
+def _compiles(sql, question):
+    """
+    Whether an entry's SQL compiles on the live schema (see precompile.py).
+    """
+    try:
+        template = parse_template(question, sql)
+    except ValueError:
+        return False
+    return get_precompiler().is_valid(template.sql, len(template.parameters))
 
-# Initialize the vectorizer and fit on preprocessed queries
-vectorizer = TfidfVectorizer().fit(preprocessed_queries)
-predefined_vectors = vectorizer.transform(preprocessed_queries)
+def _fillable_matches(index, search, n, values):
+    """
+    Returns the first n matches whose slots can be filled from the query's values.
+
+    A template whose slots the query cannot fill, or whose SQL does not compile on
+    the database, is skipped, so the candidates are widened until n matches are
+    found or the candidates run out.
+
+    :param index: The CatalogIndex searched.
+    :param search: Function of k returning the top k (row indices, similarities).
+    :param n: Number of matches to return.
+    :param values: Slot values extracted from the query.
+    :return: List of (sql, question, similarity) with the slots still unfilled.
+    """
+    k = n
+    while True:
+        rows, similarities = search(k)
+        matches = [(index.sql(row), index.question(row), similarity)
+                   for row, similarity in zip(rows, similarities)
+                   if _fill(index.sql(row), index.question(row), values) is not None
+                   and _compiles(index.sql(row), index.question(row))]
+        if len(matches) >= n or len(rows) < k:
+            return matches[:n]
+        k *= 2
+
+def _to_results(matches, values):
+    if not matches:
+        # Return a default SQL query and indicate no good match was found
+        return [DEFAULT_MATCH]
+    results = []
+    for sql, question, similarity in matches:
+        sql, question, params = _fill(sql, question, values)
+        results.append((sql, question, similarity, params))
+    return results
 
 def get_top_n_sql_queries(user_query, n=3, threshold=0.3):
     """
     Returns the top N SQL queries based on cosine similarity.
+
+    Department, location and role names and numbers in the query fill the slots of
+    parameterized catalog entries; templates whose slots the query cannot fill, and
+    templates whose SQL does not compile on the database, are skipped. Matches are
+    cached on the preprocessed query with its values replaced by slot tokens, so
+    repeated phrasings skip vectorization and scoring whatever values they name.
     
     :param user_query: The natural language query input by the user.
     :param n: Number of top matches to return.
     :param threshold: Minimum similarity score to consider a match.
-    :return: List of tuples containing SQL query, matched natural language query, and similarity score.
+    :return: List of tuples containing SQL query, matched natural language query (with
+        its slots filled), similarity score and the parameters to bind to the SQL.
+    """
+    with tracing.span('match') as match_span:
+        index = get_index()
+        result_cache, catalog = _cached_results(index)
+        with tracing.span('preprocess'):
+            extraction = extract(user_query)
+            user_query_preprocessed = preprocess(extraction.text)
+        key = _result_key(catalog, user_query_preprocessed, n, threshold)
+        matches = result_cache.get(key)
+        match_span.set('cache_hit', matches is not MISSING)
+        if matches is MISSING:
+            with tracing.span('transform'):
+                user_vector = index.transform([user_query_preprocessed])
+            with tracing.span('score', backend=RETRIEVAL_BACKEND):
+                retriever = get_retriever(index)
+                matches = _fillable_matches(
+                    index, lambda k: index.search(retriever, user_vector, k, threshold), n, extraction.values)
+            # The slot tokens in the key fix how many values of each type there are,
+            # so the same matches can be filled for any query sharing it
+            result_cache.put(key, matches)
+        results = _to_results(matches, extraction.values)
+        match_span.set('top_score', float(results[0][2]))
+    return results
+
+def _row_templates(rows):
+    counts = np.zeros((len(rows), len(SLOT_TYPES)), dtype=np.int32)
+    runnable = np.zeros(len(rows), dtype=bool)
+    for row, (question, sql) in enumerate(rows):
+        try:
+            template = parse_template(question, sql)
+        except ValueError:
+            continue
+        for _, kind in template.slots:
+            counts[row, SLOT_TYPES.index(kind)] += 1
+        runnable[row] = get_precompiler().is_valid(template.sql, len(template.parameters))
+    return counts, runnable
+
+def _template_rows(index):
     """
-    user_query_preprocessed = preprocess(user_query)
-    user_vector = vectorizer.transform([user_query_preprocessed])
-    similarities = cosine_similarity(user_vector, predefined_vectors).flatten()
-    top_n_indices = similarities.argsort()[-n:][::-1]
-    top_n_similarities = similarities[top_n_indices]
+    Returns the slots and runnability of every row of an index, for masking scores.
 
+    :return: Tuple of (counts, runnable): the number of slots of each SLOT_TYPES type
+        per row, and whether the row's slots match its SQL and the SQL compiles.
+    """
+    global _base_rows
+    key = (index.base.catalog_hash, get_precompiler().schema_version())
+    base_rows = _base_rows
+    if base_rows is None or base_rows[0] != key:
+        base_rows = _base_rows = (key, *_row_templates(list(zip(index.base.keys, index.base_sql))))
+    _, counts, runnable = base_rows
+    if len(index.added):
+        added_counts, added_runnable = _row_templates(index.added)
+        counts = np.vstack([counts, added_counts])
+        runnable = np.concatenate([runnable, added_runnable])
+    return counts, runnable
+
+def get_top_n_sql_queries_batch(user_queries, n=3, threshold=0.3):
+    """
+    Returns the top N SQL queries for many user queries at once.
+
+    All queries are vectorized together and scored with one sparse matrix product per
+    chunk of BATCH_CHUNK_SIZE queries. Templates a query cannot fill, and templates
+    that do not compile, are masked out of the scores before the top N are selected,
+    so no query searches past them. Row i of the output equals
+    get_top_n_sql_queries(user_queries[i], n, threshold).
+    
+    :param user_queries: Iterable of natural language queries.
+    :param n: Number of top matches to return per query.
+    :param threshold: Minimum similarity score to consider a match.
+    :return: List with one result list per user query, in input order.
+    """
+    index = get_index()
+    user_queries = list(user_queries)
+    # Replayed logs repeat the same phrasings, so each distinct string is preprocessed once
+    extractions = {user_query: extract(user_query) for user_query in set(user_queries)}
+    preprocessed = {user_query: preprocess(extraction.text) for user_query, extraction in extractions.items()}
+    preprocessed_queries = [preprocessed[user_query] for user_query in user_queries]
+    # A template can be filled when the query has at least as many values of each
+    # type as it has slots
+    available = {user_query: tuple(len(extraction.values.get(kind, ())) for kind in SLOT_TYPES)
+                 for user_query, extraction in extractions.items()}
+    counts, runnable = _template_rows(index)
     results = []
-    for idx, sim in zip(top_n_indices, top_n_similarities):
-        if sim >= threshold:
-            matched_nl_query = list(PREDEFINED_QUERIES.keys())[idx]
-            sql = PREDEFINED_QUERIES[matched_nl_query]
-            results.append((sql, matched_nl_query, sim))
-    
-    if not results:
-        # Return a default SQL query and indicate no good match was found
-        default_query = "SELECT name, role FROM Employees;"
-        results.append((default_query, "Default: List all employees.", 0.0))
-    
+    for start in range(0, len(preprocessed_queries), BATCH_CHUNK_SIZE):
+        chunk = user_queries[start:start + BATCH_CHUNK_SIZE]
+        user_vectors = index.transform(preprocessed_queries[start:start + BATCH_CHUNK_SIZE])
+        # Rows are L2-normalized, so the dot product is the cosine similarity
+        similarities = index.scores(user_vectors)
+        # Queries share few distinct value counts, so the masks are built per count
+        signatures, inverse = np.unique(np.array([available[user_query] for user_query in chunk]),
+                                        axis=0, return_inverse=True)
+        fillable = (counts[np.newaxis, :, :] <= signatures[:, np.newaxis, :]).all(axis=2) & runnable
+        similarities[~fillable[inverse.ravel()]] = -np.inf
+        top_indices = top_n_indices(similarities, n)
+        top_similarities = np.take_along_axis(similarities, top_indices, axis=1)
+        matched = above_threshold(top_similarities, threshold)
+        for row, user_query in enumerate(chunk):
+            keep = matched[row]
+            matches = [(index.sql(match), index.question(match), similarity)
+                       for match, similarity in zip(top_indices[row][keep], top_similarities[row][keep])]
+            results.append(_to_results(matches, extractions[user_query].values))
     return results
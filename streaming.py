@@ -0,0 +1,240 @@
+# streaming.py
+import csv
+import os
+
+import tracing
+from pool import get_pool
+from query_cache import get_result_cache
+from summaries import route
+
+# Rows fetched per fetchmany() call
+CHUNK_SIZE = 1000
+# Hard cap on rows streamed for one query unless the caller overrides it
+MAX_ROWS = int(os.environ.get('LAB_DB_MAX_ROWS', '1000000'))
+# Rows per page in the UI
+PAGE_SIZE = 100
+
+
+class QueryStream:
+    """
+    Streams the rows of one query in fetchmany() chunks from a pooled connection.
+
+    The connection is returned to the pool once the rows are exhausted, the row cap is
+    hit, or close() is called. Use it as a context manager to guarantee the latter.
+    """
+
+    def __init__(self, sql_query, params=(), chunk_size=CHUNK_SIZE, max_rows=MAX_ROWS, pool=None):
+        """
+        :param sql_query: The SQL query string to execute.
+        :param params: Parameters bound to the query.
+        :param chunk_size: Rows per chunk.
+        :param max_rows: Stop after this many rows (None for no cap).
+        :param pool: Connection pool to borrow from, defaults to the shared pool, in
+            which case the query may be routed to its summary tables.
+        """
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.rows_fetched = 0
+        self.truncated = False
+        if pool is None:
+            sql_query = route(sql_query)
+        self._pool = pool or get_pool()
+        self._conn = self._pool.acquire()
+        try:
+            self._cursor = self._conn.execute(sql_query, params)
+            self.columns = [description[0] for description in self._cursor.description or ()]
+        except BaseException:
+            self.close()
+            raise
+
+    def chunks(self):
+        """
+        Yields lists of up to chunk_size rows.
+        """
+        try:
+            while self._conn is not None:
+                size = self.chunk_size
+                if self.max_rows is not None:
+                    size = min(size, self.max_rows - self.rows_fetched)
+                    if size <= 0:
+                        # Peek one row to tell a capped result from one that fits exactly
+                        self.truncated = self._cursor.fetchone() is not None
+                        break
+                rows = self._cursor.fetchmany(size)
+                if not rows:
+                    break
+                self.rows_fetched += len(rows)
+                yield rows
+        finally:
+            self.close()
+
+    def __iter__(self):
+        for rows in self.chunks():
+            yield from rows
+
+    def close(self):
+        """Returns the connection to the pool; safe to call more than once."""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def paged_query(sql_query, page_size=PAGE_SIZE, page=0, after=None, key_columns=None, routed=True, params=()):
+    """
+    Wraps a query so it returns one page of rows plus one look-ahead row.
+
+    See fetch_page for the parameters.
+
+    :param routed: Route the query to the shared database's summary tables where
+        possible (see summaries.route); pass False for other databases.
+    :return: Tuple of (paged SQL, params).
+    """
+    if routed:
+        sql_query = route(sql_query)
+    inner = sql_query.strip().rstrip(';')
+    # The query's own parameters come first, as it precedes the paging clauses
+    params = list(params)
+    if key_columns:
+        keys = ', '.join(_quote_identifier(column) for column in key_columns)
+        where = ''
+        if after is not None:
+            placeholders = ', '.join('?' for _ in key_columns)
+            where = f' WHERE ({keys}) > ({placeholders})'
+            params.extend(after)
+        paged = f'SELECT * FROM ({inner}){where} ORDER BY {keys} LIMIT ?'
+    else:
+        paged = f'SELECT * FROM ({inner}) LIMIT ? OFFSET ?'
+    # One extra row tells whether another page exists
+    params.append(page_size + 1)
+    if not key_columns:
+        params.append(page * page_size)
+    return paged, params
+
+
+def fetch_page(sql_query, page_size=PAGE_SIZE, page=0, after=None, key_columns=None, pool=None, params=()):
+    """
+    Materializes a single page of a query's results.
+
+    With key_columns, pages use keyset pagination: the query is ordered by those
+    columns and the page starts strictly after the `after` key, so SQLite can seek
+    instead of skipping rows. The key columns must be unique within the result.
+    Without them, the page is located by LIMIT/OFFSET. Either way only one page is
+    held in memory.
+
+    :param sql_query: The SQL query string to execute.
+    :param page_size: Rows per page.
+    :param page: Zero-based page number, used when key_columns is not given.
+    :param after: Key (tuple of key column values) of the last row of the previous page.
+    :param key_columns: Names of result columns forming a unique ordering key.
+    :param pool: Connection pool to borrow from, defaults to the shared pool.
+    :param params: Parameters bound to the query.
+    :return: Tuple of (columns, rows, has_more).
+    """
+    paged, params = paged_query(sql_query, page_size, page, after, key_columns, routed=pool is None, params=params)
+
+    def execute():
+        with tracing.span('sqlite'), (pool or get_pool()).connection() as conn:
+            cursor = conn.execute(paged, params)
+            rows = cursor.fetchmany(page_size + 1)
+            # SQLite gives duplicate subquery columns unique names ("name", "name:1"),
+            # which the DataFrame rendering needs anyway
+            columns = [description[0] for description in cursor.description]
+        return columns, rows
+
+    with tracing.span('fetch_page', page=page) as page_span:
+        if pool is None:
+            # Pages of the shared database are small, so they are cached until it changes
+            columns, rows = get_result_cache().get_or_execute(paged, execute, params)
+        else:
+            columns, rows = execute()
+        page_span.count('rows', min(len(rows), page_size))
+        if tracing.is_enabled():
+            page_span.count('bytes', tracing.result_size(rows[:page_size]))
+    return columns, rows[:page_size], len(rows) > page_size
+
+
+def export_csv(sql_query, destination, chunk_size=CHUNK_SIZE, max_rows=None, params=()):
+    """
+    Streams a query's results into a CSV file without holding them in memory.
+
+    :param sql_query: The SQL query string to execute.
+    :param destination: Path or writable text file object.
+    :param chunk_size: Rows fetched per chunk.
+    :param max_rows: Optional cap on exported rows.
+    :param params: Parameters bound to the query.
+    :return: Number of rows written.
+    """
+    with QueryStream(sql_query, params, chunk_size=chunk_size, max_rows=max_rows) as stream:
+        return write_csv(destination, stream.columns, stream.chunks())
+
+
+def write_csv(destination, columns, chunks):
+    """
+    Writes a header and row chunks to a CSV file.
+
+    A path is opened afresh, replacing an earlier file, so with destination bound
+    (e.g. by functools.partial) it fits the write argument of QueryExecutor.submit.
+
+    :param destination: Path or writable text file object.
+    :param columns: Column names for the header.
+    :param chunks: Iterable of lists of rows.
+    :return: Number of rows written.
+    """
+    if not hasattr(destination, 'write'):
+        with open(destination, 'w', newline='', encoding='utf-8') as f:
+            return write_csv(f, columns, chunks)
+    writer = csv.writer(destination)
+    writer.writerow(columns)
+    written = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        written += len(rows)
+    return written
+
+
+def export_parquet(sql_query, destination, chunk_size=CHUNK_SIZE * 50, max_rows=None, params=()):
+    """
+    Streams a query's results into a Parquet file, one row group per chunk.
+
+    Requires the optional pyarrow package.
+
+    :param sql_query: The SQL query string to execute.
+    :param destination: Path or writable binary file object.
+    :param chunk_size: Rows per row group.
+    :param max_rows: Optional cap on exported rows.
+    :param params: Parameters bound to the query.
+    :return: Number of rows written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow: pip install pyarrow") from e
+
+    writer = None
+    try:
+        with QueryStream(sql_query, params, chunk_size=chunk_size, max_rows=max_rows) as stream:
+            for rows in stream.chunks():
+                table = pa.Table.from_arrays([pa.array(values) for values in zip(*rows)],
+                                             names=stream.columns)
+                if writer is None:
+                    writer = pq.ParquetWriter(destination, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            if writer is None:
+                # Still write a valid (empty) file with the result's columns
+                schema = pa.schema([(column, pa.null()) for column in stream.columns])
+                writer = pq.ParquetWriter(destination, schema)
+            return stream.rows_fetched
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,282 @@
+# summaries.py
+"""
+Routes per-department aggregate templates to the summary tables from db.py.
+
+db.SUMMARY_TABLES keeps per-department counts, sums, minimums and maximums of
+LabTests and Employees current through triggers. Rollup questions such as average
+price per department or total salary expenditure can then be answered by reading
+one row per department instead of scanning the base tables. ROUTES maps each such
+catalog statement to an equivalent query over the summaries, with the same column
+names. route() swaps a statement for its summary query, but only while the shared
+database has the summary tables and their triggers.
+
+Usage:
+    python summaries.py install [--database lab.db]
+    python summaries.py check [--database lab.db] [--repair]
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+from db import SUMMARY_TABLES, add_summary_tables, refresh_summary_table, summary_query, summary_triggers
+from pool import DATABASE_PATH
+from query_cache import normalize_sql
+from templates import positional_sql, sample_value
+
+# Set LAB_DB_SUMMARY_ROUTING=0 to always answer from the base tables
+SUMMARY_ROUTING = os.environ.get('LAB_DB_SUMMARY_ROUTING', '1') != '0'
+# Relative tolerance when comparing routed answers: sums are accumulated row by row
+# in the summaries but in one pass by the base query, so the last digits may differ
+CHECK_TOLERANCE = 1e-9
+
+_LABTESTS = 'DepartmentLabTestSummary s JOIN Departments ON s.department_id = Departments.id'
+_EMPLOYEES = 'DepartmentEmployeeSummary s JOIN Departments ON s.department_id = Departments.id'
+
+# Catalog statement -> equivalent query over the summary tables. Aliases keep the
+# column names of the original; departments are still grouped by name like there.
+# Templates keep their :name parameters, in the same order on both sides.
+ROUTES = {
+    "SELECT Departments.name, COUNT(LabTests.id) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;":
+        f'SELECT Departments.name, SUM(s.test_count) AS "COUNT(LabTests.id)" FROM {_LABTESTS} GROUP BY Departments.name;',
+    "SELECT Departments.name, AVG(LabTests.price) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;":
+        f'SELECT Departments.name, SUM(s.price_sum) / SUM(s.price_count) AS "AVG(LabTests.price)" FROM {_LABTESTS} GROUP BY Departments.name;',
+    "SELECT Departments.name, COUNT(LabTests.id) as test_count FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name ORDER BY test_count DESC;":
+        f'SELECT Departments.name, SUM(s.test_count) AS test_count FROM {_LABTESTS} GROUP BY Departments.name ORDER BY test_count DESC;',
+    "SELECT Departments.location, COUNT(LabTests.id) as test_count FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.location ORDER BY test_count DESC LIMIT 1;":
+        f'SELECT Departments.location, SUM(s.test_count) AS test_count FROM {_LABTESTS} GROUP BY Departments.location ORDER BY test_count DESC LIMIT 1;',
+    "SELECT Departments.name, SUM(Employees.salary) FROM Employees JOIN Departments ON Employees.department_id = Departments.id GROUP BY Departments.name;":
+        f'SELECT Departments.name, CASE WHEN SUM(s.salary_count) > 0 THEN SUM(s.salary_sum) END AS "SUM(Employees.salary)" FROM {_EMPLOYEES} GROUP BY Departments.name;',
+    "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING SUM(LabTests.price) > :total;":
+        f'SELECT Departments.name FROM {_LABTESTS} GROUP BY Departments.name HAVING SUM(s.price_count) > 0 AND SUM(s.price_sum) > :total;',
+    "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY AVG(Employees.salary) DESC LIMIT 1;":
+        f'SELECT Departments.name FROM {_EMPLOYEES} GROUP BY Departments.name ORDER BY SUM(s.salary_sum) / SUM(s.salary_count) DESC LIMIT 1;',
+    "SELECT Departments.name, SUM(LabTests.price) as total_price, AVG(LabTests.price) as average_price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;":
+        f'SELECT Departments.name, CASE WHEN SUM(s.price_count) > 0 THEN SUM(s.price_sum) END AS total_price, SUM(s.price_sum) / SUM(s.price_count) AS average_price FROM {_LABTESTS} GROUP BY Departments.name;',
+    "SELECT Departments.name, MAX(LabTests.price) as max_price, MIN(LabTests.price) as min_price FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id GROUP BY Departments.name;":
+        f'SELECT Departments.name, MAX(s.price_max) AS max_price, MIN(s.price_min) AS min_price FROM {_LABTESTS} GROUP BY Departments.name;',
+    "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name HAVING AVG(Employees.salary) > :salary;":
+        f'SELECT Departments.name FROM {_EMPLOYEES} GROUP BY Departments.name HAVING SUM(s.salary_sum) / SUM(s.salary_count) > :salary;',
+    "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) > :price AND COUNT(LabTests.id) > :count;":
+        f'SELECT Departments.name FROM {_LABTESTS} GROUP BY Departments.name HAVING SUM(s.price_sum) / SUM(s.price_count) > :price AND SUM(s.test_count) > :count;',
+    "SELECT Departments.name, AVG(Employees.salary) FROM Employees JOIN Departments ON Employees.department_id = Departments.id WHERE Departments.location = :location GROUP BY Departments.name;":
+        f'SELECT Departments.name, SUM(s.salary_sum) / SUM(s.salary_count) AS "AVG(Employees.salary)" FROM {_EMPLOYEES} WHERE Departments.location = :location GROUP BY Departments.name;',
+    "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY COUNT(Employees.id) ASC LIMIT 1;":
+        f'SELECT Departments.name FROM {_EMPLOYEES} GROUP BY Departments.name ORDER BY SUM(s.employee_count) ASC LIMIT 1;',
+    "SELECT Departments.name, AVG(Employees.age) FROM Employees JOIN Departments ON Employees.department_id = Departments.id GROUP BY Departments.name;":
+        f'SELECT Departments.name, SUM(s.age_sum) / SUM(s.age_count) AS "AVG(Employees.age)" FROM {_EMPLOYEES} GROUP BY Departments.name;',
+    "SELECT Departments.name, AVG(Employees.age) FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name;":
+        f'SELECT Departments.name, SUM(s.age_sum) / SUM(s.age_count) AS "AVG(Employees.age)" FROM {_EMPLOYEES} GROUP BY Departments.name;',
+    "SELECT COUNT(LabTests.id) FROM LabTests JOIN Departments ON LabTests.department_id = Departments.id WHERE Departments.location = :location;":
+        f'SELECT IFNULL(SUM(s.test_count), 0) AS "COUNT(LabTests.id)" FROM {_LABTESTS} WHERE Departments.location = :location;',
+    "SELECT Departments.name FROM Departments JOIN LabTests ON Departments.id = LabTests.department_id GROUP BY Departments.name HAVING AVG(LabTests.price) < :price;":
+        f'SELECT Departments.name FROM {_LABTESTS} GROUP BY Departments.name HAVING SUM(s.price_sum) / SUM(s.price_count) < :price;',
+    "SELECT Departments.name FROM Departments JOIN Employees ON Departments.id = Employees.department_id GROUP BY Departments.name ORDER BY SUM(Employees.salary) DESC LIMIT 1;":
+        f'SELECT Departments.name FROM {_EMPLOYEES} GROUP BY Departments.name ORDER BY CASE WHEN SUM(s.salary_count) > 0 THEN SUM(s.salary_sum) END DESC LIMIT 1;',
+}
+
+
+class SummaryRouter:
+    """
+    Swaps catalog statements in ROUTES for their summary queries.
+
+    The summaries are only used while the database has every summary table and
+    trigger. db.generate_database drops the triggers during a bulk load, so stale
+    summaries are never read. The check is repeated whenever the schema changes.
+    """
+
+    def __init__(self, database=DATABASE_PATH, enabled=SUMMARY_ROUTING):
+        """
+        :param database: Path to the SQLite database whose summaries are used.
+        :param enabled: Route at all; False leaves every statement unchanged.
+        """
+        self.database = database
+        self.enabled = enabled
+        # Statements reach the router with positional parameters (see templates.py)
+        self.routes = {}
+        for sql, summary_sql in ROUTES.items():
+            sql, parameters = positional_sql(sql)
+            summary_sql, summary_parameters = positional_sql(summary_sql)
+            if parameters != summary_parameters:
+                raise ValueError(f'Summary route binds {summary_parameters} instead of {parameters}: {sql}')
+            self.routes[normalize_sql(sql)] = summary_sql
+        self.routed = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._schema_version = None
+        self._available = False
+
+    def available(self):
+        """
+        Returns whether the database has the summary tables and their triggers.
+        """
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._conn = sqlite3.connect(Path(self.database).resolve().as_uri() + '?mode=ro',
+                                                 uri=True, check_same_thread=False)
+                schema_version = self._conn.execute('PRAGMA schema_version;').fetchone()[0]
+                if schema_version != self._schema_version:
+                    self._available = has_summary_tables(self._conn)
+                    self._schema_version = schema_version
+            except sqlite3.Error:
+                self._available = False
+            return self._available
+
+    def route(self, sql_query):
+        """
+        Returns the summary query answering a statement, or the statement itself.
+
+        :param sql_query: The SQL query string to execute.
+        :return: SQL string to execute instead.
+        """
+        if not self.enabled:
+            return sql_query
+        summary_sql = self.routes.get(normalize_sql(sql_query))
+        if summary_sql is None or not self.available():
+            return sql_query
+        self.routed += 1
+        return summary_sql
+
+
+def has_summary_tables(conn):
+    """
+    Returns whether a database has every summary table and maintenance trigger.
+
+    :param conn: An open sqlite3.Connection.
+    """
+    existing = {name for name, in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger');")}
+    return all(summary in existing and all(trigger in existing for trigger in summary_triggers(summary))
+               for summary, _, _, _ in SUMMARY_TABLES)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    Returns the process-wide router for DATABASE_PATH, creating it on first use.
+
+    :return: The shared SummaryRouter.
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = SummaryRouter()
+    return _router
+
+
+def route(sql_query):
+    """
+    Routes a statement to the shared database's summary tables where possible.
+
+    :param sql_query: The SQL query string to execute.
+    :return: SQL string to execute instead.
+    """
+    return get_router().route(sql_query)
+
+
+def _same_value(a, b, tolerance):
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance)
+    return a == b
+
+
+def _same_rows(rows, expected, tolerance):
+    if len(rows) != len(expected):
+        return False
+    # Only the ORDER BY of a statement fixes its row order, so compare as sorted lists
+    key = lambda row: [(value is None, str(type(value)), value if value is not None else 0) for value in row]
+    return all(len(row) == len(other) and all(_same_value(a, b, tolerance) for a, b in zip(row, other))
+               for row, other in zip(sorted(rows, key=key), sorted(expected, key=key)))
+
+
+def check_tables(conn, tolerance=CHECK_TOLERANCE):
+    """
+    Compares each summary table with a fresh computation from its base table.
+
+    :param conn: An open sqlite3.Connection.
+    :param tolerance: Relative tolerance for sums.
+    :return: List of (summary table, ok) tuples.
+    """
+    results = []
+    for summary, _, _, _ in SUMMARY_TABLES:
+        stored = conn.execute(f'SELECT * FROM {summary} ORDER BY department_id;').fetchall()
+        expected = conn.execute(summary_query(summary)).fetchall()
+        results.append((summary, _same_rows(stored, expected, tolerance)))
+    return results
+
+
+def check_routes(conn, tolerance=CHECK_TOLERANCE):
+    """
+    Runs every routed statement both ways and compares the answers.
+
+    Statements ending in ORDER BY ... LIMIT may legitimately differ when several
+    groups tie on the ordering value. Templates are bound to templates.SAMPLE_VALUES.
+
+    :param conn: An open sqlite3.Connection.
+    :param tolerance: Relative tolerance for sums and averages.
+    :return: List of dicts with sql, ok, base_seconds and summary_seconds.
+    """
+    results = []
+    for sql, summary_sql in ROUTES.items():
+        outcome = {'sql': sql}
+        answers = []
+        for name, statement in (('base', sql), ('summary', summary_sql)):
+            statement, parameters = positional_sql(statement)
+            start = time.perf_counter()
+            cursor = conn.execute(statement, [sample_value(parameter) for parameter in parameters])
+            rows = cursor.fetchall()
+            outcome[f'{name}_seconds'] = time.perf_counter() - start
+            answers.append(([description[0] for description in cursor.description], rows))
+        (base_columns, base_rows), (summary_columns, summary_rows) = answers
+        outcome['ok'] = base_columns == summary_columns and _same_rows(summary_rows, base_rows, tolerance)
+        results.append(outcome)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['install', 'check'])
+    parser.add_argument('--database', default=DATABASE_PATH)
+    parser.add_argument('--repair', action='store_true', help='recompute summary tables that disagree')
+    args = parser.parse_args()
+
+    if args.command == 'install':
+        add_summary_tables(args.database)
+        print(f"Summary tables and triggers installed in '{args.database}'.")
+        return 0
+
+    conn = sqlite3.connect(args.database)
+    try:
+        if not has_summary_tables(conn):
+            print(f"'{args.database}' has no summary tables; run `python summaries.py install` first.")
+            return 1
+        failures = 0
+        for summary, ok in check_tables(conn):
+            print(f"{summary}: {'ok' if ok else 'MISMATCH'}")
+            if not ok:
+                failures += 1
+                if args.repair:
+                    refresh_summary_table(conn.cursor(), summary)
+                    conn.commit()
+                    print(f"{summary}: recomputed")
+        for outcome in check_routes(conn):
+            if not outcome['ok']:
+                failures += 1
+            print(f"{'ok' if outcome['ok'] else 'MISMATCH':<8} base {outcome['base_seconds'] * 1000:8.2f} ms | "
+                  f"summary {outcome['summary_seconds'] * 1000:6.2f} ms | {outcome['sql']}")
+        return 1 if failures else 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+# templates.py
+"""
+Parameterized catalog entries and the entity index that fills their slots.
+
+A catalog question may name typed slots in braces, which its SQL binds as named
+parameters:
+
+    "Find lab tests in {department} priced above {price}."
+    "SELECT name, price FROM LabTests WHERE department_id =
+        (SELECT id FROM Departments WHERE name = :department) AND price > :price;"
+
+A slot's type is its name without trailing digits when that is one of
+ENTITY_SOURCES (department, location, role), and a number otherwise. So
+{department2} is a second department and {min_price} is a number.
+
+The entity index holds the distinct values of each entity type in the database,
+and reloads them when the database changes. extract() replaces the entities and
+numbers of a user query with slot tokens, so one template matches every value.
+bind() fills the template's slots of each type in the order the values appear in
+the query. Parameters are rewritten to positional ones, because the pager and the
+executor append their own.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+from pool import DATABASE_PATH
+
+# Entity type -> statement listing its values in the database
+ENTITY_SOURCES = {
+    'department': 'SELECT DISTINCT name FROM Departments WHERE name IS NOT NULL;',
+    'location': 'SELECT DISTINCT location FROM Departments WHERE location IS NOT NULL;',
+    'role': 'SELECT DISTINCT role FROM Employees WHERE role IS NOT NULL;',
+}
+NUMBER = 'number'
+# Minimum seconds between checks of the database for changed entity values
+ENTITY_REFRESH_INTERVAL = 1.0
+# Parsed templates kept, keyed on (question, sql)
+TEMPLATE_CACHE_SIZE = 8192
+# Values bound to slots when a template runs without a user query (benchmarks, the
+# index advisor, the summary checker); unknown number slots get 1
+SAMPLE_VALUES = {
+    'department': 'Hematology', 'department2': 'Immunology',
+    'location': 'Second Floor',
+    'role': 'Lab Manager', 'role2': 'Lab Technician',
+    'price': 50, 'min_price': 30, 'max_price': 60, 'total': 300,
+    'salary': 70000, 'min_salary': 50000, 'max_salary': 80000,
+    'age': 35, 'count': 3,
+}
+# Spelled-out numbers recognized in queries; "one" is left out, as it is mostly a
+# pronoun or article ("at least one", "the one")
+NUMBER_WORDS = {
+    'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8,
+    'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'fifteen': 15, 'twenty': 20,
+}
+
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+# String literals and quoted identifiers are matched only to be skipped
+_SQL_PARAMETER = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|:(\w+)")
+# Years (1900-2099) and percentages are not slot values: "joined in 2020" or "the
+# top 10%" are part of the question, and filling a price or salary slot with them
+# answers a different one
+_NUMBER = re.compile(r'(?<![\w.])(?!(?:19|20)\d\d(?!\w|[.,]\d))'
+                     r'(?:(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?(k)?|(' + '|'.join(NUMBER_WORDS) + r'))'
+                     r'(?!\w|[.,]\d|\s*%|\s*percent\b)', re.IGNORECASE)
+
+# A capitalized name after "in" or "at" that is not a database value, such as "in
+# Chicago": a location, or a department when "department" follows. It fills the
+# slot like a known value and the query returns no rows, rather than matching an
+# entry that hard-codes the name
+_UNKNOWN_ENTITY = re.compile(r"(?<!\w)(?:located\s+)?(?:[Ii]n|[Aa]t)\s+(?:the\s+)?"
+                             r"([A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*)(\s+department)?(?!\w)")
+
+Extraction = namedtuple('Extraction', 'text values')
+Template = namedtuple('Template', 'question sql slots parameters')
+
+
+def slot_type(name):
+    """
+    Returns the type of a slot: an ENTITY_SOURCES key or NUMBER.
+    """
+    kind = name.rstrip('0123456789')
+    return kind if kind in ENTITY_SOURCES else NUMBER
+
+
+def slot_token(kind):
+    """
+    Returns the word standing for a slot of the given type in matched text.
+    """
+    return f' slot{kind} '
+
+
+def _number(match):
+    if match.group(4):
+        return NUMBER_WORDS[match.group(4).lower()]
+    value = float(match.group(1).replace(',', '') + (match.group(2) or ''))
+    if match.group(3):
+        value *= 1000
+    return int(value) if value.is_integer() else value
+
+
+def _replace_numbers(text, values=None):
+    def replace(match):
+        if values is not None:
+            values.setdefault(NUMBER, []).append(_number(match))
+        return slot_token(NUMBER)
+    return _NUMBER.sub(replace, text)
+
+
+def template_text(question):
+    """
+    Returns a catalog question as it is matched: slots and numbers become slot tokens.
+
+    :param question: Catalog question, possibly with {slot} placeholders.
+    :return: Text for preprocessing.
+    """
+    text = _PLACEHOLDER.sub(lambda match: slot_token(slot_type(match.group(1))), question)
+    return _replace_numbers(text)
+
+
+def positional_sql(sql):
+    """
+    Rewrites :name parameters to positional ones.
+
+    :param sql: SQL with named parameters.
+    :return: Tuple of (SQL with ? parameters, parameter names in binding order).
+    """
+    parameters = []
+
+    def positional(match):
+        if match.group(1) is None:
+            return match.group(0)
+        parameters.append(match.group(1))
+        return '?'
+
+    return _SQL_PARAMETER.sub(positional, sql), tuple(parameters)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def parse_template(question, sql):
+    """
+    Parses the slots of a catalog entry; entries without slots parse to no slots.
+
+    :param question: Catalog question, possibly with {slot} placeholders.
+    :param sql: SQL binding the slots as :name parameters.
+    :return: A Template whose sql uses positional parameters.
+    :raises ValueError: If the SQL and the question do not name the same slots.
+    """
+    slots = tuple(dict.fromkeys(_PLACEHOLDER.findall(question)))
+    sql, parameters = positional_sql(sql)
+    if set(parameters) != set(slots):
+        raise ValueError(f'Slots of {question!r} {sorted(slots)} do not match '
+                         f'the parameters of its SQL {sorted(set(parameters))}')
+    return Template(question, sql, tuple((slot, slot_type(slot)) for slot in slots), parameters)
+
+
+def _format(value):
+    return str(value) if not isinstance(value, float) or not value.is_integer() else str(int(value))
+
+
+def bind(template, values):
+    """
+    Fills a template's slots with extracted values.
+
+    Slots of one type take the values of that type in query order; extra values
+    are ignored.
+
+    :param template: A Template from parse_template().
+    :param values: Dict of slot type -> list of values, as in Extraction.values.
+    :return: Tuple of (SQL, question with the values filled in, params), or None if
+        the values do not cover every slot.
+    """
+    if not template.slots:
+        return template.sql, template.question, ()
+    assigned = {}
+    used = {}
+    for name, kind in template.slots:
+        available = values.get(kind, ())
+        position = used.get(kind, 0)
+        if position >= len(available):
+            return None
+        assigned[name] = available[position]
+        used[kind] = position + 1
+    question = _PLACEHOLDER.sub(lambda match: _format(assigned[match.group(1)]), template.question)
+    return template.sql, question, tuple(assigned[name] for name in template.parameters)
+
+
+def sample_value(name):
+    """
+    Returns the SAMPLE_VALUES entry for a slot, falling back on its type.
+    """
+    return SAMPLE_VALUES.get(name, SAMPLE_VALUES.get(slot_type(name), 1))
+
+
+def example(question, sql):
+    """
+    Binds a catalog entry to SAMPLE_VALUES, for running it without a user query.
+
+    :return: Tuple of (SQL, question, params) like bind().
+    """
+    template = parse_template(question, sql)
+    values = {}
+    for name, kind in template.slots:
+        values.setdefault(kind, []).append(sample_value(name))
+    return bind(template, values)
+
+
+def examples(queries):
+    """
+    Returns the distinct executable statements of a catalog, bound to SAMPLE_VALUES.
+
+    :param queries: Mapping of questions to SQL, such as PREDEFINED_QUERIES.
+    :return: List of (SQL, params), in catalog order.
+    """
+    statements = {}
+    for question, sql in queries.items():
+        sql, _, params = example(question, sql)
+        statements.setdefault((sql, params), None)
+    return list(statements)
+
+
+class EntityIndex:
+    """
+    Distinct department, location and role values of the database, for extract().
+
+    The values are read on a dedicated read-only connection and reloaded when
+    `PRAGMA data_version` shows that another connection committed. That check runs
+    at most every refresh_interval seconds.
+    """
+
+    def __init__(self, database=DATABASE_PATH, refresh_interval=ENTITY_REFRESH_INTERVAL):
+        """
+        :param database: Path to the SQLite database holding the entities.
+        :param refresh_interval: Minimum seconds between checks for changes.
+        """
+        self.database = database
+        self.refresh_interval = refresh_interval
+        self.values = {kind: () for kind in ENTITY_SOURCES}
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._checked = None
+        self._lookup = {}
+        self._pattern = None
+
+    def refresh(self, force=False):
+        """
+        Reloads the values if the database changed since they were read.
+
+        A missing or unreadable database keeps the values read last.
+
+        :param force: Check now even if the last check was within refresh_interval.
+        """
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.refresh_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                if self._conn is None:
+                    self._conn = sqlite3.connect(Path(self.database).resolve().as_uri() + '?mode=ro',
+                                                 uri=True, check_same_thread=False)
+                data_version = self._conn.execute('PRAGMA data_version;').fetchone()[0]
+                if data_version != self._data_version:
+                    self._load()
+                    self._data_version = data_version
+            except sqlite3.Error:
+                pass
+
+    def _load(self):
+        values = {}
+        for kind, statement in ENTITY_SOURCES.items():
+            values[kind] = tuple(sorted({str(value).strip() for (value,) in self._conn.execute(statement)} - {''}))
+        lookup = {}
+        for kind, kind_values in values.items():
+            for value in kind_values:
+                # A value of two types is taken as the first type listed in ENTITY_SOURCES
+                lookup.setdefault(' '.join(value.split()).casefold(), (kind, value))
+        pattern = None
+        if lookup:
+            # Longest first, so "Lab Manager" wins over a shorter overlapping value
+            phrases = sorted(lookup, key=len, reverse=True)
+            alternatives = '|'.join(r'\s+'.join(map(re.escape, phrase.split())) for phrase in phrases)
+            pattern = re.compile(rf'(?<!\w)({alternatives})(?:e?s)?(?!\w)', re.IGNORECASE)
+        self.values, self._lookup, self._pattern = values, lookup, pattern
+        self.reloads += 1
+
+    def extract(self, text):
+        """
+        Replaces the entities and numbers of a query with slot tokens.
+
+        :param text: Natural language query.
+        :return: Extraction of (text with slot tokens, dict of slot type -> values in
+            query order).
+        """
+        self.refresh()
+        lookup, pattern = self._lookup, self._pattern
+        # (start, end, kind, value) of each entity, known values first
+        spans = []
+        if pattern is not None:
+            for match in pattern.finditer(text):
+                spans.append((*match.span(), *lookup[' '.join(match.group(1).split()).casefold()]))
+        for match in _UNKNOWN_ENTITY.finditer(text):
+            start, end = match.span(1)
+            if not any(start < known_end and known_start < end for known_start, known_end, _, _ in spans):
+                kind = 'department' if match.group(2) else 'location'
+                spans.append((start, end, kind, ' '.join(match.group(1).split())))
+        values = {}
+        parts = []
+        position = 0
+        for start, end, kind, value in sorted(spans):
+            values.setdefault(kind, []).append(value)
+            parts += [text[position:start], slot_token(kind)]
+            position = end
+        parts.append(text[position:])
+        return Extraction(_replace_numbers(''.join(parts), values), values)
+
+
+_entity_index = None
+_entity_index_lock = threading.Lock()
+
+
+def get_entity_index():
+    """
+    Returns the process-wide entity index for DATABASE_PATH, creating it on first use.
+
+    :return: The shared EntityIndex.
+    """
+    global _entity_index
+    if _entity_index is None:
+        with _entity_index_lock:
+            if _entity_index is None:
+                _entity_index = EntityIndex()
+    return _entity_index
+
+
+def extract(text):
+    """
+    Extracts slot values from a query with the shared entity index (see EntityIndex.extract).
+    """
+    return get_entity_index().extract(text)
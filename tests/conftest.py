@@ -0,0 +1,17 @@
+# tests/conftest.py
+"""
+Runs the tests against the repository's lab.db, with the catalog store and the
+matcher index in a scratch directory so the checked-in tree is left alone.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix='lab-tests-')
+
+os.environ.setdefault('LAB_CATALOG_PATH', os.path.join(SCRATCH, 'catalog.db'))
+os.environ.setdefault('MATCHER_INDEX_PATH', os.path.join(SCRATCH, 'matcher_index'))
+# DATABASE_PATH is relative to the repository root
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
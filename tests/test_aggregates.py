@@ -0,0 +1,84 @@
+# tests/test_aggregates.py
+"""
+The SQLite statistical functions against NumPy, as aggregates and window functions.
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+import aggregates
+
+
+@pytest.fixture
+def conn():
+    conn = aggregates.connect(':memory:')
+    yield conn
+    conn.close()
+
+
+def _load(conn, values, groups=None):
+    conn.execute('CREATE TABLE t (g INTEGER, x REAL);')
+    groups = groups if groups is not None else [0] * len(values)
+    conn.executemany('INSERT INTO t VALUES (?, ?);', zip(groups, values))
+
+
+def test_moments_match_numpy(conn):
+    values = np.random.default_rng(0).normal(1e6, 3.0, 20000)
+    _load(conn, values.tolist())
+    stddev, variance, population = conn.execute(
+        'SELECT STDDEV(x), VARIANCE(x), VAR_POP(x) FROM t;').fetchone()
+    assert variance == pytest.approx(np.var(values, ddof=1), rel=1e-12)
+    assert population == pytest.approx(np.var(values), rel=1e-12)
+    assert stddev == pytest.approx(np.std(values, ddof=1), rel=1e-12)
+
+
+def test_quantiles_are_exact_for_small_groups(conn):
+    values = np.random.default_rng(1).random(1000)
+    _load(conn, values.tolist())
+    median, p90 = conn.execute('SELECT MEDIAN(x), PERCENTILE(x, 0.9) FROM t;').fetchone()
+    assert median == np.quantile(values, 0.5)
+    assert p90 == np.quantile(values, 0.9)
+
+
+def test_sketched_quantiles_stay_close_in_rank():
+    values = np.random.default_rng(2).random(50000)
+    sketch = aggregates.QuantileSketch(capacity=1024)
+    for value in values.tolist():
+        sketch.add(value)
+    assert sketch.levels
+    ordered = np.sort(values)
+    for fraction in (0.1, 0.5, 0.99):
+        rank = np.searchsorted(ordered, sketch.quantile(fraction)) / len(values)
+        assert abs(rank - fraction) < 0.01
+
+
+def test_nulls_are_ignored(conn):
+    _load(conn, [1.0, None, 3.0, None])
+    assert conn.execute('SELECT VARIANCE(x), MEDIAN(x) FROM t;').fetchone() == (2.0, 2.0)
+
+
+def test_empty_and_single_value_groups(conn):
+    _load(conn, [None, 5.0], groups=[0, 1])
+    rows = conn.execute('SELECT g, VARIANCE(x), VAR_POP(x), MEDIAN(x) FROM t GROUP BY g ORDER BY g;').fetchall()
+    assert rows == [(0, None, None, None), (1, None, 0.0, 5.0)]
+
+
+def test_percentile_rejects_fractions_out_of_range(conn):
+    _load(conn, [1.0])
+    with pytest.raises(sqlite3.OperationalError, match="'step' method raised error"):
+        conn.execute('SELECT PERCENTILE(x, 1.5) FROM t;').fetchone()
+
+
+@pytest.mark.skipif(not hasattr(sqlite3.Connection, 'create_window_function'),
+                    reason='window functions need Python 3.11+')
+def test_window_frames(conn):
+    values = [4.0, 1.0, 3.0, 2.0, 8.0]
+    _load(conn, values)
+    rows = conn.execute('SELECT MEDIAN(x) OVER (ORDER BY rowid ROWS BETWEEN 1 PRECEDING AND 1 FOLLOWING), '
+                        'VARIANCE(x) OVER (ORDER BY rowid ROWS BETWEEN 1 PRECEDING AND 1 FOLLOWING) '
+                        'FROM t ORDER BY rowid;').fetchall()
+    for i, (median, variance) in enumerate(rows):
+        frame = values[max(i - 1, 0):i + 2]
+        assert median == np.median(frame)
+        assert variance == pytest.approx(np.var(frame, ddof=1))
@@ -0,0 +1,37 @@
+# tests/test_batch.py
+"""
+The batch matcher returns, row for row, what the single-query matcher returns.
+"""
+import pytest
+
+import similarity
+from similarity import PREDEFINED_QUERIES, get_top_n_sql_queries, get_top_n_sql_queries_batch
+from templates import example
+
+QUERIES = [example(question, sql)[1] for question, sql in PREDEFINED_QUERIES.items()] + [
+    'show me everything',
+    'employees in Pathology',
+    'lab tests above 50 in Hematology on the First Floor',
+    'Lab Manager and Lab Technician earning more than 5',
+    'employees who joined in 2020',
+    '',
+]
+
+
+def _rounded(results):
+    return [(sql, question, round(float(score), 9), tuple(params)) for sql, question, score, params in results]
+
+
+@pytest.mark.parametrize('n', [1, 3])
+def test_batch_matches_single_queries(n):
+    batch = get_top_n_sql_queries_batch(QUERIES, n=n)
+    assert len(batch) == len(QUERIES)
+    for query, results in zip(QUERIES, batch):
+        similarity._result_cache.clear()
+        assert _rounded(results) == _rounded(get_top_n_sql_queries(query, n=n)), query
+
+
+def test_batch_skips_templates_the_query_cannot_fill():
+    # Without a number, no template with a price slot can be offered
+    for sql, _, _, params in get_top_n_sql_queries_batch(['lab tests priced above'], n=5)[0]:
+        assert '?' not in sql and params == ()
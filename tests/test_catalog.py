@@ -0,0 +1,110 @@
+# tests/test_catalog.py
+"""
+Catalog editing: the store's change log and the index layered on a compiled catalog.
+"""
+import numpy as np
+import pytest
+
+from catalog import CatalogStore, catalog_key, compact, load_catalog_index, refresh
+
+SEED = {
+    'Show all departments': 'SELECT * FROM Departments;',
+    'Show all employees': 'SELECT * FROM Employees;',
+    'Count lab tests': 'SELECT COUNT(*) FROM LabTests;',
+}
+
+
+def preprocess(text):
+    return text.lower()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CatalogStore(str(tmp_path / 'catalog.db'), seed=SEED)
+    yield store
+    store.close()
+
+
+def _best(index, question):
+    scores = index.scores(index.transform([preprocess(question)]))[0]
+    row = int(np.argmax(scores))
+    return index.question(row), index.sql(row)
+
+
+def test_keys_ignore_case_and_spacing():
+    assert catalog_key('  Show   ALL departments ') == catalog_key('show all Departments')
+
+
+def test_add_update_delete_are_logged(store):
+    version, rows = store.items()
+    assert rows == list(SEED.items())
+
+    added = store.add('List rooms', 'SELECT * FROM Rooms;')
+    with pytest.raises(ValueError):
+        store.add('list  ROOMS', 'SELECT 1;')
+    updated = store.update('Show all employees', 'SELECT name FROM Employees;')
+    deleted = store.delete('Count lab tests')
+    with pytest.raises(KeyError):
+        store.delete('Count lab tests')
+    assert (added, updated, deleted) == (version + 1, version + 2, version + 3)
+
+    current, changes = store.changes_since(version)
+    assert current == deleted
+    assert changes == [
+        ('list rooms', 'List rooms', 'SELECT * FROM Rooms;'),
+        ('show all employees', 'Show all employees', 'SELECT name FROM Employees;'),
+        ('count lab tests', None, None),
+    ]
+    # An edited entry moves to the end, where the index appends it
+    assert [question for question, _ in store.items()[1]] == ['Show all departments', 'List rooms', 'Show all employees']
+
+
+def test_templates_with_mismatched_slots_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.add('Employees in {department}', 'SELECT * FROM Employees;')
+    assert len(store) == len(SEED)
+
+
+def test_seed_edits_leave_store_edits_alone(store):
+    store.update('Show all departments', 'SELECT name FROM Departments;')
+    seed = dict(SEED)
+    seed['Show all departments'] = 'SELECT id FROM Departments;'
+    seed['Count lab tests'] = 'SELECT COUNT(id) FROM LabTests;'
+    del seed['Show all employees']
+    store.sync_builtin(seed)
+    assert dict(store.items()[1]) == {
+        'Show all departments': 'SELECT name FROM Departments;',
+        'Count lab tests': 'SELECT COUNT(id) FROM LabTests;',
+    }
+
+
+def test_compaction_truncates_the_log(store, tmp_path):
+    compact(store, preprocess, str(tmp_path / 'index'))
+    version = store.version()
+    store.add('List rooms', 'SELECT * FROM Rooms;')
+    assert store.changes_since(version - 1) is None
+    assert store.changes_since(version)[1] == [('list rooms', 'List rooms', 'SELECT * FROM Rooms;')]
+
+
+def test_index_applies_changes_without_recompiling(store, tmp_path):
+    path = str(tmp_path / 'index')
+    index = load_catalog_index(store, preprocess, path)
+    assert index.pending == 0 and len(index) == len(SEED)
+
+    store.add('List rooms', 'SELECT * FROM Rooms;')
+    store.update('Show all employees', 'SELECT name FROM Employees;')
+    store.delete('Count lab tests')
+    index = refresh(index, store, preprocess, path)
+    assert index.version == store.version()
+    assert index.pending == 4 and len(index) == 3
+    assert _best(index, 'list rooms') == ('List rooms', 'SELECT * FROM Rooms;')
+    assert _best(index, 'show all employees') == ('Show all employees', 'SELECT name FROM Employees;')
+    assert max(index.scores(index.transform(['count lab tests']))[0]) < 1.0
+
+    # A second reader loading the same store gets the same view
+    other = CatalogStore(store.path)
+    reloaded = load_catalog_index(other, preprocess, path)
+    other.close()
+    assert reloaded.version == index.version
+    assert _best(reloaded, 'list rooms') == _best(index, 'list rooms')
+    assert refresh(index, store, preprocess, path) is index
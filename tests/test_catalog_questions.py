@@ -0,0 +1,84 @@
+# tests/test_catalog_questions.py
+"""
+Every catalog question, asked as written, is answered by its own SQL, and other
+phrasings of a query shape are answered by its one catalog entry.
+"""
+import pytest
+
+from precompile import get_precompiler
+from similarity import PREDEFINED_QUERIES, get_top_n_sql_queries, preprocess_question
+from templates import example, parse_template
+
+
+def _runnable(question, sql):
+    template = parse_template(question, sql)
+    return get_precompiler().is_valid(template.sql, len(template.parameters))
+
+
+@pytest.mark.parametrize('question, sql', list(PREDEFINED_QUERIES.items()))
+def test_question_returns_its_own_sql(question, sql):
+    if not _runnable(question, sql):
+        pytest.skip('SQL does not compile on lab.db, so the matcher skips it')
+    expected_sql, asked, expected_params = example(question, sql)
+    matched_sql, _, similarity, params = get_top_n_sql_queries(asked, n=1)[0]
+    assert (matched_sql, tuple(params)) == (expected_sql, expected_params)
+    assert similarity > 0.99
+
+
+# Phrasings and values that once had catalog entries of their own -> the entry now
+# answering them, and its parameters. Names missing from lab.db, such as Chicago,
+# fill the slot and return no rows.
+PHRASINGS = [
+    ('List all lab test names.', 'List all lab tests.', ()),
+    ('List all labs.', 'List all lab tests.', ()),
+    ('List all lab test names and their prices.', 'List lab test names and their prices.', ()),
+    ('List all lab tests in the Hematology department.', 'List all lab tests in {department} department.', ('Hematology',)),
+    ('Find lab tests in the Second Floor.', 'Show lab tests in departments located in {location}.', ('Second Floor',)),
+    ('Show lab tests that cost more than the average price.', 'Find lab tests with prices greater than the average price.', ()),
+    ('Find all departments and their locations.', 'List departments and their locations.', ()),
+    ('List all lab tests with a price greater than 50.', 'List lab tests with prices above {price}.', (50,)),
+    ('List employees working in the Hematology department.', 'List employees working in {department} department.', ('Hematology',)),
+    ('List all roles in the lab.', 'Show all employee roles.', ()),
+    ('Show lab tests priced between 30 and 60.', 'Find lab tests priced between {min_price} and {max_price}.', (30, 60)),
+    ('Show employees in Hematology earning above 70000.', 'List employees in {department} earning over {salary}.', ('Hematology', 70000)),
+    ('List employees who are Lab Manager and earn above 70000.', 'List employees who are {role} and earn more than {salary}.', ('Lab Manager', 70000)),
+    ('Show Lab Manager earning above 70000.', 'List employees who are {role} and earn more than {salary}.', ('Lab Manager', 70000)),
+    ('List lab tests without a specified normal range.', 'Find lab tests without a specified normal range.', ()),
+    ('Find employees who do not have a specified salary.', 'List employees who do not have a specified salary.', ()),
+    ('Find employees without an assigned department.', 'Find employees with no assigned department.', ()),
+    ('Show employees in departments offering lab tests priced between 30 and 60.', 'List employees in departments offering lab tests priced between {min_price} and {max_price}.', (30, 60)),
+    ('Find lab tests that cost more than the average salary of employees in their department.', 'Find lab tests that are more expensive than the average salary of employees in their department.', ()),
+    ('List employees who manage departments offering lab tests priced below 50.', 'List employees who manage departments offering lab tests below {price}.', (50,)),
+    ('Find the total salary paid to Lab Manager staff.', 'Find the total salary paid to {role}.', ('Lab Manager',)),
+    ('Find lab tests that are administered by both Lab Manager and Lab Technician staff.', 'Find lab tests that are administered by both {role} and {role2}.', ('Lab Manager', 'Lab Technician')),
+    ('List all Lab Manager staff along with their departments.', 'List all {role} along with their departments.', ('Lab Manager',)),
+    ('List lab tests that are not administered by Lab Manager staff.', 'List lab tests that are not administered by {role}.', ('Lab Manager',)),
+    ('What lab tests are available in Chicago?', 'Show lab tests in departments located in {location}.', ('Chicago',)),
+    ('Find lab tests in New York.', 'Show lab tests in departments located in {location}.', ('New York',)),
+    ('Show lab tests in departments located in San Francisco.', 'Show lab tests in departments located in {location}.', ('San Francisco',)),
+    ('Show employees in departments located in Chicago earning above 60000.', 'Show employees in departments located in {location} earning above {salary}.', ('Chicago', 60000)),
+    ('Show the average salary of employees in departments located in Chicago.', 'Show the average salary of employees in departments located in {location}.', ('Chicago',)),
+    ('Find lab tests in departments not located in Chicago.', 'Find lab tests in departments not located in {location}.', ('Chicago',)),
+    ('What lab tests are available in Second Floor?', 'Show lab tests in departments located in {location}.', ('Second Floor',)),
+    ('Show employees in the Second Floor department.', 'Show employees in departments located in {location}.', ('Second Floor',)),
+    ('Find lab tests that are priced between 30 and 60.', 'Find lab tests priced between {min_price} and {max_price}.', (30, 60)),
+    ('List lab tests and their prices.', 'List lab test names and their prices.', ()),
+]
+
+
+@pytest.mark.parametrize('asked, question, params', PHRASINGS)
+def test_phrasing_returns_its_entry(asked, question, params):
+    expected_sql = parse_template(question, PREDEFINED_QUERIES[question]).sql
+    matched_sql, _, _, matched_params = get_top_n_sql_queries(asked, n=1)[0]
+    assert (matched_sql, tuple(matched_params)) == (expected_sql, params)
+
+
+def test_catalog_has_one_entry_per_query_shape():
+    assert len(set(map(preprocess_question, PREDEFINED_QUERIES))) == len(PREDEFINED_QUERIES)
+    assert len(set(PREDEFINED_QUERIES.values())) == len(PREDEFINED_QUERIES)
+
+
+def test_templates_compile():
+    failing = [question for question, sql in PREDEFINED_QUERIES.items()
+               if parse_template(question, sql).slots and not _runnable(question, sql)]
+    assert failing == []
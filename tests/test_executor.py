@@ -0,0 +1,152 @@
+# tests/test_executor.py
+"""
+The executor's row cap, time budget and cancellation, on a scratch database.
+"""
+import sqlite3
+import time
+from functools import partial
+
+import pytest
+
+from executor import QueryCancelled, QueryExecutor, QueryTimeout
+from pool import ConnectionPool
+from streaming import write_csv
+
+# Never finishes on its own; only the budget or a cancel stops it
+ENDLESS = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c;'
+
+
+@pytest.fixture
+def executor(tmp_path):
+    database = str(tmp_path / 'numbers.db')
+    conn = sqlite3.connect(database)
+    conn.execute('CREATE TABLE numbers (n INTEGER);')
+    conn.executemany('INSERT INTO numbers VALUES (?);', [(n,) for n in range(100)])
+    conn.commit()
+    conn.close()
+    pool = ConnectionPool(database, size=2)
+    executor = QueryExecutor(pool, max_workers=1, heavy_after=60)
+    yield executor
+    executor.close()
+    pool.close()
+
+
+def _wait_until_running(handle):
+    deadline = time.monotonic() + 5
+    while handle.status != 'running' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert handle.status == 'running'
+
+
+def test_run_returns_columns_rows_and_truncation(executor):
+    columns, rows, truncated = executor.run('SELECT n FROM numbers WHERE n < ?;', (10,))
+    assert columns == ['n']
+    assert rows == [(n,) for n in range(10)]
+    assert truncated is False
+
+
+def test_rows_stop_at_the_cap(executor):
+    columns, rows, truncated = executor.run('SELECT n FROM numbers;', max_rows=5)
+    assert rows == [(n,) for n in range(5)]
+    assert truncated is True
+
+
+def test_exactly_the_cap_is_not_truncated(executor):
+    _, rows, truncated = executor.run('SELECT n FROM numbers;', max_rows=100)
+    assert len(rows) == 100
+    assert truncated is False
+
+
+def test_timeout(executor):
+    handle = executor.submit(ENDLESS, timeout=0.2)
+    with pytest.raises(QueryTimeout):
+        handle.result(timeout=5)
+    assert handle.status == 'timeout'
+    assert executor.stats()['timeouts'] == 1
+
+
+def test_cancel_running_query(executor):
+    handle = executor.submit(ENDLESS)
+    _wait_until_running(handle)
+    handle.cancel()
+    with pytest.raises(QueryCancelled):
+        handle.result(timeout=5)
+    assert handle.status == 'cancelled'
+    assert executor.stats()['cancelled'] == 1
+
+
+def test_cancel_queued_query(executor):
+    running = executor.submit(ENDLESS)
+    _wait_until_running(running)
+    queued = executor.submit('SELECT n FROM numbers;')
+    queued.cancel()
+    with pytest.raises(QueryCancelled):
+        queued.result(timeout=5)
+    assert queued.status == 'cancelled'
+    assert queued.started_at is None
+    running.cancel()
+    with pytest.raises(QueryCancelled):
+        running.result(timeout=5)
+
+
+def test_failed_query(executor):
+    with pytest.raises(sqlite3.OperationalError):
+        executor.run('SELECT missing FROM numbers;')
+    assert executor.stats()['failed'] == 1
+
+
+def test_heavy_queries_leave_light_workers_free(tmp_path):
+    database = str(tmp_path / 'empty.db')
+    sqlite3.connect(database).close()
+    pool = ConnectionPool(database, size=2)
+    executor = QueryExecutor(pool, max_workers=1, heavy_slots=1, heavy_after=0.05)
+    try:
+        heavy = executor.submit(ENDLESS, timeout=10)
+        waiting = executor.submit(ENDLESS, timeout=10)
+        # Both are promoted off the single light worker; one runs, one waits for a heavy worker
+        deadline = time.monotonic() + 5
+        while executor.stats()['promoted'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert {heavy.status, waiting.status} == {'running', 'waiting'}
+        light = executor.submit('SELECT 1;')
+        assert light.result(timeout=1) == (['1'], [(1,)])
+        assert light.elapsed < 0.5
+
+        # A query cancelled while it waits for a heavy worker is resolved at once
+        queued = waiting if waiting.status == 'waiting' else heavy
+        queued.cancel()
+        with pytest.raises(QueryCancelled):
+            queued.result(timeout=1)
+        assert queued.status == 'cancelled'
+        running = heavy if queued is waiting else waiting
+        running.cancel()
+        with pytest.raises(QueryCancelled):
+            running.result(timeout=5)
+    finally:
+        executor.close()
+        pool.close()
+
+
+def test_promoted_query_keeps_its_budget_and_result(executor):
+    executor.heavy_after = 0
+    slow = 'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 300000) SELECT COUNT(*) FROM c;'
+    handle = executor.submit(slow, timeout=10)
+    assert handle.result(timeout=10) == (['COUNT(*)'], [(300000,)])
+    assert handle.heavy and handle.status == 'done'
+    assert executor.stats()['promoted'] == 1
+
+    with pytest.raises(QueryTimeout):
+        executor.run(ENDLESS, timeout=0.2)
+
+
+@pytest.mark.parametrize('heavy_after', [60, 0])
+def test_write_streams_rows_within_the_cap(executor, tmp_path, heavy_after):
+    # A promoted export starts over on a heavy worker, rewriting the file from the top
+    executor.heavy_after = heavy_after
+    path = tmp_path / 'export.csv'
+    # Sorting reads every row before the first is returned, so the progress handler runs
+    sql = 'WITH RECURSIVE c(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM c WHERE n < 100000) SELECT n FROM c ORDER BY n;'
+    handle = executor.submit(sql, max_rows=40, write=partial(write_csv, str(path)))
+    assert handle.result(timeout=5) == (['n'], 40)
+    assert handle.truncated and handle.heavy == (heavy_after == 0)
+    assert path.read_text().split() == ['n'] + [str(n) for n in range(40)]
@@ -0,0 +1,59 @@
+# tests/test_pool.py
+"""
+Connection reuse and journal-mode handling of the read-only pool.
+"""
+import sqlite3
+
+import pytest
+
+from pool import ConnectionPool
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'rollback.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (x INTEGER);')
+    conn.execute('INSERT INTO t VALUES (1);')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _journal_mode(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA journal_mode;').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_pool_leaves_journal_mode_alone(database):
+    pool = ConnectionPool(database, size=1)
+    with pool.connection() as conn:
+        assert conn.execute('SELECT x FROM t;').fetchall() == [(1,)]
+    pool.close()
+    assert _journal_mode(database) == 'delete'
+
+
+def test_journal_mode_is_opt_in(database):
+    ConnectionPool(database, size=1, journal_mode='WAL').close()
+    assert _journal_mode(database) == 'wal'
+
+
+def test_connections_are_reused(database):
+    pool = ConnectionPool(database, size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats()['open'] == 1
+    pool.close()
+
+
+def test_connections_are_read_only(database):
+    pool = ConnectionPool(database, size=1)
+    with pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute('INSERT INTO t VALUES (2);')
+    pool.close()
@@ -0,0 +1,74 @@
+# tests/test_precompile.py
+"""
+Compiling catalog SQL against the live schema.
+"""
+import sqlite3
+
+import pytest
+
+from precompile import Precompiler
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'schema.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE Departments (id INTEGER PRIMARY KEY, name TEXT, location TEXT);')
+    conn.execute('CREATE TABLE Employees (id INTEGER PRIMARY KEY, name TEXT, department_id INTEGER);')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_valid_statement_has_columns_and_plan(database):
+    compiled = Precompiler(database).compile('SELECT name, location FROM Departments WHERE id = ?;', 1)
+    assert compiled.valid
+    assert compiled.columns == ['name', 'location']
+    assert compiled.plan
+
+
+def test_repeated_column_names_keep_sqlite_suffix(database):
+    compiled = Precompiler(database).compile(
+        'SELECT Employees.name, Departments.name FROM Employees '
+        'JOIN Departments ON Employees.department_id = Departments.id;')
+    assert compiled.columns == ['name', 'name:1']
+
+
+@pytest.mark.parametrize('sql, error', [
+    ('SELECT join_date FROM Employees;', 'no such column'),
+    ('SELECT name FROM Employees JOIN Departments ON Employees.department_id = Departments.id;', 'ambiguous'),
+    ('SELECT name FROM Missing;', 'no such table'),
+])
+def test_invalid_statement(database, sql, error):
+    precompiler = Precompiler(database)
+    compiled = precompiler.compile(sql)
+    assert not compiled.valid
+    assert error in compiled.error
+    assert not precompiler.is_valid(sql)
+
+
+def test_schema_change_recompiles(database):
+    precompiler = Precompiler(database, refresh_interval=0)
+    sql = 'SELECT join_date FROM Employees;'
+    assert not precompiler.is_valid(sql)
+    conn = sqlite3.connect(database)
+    conn.execute('ALTER TABLE Employees ADD COLUMN join_date TEXT;')
+    conn.commit()
+    conn.close()
+    assert precompiler.is_valid(sql)
+    assert precompiler.stats()['recompilations'] == 1
+
+
+def test_compile_catalog_binds_slots(database):
+    results = Precompiler(database).compile_catalog([
+        ('Show employees in {department}.', 'SELECT Employees.name FROM Employees JOIN Departments '
+         'ON Employees.department_id = Departments.id WHERE Departments.name = :department;'),
+        ('Show {department}.', 'SELECT name FROM Departments WHERE name = :location;'),
+    ])
+    assert [compiled.valid for _, compiled in results] == [True, False]
+
+
+def test_unreadable_database_counts_as_valid(tmp_path):
+    precompiler = Precompiler(str(tmp_path / 'missing.db'))
+    assert precompiler.compile('SELECT 1;') is None
+    assert precompiler.is_valid('SELECT nothing FROM nowhere;')
@@ -0,0 +1,93 @@
+# tests/test_replica.py
+"""
+Refreshing the in-memory replica after commits, and falling back to the file.
+"""
+import sqlite3
+
+import pytest
+
+from replica import MEMDB_AVAILABLE, ReplicaPool
+
+pytestmark = pytest.mark.skipif(not MEMDB_AVAILABLE, reason='memdb needs SQLite 3.36+')
+
+
+@pytest.fixture(params=['delete', 'wal'])
+def database(request, tmp_path):
+    path = str(tmp_path / f'{request.param}.db')
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA journal_mode={request.param};')
+    conn.execute('CREATE TABLE t (x INTEGER);')
+    conn.execute('INSERT INTO t VALUES (1);')
+    conn.commit()
+    conn.close()
+    return path
+
+
+def _write(path, value):
+    conn = sqlite3.connect(path)
+    conn.execute('INSERT INTO t VALUES (?);', (value,))
+    conn.commit()
+    conn.close()
+
+
+def _values(pool):
+    with pool.connection() as conn:
+        return [x for x, in conn.execute('SELECT x FROM t ORDER BY x;')]
+
+
+def test_reads_see_commits_only_after_refresh(database):
+    refreshed = []
+    pool = ReplicaPool(database, size=2, refresh_interval=None, on_refresh=lambda: refreshed.append(True))
+    try:
+        assert pool.stats()['replica'] == 'memory'
+        assert _values(pool) == [1]
+        assert pool.refresh() is False
+
+        _write(database, 2)
+        assert _values(pool) == [1]
+        assert pool.refresh() is True
+        assert _values(pool) == [1, 2]
+        assert pool.refresh() is False
+        assert pool.refresh(force=True) is True
+
+        stats = pool.stats()
+        assert (stats['refreshes'], stats['fallbacks'], stats['refresh_errors']) == (3, 0, 0)
+        assert stats['replica_bytes'] > 0
+        assert len(refreshed) == 3
+    finally:
+        pool.close()
+
+
+def test_borrowed_connections_are_replaced_after_refresh(database):
+    pool = ReplicaPool(database, size=1, refresh_interval=None)
+    try:
+        conn = pool.acquire()
+        _write(database, 2)
+        pool.refresh()
+        # The old snapshot stays readable until its connection comes back
+        assert conn.execute('SELECT COUNT(*) FROM t;').fetchone()[0] == 1
+        pool.release(conn)
+        assert _values(pool) == [1, 2]
+    finally:
+        pool.close()
+
+
+def test_large_database_is_served_from_disk(database):
+    pool = ReplicaPool(database, size=1, max_bytes=1, refresh_interval=None)
+    try:
+        stats = pool.stats()
+        assert (stats['replica'], stats['replica_bytes'], stats['fallbacks']) == ('disk', 0, 1)
+        _write(database, 2)
+        # Read from the file, so commits show up without waiting for a refresh
+        assert _values(pool) == [1, 2]
+    finally:
+        pool.close()
+
+
+def test_replica_is_read_only(database):
+    pool = ReplicaPool(database, size=1, refresh_interval=None)
+    try:
+        with pool.connection() as conn, pytest.raises(sqlite3.OperationalError):
+            conn.execute('INSERT INTO t VALUES (3);')
+    finally:
+        pool.close()
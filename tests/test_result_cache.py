@@ -0,0 +1,25 @@
+# tests/test_result_cache.py
+"""
+Cached matches are only served for the catalog and schema they were computed on.
+"""
+from types import SimpleNamespace
+
+from cache import MISSING
+import similarity
+
+
+def test_entries_stored_after_a_catalog_change_are_not_served():
+    index = similarity.get_index()
+    cache, before = similarity._cached_results(index)
+    key = similarity._result_key(before, 'employe', 3, 0.3)
+    # Another caller sees a new catalog and empties the cache while this one is still matching
+    _, after = similarity._cached_results(SimpleNamespace(catalog_hash=index.catalog_hash + ':edited'))
+    cache.put(key, ['stale'])
+    assert cache.get(similarity._result_key(after, 'employe', 3, 0.3)) is MISSING
+
+
+def test_matches_follow_catalog_version():
+    first = similarity.get_top_n_sql_queries('show all employees', n=1)
+    _, catalog = similarity._cached_results(similarity.get_index())
+    assert similarity._result_cache.get(similarity._result_key(catalog, similarity.preprocess('show all employees'), 1, 0.3)) is not MISSING
+    assert similarity.get_top_n_sql_queries('show all employees', n=1) == first
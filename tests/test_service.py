@@ -0,0 +1,54 @@
+# tests/test_service.py
+"""
+Request validation and pre-fork loading of the HTTP service, called without a server.
+"""
+import pytest
+
+import similarity
+from service import QueryService, ServiceError, _load_shared
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = QueryService()
+    yield service
+    service.close()
+
+
+@pytest.mark.parametrize('payload', [
+    {'page_size': -3},
+    {'page_size': 0},
+    {'page': -1},
+    {'page': '1'},
+    {'page_size': True},
+    {'page_size': 2.5},
+])
+def test_execute_rejects_bad_paging(service, payload):
+    with pytest.raises(ServiceError) as error:
+        service.execute({'sql': 'SELECT name FROM Departments;', **payload})
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize('n', [0, -1, None])
+def test_suggest_rejects_bad_n(service, n):
+    with pytest.raises(ServiceError) as error:
+        service.suggest({'query': 'show all employees', 'n': n})
+    assert error.value.status == 400
+
+
+def test_execute_pages(service):
+    first = service.execute({'sql': 'SELECT id FROM Departments ORDER BY id;', 'page_size': 2})
+    second = service.execute({'sql': 'SELECT id FROM Departments ORDER BY id;', 'page_size': 2, 'page': 1})
+    assert len(first['rows']) == 2 and first['has_more']
+    assert second['page'] == 1 and second['rows'][0][0] > first['rows'][-1][0]
+
+
+def test_suggest_returns_n_matches(service):
+    assert len(service.suggest({'query': 'show all employees', 'n': 2})['results']) == 2
+
+
+def test_loading_before_fork_leaves_no_connection_open():
+    _load_shared()
+    assert similarity._store is None and similarity._index is not None
+    # The next caller reopens the store and sees the same catalog
+    assert similarity.get_index().catalog_hash == similarity._index.catalog_hash
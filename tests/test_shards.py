@@ -0,0 +1,161 @@
+# tests/test_shards.py
+"""
+Fan-out planning and merging: lab.db split into shards by department must give
+the answers lab.db gives.
+"""
+import sqlite3
+
+import pytest
+
+import aggregates
+from db import create_schema
+from pool import DATABASE_PATH
+from shards import ShardExecutor, ShardMergeError, ShardsFailed, merge, plan, shard_paths
+
+SHARD_COUNT = 3
+
+
+@pytest.fixture(scope='module')
+def shards(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('shards')
+    paths = []
+    for number in range(SHARD_COUNT):
+        path = str(directory / f'site{number}.db')
+        conn = sqlite3.connect(path)
+        create_schema(conn.cursor())
+        conn.execute('ATTACH DATABASE ? AS source;', (DATABASE_PATH,))
+        conn.execute('INSERT INTO Departments SELECT * FROM source.Departments WHERE (id - 1) % ? = ?;',
+                     (SHARD_COUNT, number))
+        for table in ('LabTests', 'Employees'):
+            conn.execute(f'INSERT INTO {table} SELECT * FROM source.{table} '
+                         f'WHERE department_id IN (SELECT id FROM main.Departments);')
+        conn.commit()
+        conn.close()
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture(scope='module')
+def lab():
+    conn = aggregates.connect(f'file:{DATABASE_PATH}?mode=ro', uri=True)
+    yield conn
+    conn.close()
+
+
+def _shard_results(paths, merge_plan):
+    results = []
+    for path in paths:
+        conn = aggregates.connect(path)
+        cursor = conn.execute(merge_plan.shard_sql, merge_plan.shard_params)
+        results.append(([description[0] for description in cursor.description], cursor.fetchall()))
+        conn.close()
+    return results
+
+
+def _sorted(rows):
+    return sorted(rows, key=repr)
+
+
+MERGEABLE = [
+    ('SELECT * FROM Employees;', ()),
+    ('SELECT DISTINCT role FROM Employees;', ()),
+    ('SELECT name, salary FROM Employees WHERE salary > ? ORDER BY salary DESC, name;', (60000,)),
+    ('SELECT name, price FROM LabTests ORDER BY price DESC, name LIMIT 3;', ()),
+    ('SELECT name FROM Employees ORDER BY age, name LIMIT 2 OFFSET 3;', ()),
+    ('SELECT COUNT(*), SUM(salary), MIN(age), MAX(age) FROM Employees;', ()),
+    ('SELECT role, AVG(salary) AS average, COUNT(*) FROM Employees GROUP BY role;', ()),
+    ('SELECT role, COUNT(*) FROM Employees GROUP BY role HAVING COUNT(*) > ? ORDER BY role;', (1,)),
+    ('SELECT Departments.location, COUNT(LabTests.id) AS tests FROM LabTests JOIN Departments '
+     'ON LabTests.department_id = Departments.id GROUP BY Departments.location ORDER BY tests DESC, 1;', ()),
+    ('SELECT name FROM LabTests WHERE department_id = (SELECT id FROM Departments WHERE name = ?);',
+     ('Hematology',)),
+    ('SELECT AVG(price) FROM LabTests WHERE price > ?;', (1000000,)),
+]
+
+
+@pytest.mark.parametrize('sql, params', MERGEABLE)
+def test_merged_answer_matches_unsplit_database(shards, lab, sql, params):
+    merge_plan = plan(sql, params)
+    columns, rows = merge(merge_plan, _shard_results(shards, merge_plan))
+    cursor = lab.execute(sql, params)
+    expected = cursor.fetchall()
+    assert list(columns) == [description[0] for description in cursor.description]
+    if 'ORDER BY' in sql:
+        assert rows == expected
+    else:
+        assert _sorted(rows) == _sorted(expected)
+
+
+def test_avg_is_merged_from_totals_and_counts():
+    merge_plan = plan('SELECT role, AVG(salary) FROM Employees GROUP BY role;')
+    assert 'AVG' not in merge_plan.shard_sql.upper()
+    columns = ['g0', 'a0', 'a1']
+    # 1 manager earning 100 on one shard, 3 earning 500 in total on the other
+    results = [(columns, [('Lab Manager', 100.0, 1)]), (columns, [('Lab Manager', 500.0, 3)])]
+    assert merge(merge_plan, results) == (['role', 'AVG(salary)'], [('Lab Manager', 150.0)])
+
+
+def test_row_queries_are_concatenated():
+    merge_plan = plan('SELECT name FROM Employees WHERE age > ?;', (30,))
+    assert merge_plan.merge_sql is None
+    assert merge_plan.shard_params == (30,)
+    columns, rows = merge(merge_plan, [(['name'], [('a',), ('b',)]), (['name'], [('c',)])], max_rows=2)
+    assert columns == ['name']
+    assert rows == [('a',), ('b',)]
+
+
+def test_limit_is_pushed_down_with_offset():
+    merge_plan = plan('SELECT name FROM Employees ORDER BY age LIMIT 2 OFFSET 3;')
+    conn = sqlite3.connect(':memory:')
+    limit = conn.execute('SELECT ' + merge_plan.shard_sql.split(' LIMIT ', 1)[1]).fetchone()[0]
+    conn.close()
+    assert limit == 5
+    assert merge_plan.merge_sql.endswith('LIMIT 2 OFFSET 3')
+
+
+@pytest.mark.parametrize('sql', [
+    'SELECT COUNT(DISTINCT role) FROM Employees;',
+    'SELECT MEDIAN(salary) FROM Employees;',
+    'SELECT name FROM LabTests WHERE price > (SELECT AVG(price) FROM LabTests);',
+    'SELECT name FROM Employees UNION SELECT name FROM LabTests;',
+    'SELECT name, RANK() OVER (ORDER BY salary) FROM Employees;',
+])
+def test_unmergeable_statements_are_rejected(sql):
+    with pytest.raises(ShardMergeError):
+        plan(sql)
+
+
+def test_executor_fans_out_and_merges(shards, lab):
+    executor = ShardExecutor(shards, timeout=5)
+    try:
+        result = executor.run('SELECT role, SUM(salary) FROM Employees GROUP BY role ORDER BY role;')
+    finally:
+        executor.close()
+    assert result.failures == {}
+    assert result.rows == lab.execute('SELECT role, SUM(salary) FROM Employees GROUP BY role ORDER BY role;').fetchall()
+
+
+def test_failed_shard_is_reported_and_skipped(shards, tmp_path):
+    missing = str(tmp_path / 'missing.db')
+    executor = ShardExecutor(shards + [missing], timeout=5)
+    try:
+        result = executor.run('SELECT COUNT(*) FROM Departments;')
+    finally:
+        executor.close()
+    assert list(result.failures) == [missing]
+    assert result.rows == [(5,)]
+
+
+def test_no_shard_answering_raises(tmp_path):
+    executor = ShardExecutor([str(tmp_path / 'a.db'), str(tmp_path / 'b.db')], timeout=5)
+    try:
+        with pytest.raises(ShardsFailed) as raised:
+            executor.run('SELECT COUNT(*) FROM Departments;')
+    finally:
+        executor.close()
+    assert len(raised.value.failures) == 2
+
+
+def test_shard_paths_expands_globs(shards):
+    directory = shards[0].rsplit('/', 1)[0]
+    assert shard_paths(f'{directory}/site*.db, extra.db') == sorted(shards) + ['extra.db']
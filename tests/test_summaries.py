@@ -0,0 +1,86 @@
+# tests/test_summaries.py
+"""
+Summary tables kept current by their triggers, and routing catalog statements to them.
+"""
+import sqlite3
+
+import pytest
+
+import db
+from summaries import ROUTES, SummaryRouter, check_routes, check_tables, has_summary_tables
+from templates import positional_sql
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'summaries.db')
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    db.create_schema(cursor)
+    cursor.executemany('INSERT INTO Departments (name, location) VALUES (?, ?);',
+                       [('Hematology', 'Building A'), ('Radiology', 'Building B'), ('Radiology', 'Building C')])
+    cursor.executemany('INSERT INTO LabTests (name, department_id, price, normal_range) VALUES (?, ?, ?, ?);',
+                       [('CBC', 1, 25.0, ''), ('MRI', 2, 900.0, ''), ('CT', 3, 400.0, ''), ('X-ray', 2, None, '')])
+    cursor.executemany('INSERT INTO Employees (name, role, department_id, age, salary) VALUES (?, ?, ?, ?, ?);',
+                       [('Alice', 'Technician', 1, 30, 50000.0), ('Bob', 'Radiologist', 2, 45, 120000.0)])
+    db.create_summary_tables(cursor)
+    conn.commit()
+    yield path
+    conn.close()
+
+
+def _assert_current(conn):
+    assert check_tables(conn) == [(summary, True) for summary, _, _, _ in db.SUMMARY_TABLES]
+    assert all(outcome['ok'] for outcome in check_routes(conn))
+
+
+def test_triggers_follow_inserts_updates_and_deletes(database):
+    conn = sqlite3.connect(database)
+    _assert_current(conn)
+
+    conn.execute("INSERT INTO LabTests (name, department_id, price, normal_range) VALUES ('PET', 3, 1500.0, '');")
+    conn.execute("INSERT INTO Employees (name, role, department_id, age, salary) VALUES ('Cara', 'Nurse', 3, NULL, 40000.0);")
+    _assert_current(conn)
+
+    # Moving a row between departments, and clearing or setting a measured value
+    conn.execute('UPDATE LabTests SET department_id = 1 WHERE name = ?;', ('MRI',))
+    conn.execute('UPDATE LabTests SET price = NULL WHERE name = ?;', ('CBC',))
+    conn.execute('UPDATE LabTests SET price = 60.0 WHERE name = ?;', ('X-ray',))
+    conn.execute('UPDATE Employees SET salary = salary * 2, age = 31;')
+    _assert_current(conn)
+
+    # Deleting the extreme value recomputes the minimum and maximum; an emptied
+    # department loses its summary row
+    conn.execute('DELETE FROM LabTests WHERE name = ?;', ('PET',))
+    conn.execute('DELETE FROM Employees WHERE department_id = 1;')
+    _assert_current(conn)
+    assert conn.execute('SELECT COUNT(*) FROM DepartmentEmployeeSummary WHERE department_id = 1;').fetchone() == (0,)
+    conn.close()
+
+
+def test_router_uses_summaries_only_while_triggers_exist(database):
+    router = SummaryRouter(database)
+    sql, summary_sql = next(iter(ROUTES.items()))
+    # Whitespace and the trailing semicolon do not matter to the lookup
+    assert router.route('  ' + sql.rstrip(';')) == positional_sql(summary_sql)[0]
+    assert router.route('SELECT * FROM Departments;') == 'SELECT * FROM Departments;'
+    assert router.routed == 1
+
+    conn = sqlite3.connect(database)
+    db.drop_summary_triggers(conn.cursor())
+    conn.commit()
+    assert not has_summary_tables(conn)
+    conn.close()
+    assert router.route(sql) == sql
+
+
+def test_templates_route_with_positional_parameters(database):
+    router = SummaryRouter(database)
+    for sql, summary_sql in ROUTES.items():
+        if ':' in sql:
+            assert router.route(positional_sql(sql)[0]) == positional_sql(summary_sql)[0]
+
+
+def test_disabled_router_leaves_statements_alone(database):
+    sql = next(iter(ROUTES))
+    assert SummaryRouter(database, enabled=False).route(sql) == sql
@@ -0,0 +1,89 @@
+# tests/test_templates.py
+"""
+Slot parsing, value extraction and binding of parameterized catalog entries.
+"""
+import pytest
+
+from templates import bind, example, extract, parse_template, template_text
+
+
+def test_parse_template_rewrites_named_parameters():
+    template = parse_template('Show {role} earning above {salary}.',
+                              'SELECT name FROM Employees WHERE role = :role AND salary > :salary;')
+    assert template.sql == 'SELECT name FROM Employees WHERE role = ? AND salary > ?;'
+    assert template.slots == (('role', 'role'), ('salary', 'number'))
+    assert template.parameters == ('role', 'salary')
+
+
+def test_parse_template_rejects_mismatched_slots():
+    with pytest.raises(ValueError):
+        parse_template('Show {role}.', 'SELECT name FROM Employees WHERE role = :department;')
+
+
+def test_parameters_inside_string_literals_are_ignored():
+    template = parse_template('Find {role}.', "SELECT ':x' FROM Employees WHERE role = :role;")
+    assert template.parameters == ('role',)
+
+
+def test_extract_entities_and_numbers():
+    extraction = extract('Find Lab Technician staff in hematology earning above 60,000')
+    assert extraction.values == {'role': ['Lab Technician'], 'department': ['Hematology'], 'number': [60000]}
+    assert 'hematology' not in extraction.text.casefold()
+
+
+@pytest.mark.parametrize('text, values', [
+    ('What lab tests are available in Chicago?', {'location': ['Chicago']}),
+    ('Show employees in departments located in New York earning above 60000',
+     {'location': ['New York'], 'number': [60000]}),
+    ('Show lab tests in the Oncology department', {'department': ['Oncology']}),
+    # Known values keep their own type and their place in the query order
+    ('Staff in Hematology and in Chicago', {'department': ['Hematology'], 'location': ['Chicago']}),
+])
+def test_unknown_names_fill_slots(text, values):
+    assert extract(text).values == values
+
+
+@pytest.mark.parametrize('text, number', [
+    ('priced above 50.', 50),
+    ('priced above 2.5k', 2500),
+    ('at least three tests', 3),
+    ('salary above 60,000', 60000),
+    ('priced at 19.99', 19.99),
+])
+def test_numbers_fill_slots(text, number):
+    assert extract(text).values == {'number': [number]}
+
+
+@pytest.mark.parametrize('text', [
+    'employees who joined in 2020',
+    'joined between 2018 and 2020',
+    'the top 10% of all tests',
+    'a 12.5% discount',
+    'ten percent of tests',
+])
+def test_years_and_percentages_stay_in_the_text(text):
+    extraction = extract(text)
+    assert extraction.values == {}
+    assert extraction.text == text
+
+
+def test_bind_fills_slots_of_a_type_in_query_order():
+    template = parse_template('Find lab tests priced between {min_price} and {max_price}.',
+                              'SELECT name FROM LabTests WHERE price BETWEEN :min_price AND :max_price;')
+    sql, question, params = bind(template, {'number': [30, 60]})
+    assert question == 'Find lab tests priced between 30 and 60.'
+    assert params == (30, 60)
+    assert bind(template, {'number': [30]}) is None
+
+
+def test_template_text_matches_extracted_query():
+    question = 'Show employees in {department} earning above {salary}.'
+    assert template_text(question).split() == extract('Show employees in Pathology earning above 70000.').text.split()
+
+
+def test_example_uses_sample_values():
+    _, question, params = example('Show {role} in {location}.',
+                                  'SELECT name FROM Employees WHERE role = :role AND department_id IN '
+                                  '(SELECT id FROM Departments WHERE location = :location);')
+    assert question == 'Show Lab Manager in Second Floor.'
+    assert params == ('Lab Manager', 'Second Floor')
@@ -0,0 +1,33 @@
+# tests/test_tracing.py
+"""
+The metrics endpoint is started once per process, however many sessions ask for it.
+"""
+import threading
+import urllib.request
+
+import tracing
+
+
+def test_concurrent_starts_share_one_server(monkeypatch):
+    monkeypatch.setattr(tracing, '_metrics_server', None)
+    barrier = threading.Barrier(8)
+    servers = []
+
+    def start():
+        barrier.wait()
+        # Port 0 binds a fresh port each time, so a second server would show up here
+        servers.append(tracing.start_metrics_server(port=0))
+
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server = tracing._metrics_server
+    try:
+        assert len(servers) == 8 and all(started is server for started in servers)
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+            assert response.status == 200
+    finally:
+        server.shutdown()
+        server.server_close()
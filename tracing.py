@@ -0,0 +1,344 @@
+# tracing.py
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# Tracing is off unless enabled here or with tracing.enable()
+TRACING_ENABLED = os.environ.get('LAB_TRACING', '') not in ('', '0')
+# JSON-lines file receiving one record per finished trace (unset = no file)
+TRACE_PATH = os.environ.get('LAB_TRACE_PATH')
+# Port of the Prometheus text endpoint started by start_metrics_server (unset = none)
+METRICS_PORT = os.environ.get('LAB_METRICS_PORT')
+
+# Durations kept per stage for the rolling percentiles
+HISTOGRAM_WINDOW = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+_enabled = TRACING_ENABLED
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_trace_ids = itertools.count(1)
+
+
+class Span:
+    """
+    A timed stage. Attributes describe it (e.g. a similarity score), counts are also
+    summed into the process-wide counters (e.g. rows fetched).
+    """
+
+    __slots__ = ('name', 'start', 'duration', 'attributes', 'counts')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.counts = {}
+        self.start = None
+        self.duration = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def count(self, key, value=1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append(self)
+        recorder.record_span(self)
+        return False
+
+    def to_dict(self, origin):
+        return {'name': self.name, 'start_ms': (self.start - origin) * 1000,
+                'duration_ms': self.duration * 1000, **self.attributes, **self.counts}
+
+
+class _NoopSpan:
+    """Stands in for every span while tracing is disabled."""
+
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def count(self, key, value=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """The spans recorded for one request."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.id = next(_trace_ids)
+        self.attributes = attributes
+        self.spans = []
+        self.timestamp = time.time()
+        self.start = None
+        self.duration = None
+
+    def breakdown(self):
+        """
+        Returns the recorded spans as dicts in the order they finished.
+
+        :return: List of dicts with name, start_ms, duration_ms and the span's attributes.
+        """
+        return [span.to_dict(self.start) for span in self.spans]
+
+    def to_dict(self):
+        duration = self.duration if self.duration is not None else time.perf_counter() - self.start
+        return {'trace': self.name, 'id': self.id, 'timestamp': self.timestamp,
+                'duration_ms': duration * 1000, **self.attributes, 'spans': self.breakdown()}
+
+
+class Histogram:
+    """Rolling window of durations with lifetime count and sum."""
+
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.values)
+        if not ordered:
+            return {q: 0.0 for q in quantiles}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles}
+
+
+class Recorder:
+    """
+    Aggregates finished spans into per-stage histograms and counters, and writes
+    finished traces to the JSON-lines file.
+    """
+
+    def __init__(self, trace_path=TRACE_PATH):
+        self.trace_path = trace_path
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._trace_file = None
+
+    def record_span(self, span):
+        with self._lock:
+            histogram = self.histograms.get(span.name)
+            if histogram is None:
+                histogram = self.histograms[span.name] = Histogram()
+            histogram.observe(span.duration)
+            for key, value in span.counts.items():
+                self.counters[(span.name, key)] = self.counters.get((span.name, key), 0) + value
+
+    def record_trace(self, trace):
+        if not self.trace_path:
+            return
+        line = json.dumps(trace.to_dict(), default=str) + '\n'
+        with self._lock:
+            if self._trace_file is None:
+                self._trace_file = open(self.trace_path, 'a', encoding='utf-8')
+            self._trace_file.write(line)
+            self._trace_file.flush()
+
+    def stats(self):
+        """
+        Returns the rolling latency percentiles and counters of every stage.
+
+        :return: Dict mapping stage name to count, mean_ms, p50_ms, p95_ms, p99_ms and its counters.
+        """
+        with self._lock:
+            stats = {}
+            for name, histogram in self.histograms.items():
+                quantiles = histogram.quantiles()
+                stats[name] = {
+                    'count': histogram.count,
+                    'mean_ms': histogram.total / histogram.count * 1000,
+                    **{f'p{round(q * 100)}_ms': value * 1000 for q, value in quantiles.items()},
+                }
+            for (name, key), value in self.counters.items():
+                stats.setdefault(name, {})[key] = value
+            return stats
+
+    def prometheus_text(self):
+        """
+        Renders the histograms and counters in the Prometheus text exposition format.
+
+        :return: The metrics page as a string.
+        """
+        with self._lock:
+            lines = ['# TYPE lab_stage_duration_seconds summary']
+            for name, histogram in sorted(self.histograms.items()):
+                for q, value in histogram.quantiles().items():
+                    lines.append(f'lab_stage_duration_seconds{{stage="{name}",quantile="{q}"}} {value:.9f}')
+                lines.append(f'lab_stage_duration_seconds_sum{{stage="{name}"}} {histogram.total:.9f}')
+                lines.append(f'lab_stage_duration_seconds_count{{stage="{name}"}} {histogram.count}')
+            for key in sorted({key for _, key in self.counters}):
+                lines.append(f'# TYPE lab_{key}_total counter')
+                for (name, counter_key), value in sorted(self.counters.items()):
+                    if counter_key == key:
+                        lines.append(f'lab_{key}_total{{stage="{name}"}} {value}')
+            return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def close(self):
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+
+recorder = Recorder()
+
+
+def enable(trace_path=None):
+    """
+    Turns tracing on for the process.
+
+    :param trace_path: JSON-lines file to append traces to, overriding LAB_TRACE_PATH.
+    """
+    global _enabled
+    if trace_path is not None and trace_path != recorder.trace_path:
+        recorder.close()
+        recorder.trace_path = trace_path
+    _enabled = True
+
+
+def disable():
+    """Turns tracing off; recorded metrics are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def span(name, **attributes):
+    """
+    Times a stage of the current request.
+
+    While tracing is disabled this returns a shared no-op span, so instrumented code
+    costs one function call per stage.
+
+    :param name: Stage name, e.g. 'preprocess' or 'execute'.
+    :param attributes: Initial attributes of the span.
+    :return: A context manager yielding the span.
+    """
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+
+class trace:
+    """
+    Groups the spans recorded in its block into one trace, written to TRACE_PATH when
+    the block exits. Does nothing while tracing is disabled.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._trace = None
+        self._token = None
+
+    def __enter__(self):
+        if _enabled:
+            self._trace = Trace(self.name, self.attributes)
+            self._trace.start = time.perf_counter()
+            self._token = _current_trace.set(self._trace)
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._trace is not None:
+            self._trace.duration = time.perf_counter() - self._trace.start
+            _current_trace.reset(self._token)
+            recorder.record_trace(self._trace)
+        return False
+
+
+def current_trace():
+    """
+    Returns the trace of the request being handled, or None outside a trace.
+    """
+    return _current_trace.get()
+
+
+def result_size(rows):
+    """
+    Estimates the bytes held by fetched rows. Only call it while tracing is enabled,
+    since it visits every value.
+
+    :param rows: Sequence of row tuples.
+    :return: Approximate size in bytes.
+    """
+    return sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows)
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host='127.0.0.1'):
+    """
+    Serves recorder.prometheus_text() at /metrics from a background thread.
+
+    Safe to call repeatedly; the server is started once per process.
+
+    :param port: Port to listen on; does nothing if None.
+    :param host: Interface to bind.
+    :return: The running server, or None.
+    """
+    global _metrics_server
+    if port is None or _metrics_server is not None:
+        return _metrics_server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = recorder.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    # Sessions can start together; only the first may bind the port
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _metrics_server = server
+    return _metrics_server